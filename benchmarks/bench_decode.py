@@ -0,0 +1,58 @@
+"""
+Compare sequential and seeking frame decode across frame intervals.
+
+    python benchmarks/bench_decode.py [VIDEO] [--intervals 1,2,5,10,30,60,120]
+
+Without VIDEO a synthetic 1280x720 mp4v clip is generated. For each
+interval the table shows the time per sampled frame for both strategies and what
+'auto' would pick from the measured GOP length; the switch happens where the
+seek column drops below the sequential one.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from claude_vision.video_utils import iter_frames, measure_gop_length, choose_decode_strategy
+
+def make_video(path, frames=900, size=(1280, 720), fps=30):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    base = np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for i in range(frames):
+        writer.write(np.roll(base, i * 4, axis=1))
+    writer.release()
+
+def time_strategy(video_path, interval, strategy):
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_frames(video_path, interval, strategy))
+    return (time.perf_counter() - start) / max(count, 1), count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='?')
+    parser.add_argument('--intervals', default='1,2,5,10,15,30,60,120')
+    args = parser.parse_args()
+
+    video_path = args.video
+    if not video_path:
+        video_path = os.path.join(tempfile.mkdtemp(), 'bench.mp4')
+        make_video(video_path)
+
+    cap = cv2.VideoCapture(video_path)
+    gop_length = measure_gop_length(cap)
+    cap.release()
+    print(f"{video_path}: measured GOP length ~{gop_length:.1f} frames")
+    print(f"{'interval':>8} {'frames':>7} {'sequential ms':>14} {'seek ms':>9} {'faster':>11} {'auto picks':>11}")
+    for interval in (int(value) for value in args.intervals.split(',')):
+        sequential, count = time_strategy(video_path, interval, 'sequential')
+        seek, _ = time_strategy(video_path, interval, 'seek')
+        faster = 'sequential' if sequential <= seek else 'seek'
+        print(f"{interval:>8} {count:>7} {sequential * 1000:>14.2f} {seek * 1000:>9.2f} {faster:>11} {choose_decode_strategy(interval, gop_length):>11}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compare image preparation throughput across executor types and pool sizes.
+
+    python benchmarks/bench_image_prep.py [IMAGE ...] [--count 20] [--workers 1,2,4,8]
+
+Without IMAGE arguments, --count synthetic 4000x3000 photos are generated. Each row
+prepares the whole set (decode, resize, encode) through process_multiple_images with the
+image cache disabled, so the time is the pure CPU cost of getting a request ready.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from unittest.mock import patch
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from claude_vision.image_processing import process_multiple_images, configure_image_executor, IMAGE_EXECUTORS
+
+def make_images(count, size=(4000, 3000)):
+    directory = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        noise = rng.integers(0, 255, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+        path = os.path.join(directory, f'{i}.jpg')
+        Image.fromarray(noise).resize(size, Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+async def prepare(paths):
+    start = time.perf_counter()
+    await process_multiple_images(paths, client=object())
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--workers', default='1,2,4,8')
+    args = parser.parse_args()
+
+    paths = args.images or make_images(args.count)
+    print(f"{len(paths)} images, {os.cpu_count()} CPUs")
+    print(f"{'executor':>8} {'workers':>7} {'total s':>8} {'ms/image':>9}")
+    with patch('claude_vision.image_processing.image_cache_key', return_value=None):
+        for kind in IMAGE_EXECUTORS:
+            for workers in (int(value) for value in args.workers.split(',')):
+                configure_image_executor(kind=kind, workers=workers)
+                elapsed = asyncio.run(prepare(paths))
+                print(f"{kind:>8} {workers:>7} {elapsed:>8.2f} {elapsed / len(paths) * 1000:>9.1f}")
+
+if __name__ == '__main__':
+    main()
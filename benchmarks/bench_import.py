@@ -0,0 +1,68 @@
+"""
+Measure CLI import time and fail if it regresses.
+
+    python benchmarks/bench_import.py [--runs 5] [--max-ms 250]
+
+Each run imports claude_vision.cli in a fresh interpreter under `python -X importtime`
+and reports the cumulative import time of the package, the median across runs and the
+slowest third-party modules it pulled in. Exits non-zero if the median exceeds --max-ms
+or if a module that only some commands need was imported: OpenCV and numpy (video),
+jsonschema (JSON input), Pillow and httpx (anything that reads images or calls the API).
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULE = 'claude_vision.cli'
+FORBIDDEN = ('cv2', 'numpy', 'jsonschema', 'PIL', 'httpx')
+
+def import_times(module=MODULE):
+    """
+    Import module in a fresh interpreter and return {module name: cumulative microseconds}.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=250.0)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    totals = [times[MODULE] / 1000 for times in runs]
+    median = statistics.median(totals)
+    print(f"import {MODULE}: median {median:.1f} ms over {args.runs} runs (min {min(totals):.1f}, max {max(totals):.1f})")
+
+    last = runs[-1]
+    top_level = sorted(
+        ((name, value) for name, value in last.items() if '.' not in name and name not in (MODULE, 'site')),
+        key=lambda item: item[1], reverse=True
+    )
+    for name, value in top_level[:args.top]:
+        print(f"  {name:<24} {value / 1000:>7.1f} ms")
+
+    failures = [f"{name} was imported" for name in FORBIDDEN if name in last]
+    if median > args.max_ms:
+        failures.append(f"median import time {median:.1f} ms exceeds {args.max_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
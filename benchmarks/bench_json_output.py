@@ -0,0 +1,69 @@
+"""
+Measure the per-frame cost of formatting, validating and serializing video JSON output.
+
+    python benchmarks/bench_json_output.py [--frames 100,1000,10000] [--runs 3]
+
+Each row formats --frames synthetic frame results (each a small JSON object, as the API
+returns for --output json) into a video document and serializes it. 'per-document' is
+the old path: jsonschema.validate on the whole document, then json.dumps. 'per-frame'
+validates each frame with a precompiled validator as it is formatted, then serializes
+with each available backend. The best of --runs is reported.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import jsonschema
+from claude_vision.json_utils import format_video_json_output, dumps, json_backend, VIDEO_OUTPUT_SCHEMA, JSON_BACKENDS
+
+METADATA = {'fps': 30.0, 'frame_count': 0, 'duration': 0.0, 'width': 1920, 'height': 1080}
+
+def make_frames(count):
+    result = json.dumps({
+        'description': 'A harbour at dusk with several fishing boats moored along the quay.',
+        'objects': [{'label': 'boat', 'confidence': 0.93}, {'label': 'gull', 'confidence': 0.71}],
+        'scene': 'outdoor',
+    })
+    return [{'frame_number': i * 30, 'timestamp': float(i), 'result': result} for i in range(count)]
+
+def per_document(frames):
+    output = {
+        'video_metadata': METADATA,
+        'frame_results': [{**frame, 'result': json.loads(frame['result'])} for frame in frames],
+        'analysis_type': 'video_description',
+    }
+    jsonschema.validate(instance=output, schema=VIDEO_OUTPUT_SCHEMA)
+    return json.dumps(output, indent=2, ensure_ascii=False)
+
+def per_frame(frames, backend):
+    return dumps(format_video_json_output(METADATA, frames, 'video_description'), indent=2, backend=backend)
+
+def best_of(runs, function, *args):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', default='100,1000,10000')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    backends = [backend for backend in JSON_BACKENDS if json_backend(backend) == backend]
+    print(f"{'frames':>7} {'path':>20} {'total ms':>9} {'us/frame':>9}")
+    for count in (int(value) for value in args.frames.split(',')):
+        frames = make_frames(count)
+        rows = [('per-document', best_of(args.runs, per_document, frames))]
+        rows += [(f'per-frame+{backend}', best_of(args.runs, per_frame, frames, backend)) for backend in backends]
+        for name, elapsed in rows:
+            print(f"{count:>7} {name:>20} {elapsed * 1000:>9.1f} {elapsed / count * 1e6:>9.1f}")
+
+if __name__ == '__main__':
+    main()
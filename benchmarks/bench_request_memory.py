@@ -0,0 +1,108 @@
+"""
+Measure the peak memory one multi-image request adds on top of its already-encoded images.
+
+    python benchmarks/bench_request_memory.py [--images 20] [--size 1200x900]
+
+Encodes --images noise PNGs once, then for each mode starts a fresh interpreter that loads
+their base64 strings, resets its RSS high-water mark and sends one request with all of them
+to a local MockAnthropicServer. 'json' is the old path: the request dict handed to httpx
+with json=, which serializes the whole payload to a string and then to bytes. 'streamed'
+is claude_vision_analysis, which writes the body from the base64 strings a slice at a time.
+'streamed+cache' also computes the response cache key, which hashes the images the same way.
+
+Peak is the rise in VmHWM over the RSS with the images loaded, so it's the request's own
+overhead; the ratio is that overhead over the payload size. Linux only.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+MODES = ('json', 'streamed', 'streamed+cache')
+
+def make_images(directory, count, size):
+    import numpy as np
+    from PIL import Image
+    from claude_vision.image_processing import convert_image_to_base64
+    rng = np.random.default_rng(0)
+    # Noise barely compresses, so each PNG is close to the per-image size limit
+    noise = Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8))
+    base64_image = convert_image_to_base64(noise, 'png')
+    for i in range(count):
+        # Reverse every other payload after its header so the images are distinct strings
+        with open(os.path.join(directory, f'image-{i}.b64'), 'w') as f:
+            f.write(base64_image[:64] + base64_image[64:][::-1] if i % 2 else base64_image)
+    return len(base64_image) * count
+
+def memory_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise RuntimeError(f"No {field} in /proc/self/status")
+
+def reset_peak():
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+async def run_mode(mode, directory):
+    from claude_vision.claude_integration import claude_vision_analysis, build_request, ANTHROPIC_API_URL
+    from claude_vision.http_client import get_client, close_client
+
+    images = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name)) as f:
+            images.append(f.read())
+    client = get_client()
+    # Warm up the connection and imports so they don't count towards the request
+    await claude_vision_analysis([], "Describe.", 'text', client=client)
+
+    baseline = memory_kb('VmRSS')
+    reset_peak()
+    if mode == 'json':
+        headers, data = build_request(images, "Describe these images.", 'text')
+        response = await client.post(ANTHROPIC_API_URL, headers=headers, json=data, timeout=180.0)
+        response.raise_for_status()
+    else:
+        await claude_vision_analysis(images, "Describe these images.", 'text', client=client, use_cache=mode == 'streamed+cache')
+    peak = memory_kb('VmHWM')
+    await close_client()
+    return {'peak_overhead_mb': round((peak - baseline) / 1024, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--size', default='1200x900', help="Width x height of each noise image")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--fixtures', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(asyncio.run(run_mode(args.run, args.fixtures))))
+        return
+
+    from claude_vision.mock_server import MockAnthropicServer
+    directory = tempfile.mkdtemp()
+    width, height = (int(value) for value in args.size.split('x'))
+    payload = make_images(directory, args.images, (width, height))
+    print(f"{args.images} images, {payload / 2**20:.1f} MB of base64 per request")
+    print(f"{'mode':>15} {'peak MB':>8} {'x payload':>9}")
+    with MockAnthropicServer() as server:
+        for mode in MODES:
+            # A fresh HOME keeps the response cache from answering without a request
+            env = dict(os.environ, ANTHROPIC_API_URL=server.url, ANTHROPIC_API_KEY='mock', HOME=tempfile.mkdtemp())
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', mode, '--fixtures', directory],
+                env=env, capture_output=True, text=True, check=True, cwd=tempfile.gettempdir()
+            )
+            overhead = json.loads(result.stdout.strip().splitlines()[-1])['peak_overhead_mb']
+            print(f"{mode:>15} {overhead:>8.2f} {overhead * 2**20 / payload:>9.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+End-to-end throughput benchmarks against the local mock Messages API.
+
+    python benchmarks/bench_throughput.py [--workloads single,group,video,batch]
+        [--latency 0.2] [--token-delay 0.01] [--error-rate 0.0]
+        [--save-baseline] [--check] [--tolerance 0.25]
+
+Starts a MockAnthropicServer and runs each workload in a fresh interpreter pointed at it
+with ANTHROPIC_API_URL, so nothing is billed and peak RSS is per workload:
+
+    single  10 one-image requests, one after another, streamed
+    group   3 requests of 20 images each, streamed
+    video   a 300-frame synthetic video sampled every 10th frame (30 requests)
+    batch   a 40-entry manifest run with concurrency 8
+
+Reports requests/s (HTTP requests, retries included), p50/p95 request latency,
+time-to-first-token for streamed workloads and peak RSS. --save-baseline stores the results
+in benchmarks/baselines/throughput.json; --check compares against it and exits non-zero
+if any metric is more than --tolerance worse.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'throughput.json')
+WORKLOADS = ('single', 'group', 'video', 'batch')
+# Metrics where a larger value is a regression; requests_per_s is the other way round
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'ttft_ms', 'peak_rss_mb')
+
+def make_fixtures(directory):
+    import cv2
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(20):
+        noise = rng.integers(0, 255, (150, 200, 3), dtype=np.uint8)
+        path = os.path.join(directory, f'image-{i}.jpg')
+        Image.fromarray(noise).resize((1600, 1200), Image.BILINEAR).save(path, quality=90)
+        images.append(path)
+    video = os.path.join(directory, 'video.avi')
+    writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), 30.0, (640, 360))
+    for i in range(300):
+        writer.write(np.full((360, 640, 3), i % 256, dtype=np.uint8))
+    writer.release()
+    with open(os.path.join(directory, 'manifest.jsonl'), 'w') as f:
+        for i in range(40):
+            f.write(json.dumps({'id': i, 'files': images[i % len(images)], 'prompt': f"Describe image {i}."}) + "\n")
+
+def peak_rss_kb():
+    # ru_maxrss can carry over a high-water mark from before exec, so prefer this process's own
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Kilobytes on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 if sys.platform == 'darwin' else maxrss
+
+async def run_workload(name, directory):
+    from claude_vision.http_client import get_client, close_client
+    from claude_vision.image_processing import process_multiple_images
+    from claude_vision.claude_integration import claude_vision_analysis
+
+    images = sorted(os.path.join(directory, file) for file in os.listdir(directory) if file.endswith('.jpg'))
+    latencies, first_tokens = [], []
+    client = get_client()
+    send = client.send
+
+    async def timed_send(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await send(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    client.send = timed_send
+
+    async def streamed(sources, runs):
+        for _ in range(runs):
+            start = time.perf_counter()
+            base64_images = await process_multiple_images(sources, process_as_group=len(sources) > 1)
+            chunks = await claude_vision_analysis(base64_images, "Describe these images.", 'text', stream=True)
+            first = True
+            async for _ in chunks:
+                if first:
+                    first_tokens.append(time.perf_counter() - start)
+                    first = False
+
+    start = time.perf_counter()
+    try:
+        if name == 'single':
+            await streamed(images[:1], 10)
+        elif name == 'group':
+            await streamed(images, 3)
+        elif name == 'video':
+            from claude_vision.video_processing import analyze_video
+            await analyze_video(os.path.join(directory, 'video.avi'), 10, None, 'text', False)
+        elif name == 'batch':
+            from claude_vision.batch import run_batch
+            await run_batch(os.path.join(directory, 'manifest.jsonl'), os.path.join(tempfile.mkdtemp(), 'results.jsonl'), 8)
+        else:
+            raise ValueError(f"Unknown workload {name!r}")
+    finally:
+        elapsed = time.perf_counter() - start
+        await close_client()
+
+    def percentile(values, fraction):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(fraction * len(values)))] * 1000 if values else None
+
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'requests_per_s': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5), 1),
+        'p95_ms': round(percentile(latencies, 0.95), 1),
+        'ttft_ms': round(statistics.median(first_tokens) * 1000, 1) if first_tokens else None,
+        'peak_rss_mb': round(peak_rss_kb() / 1024, 1),
+    }
+
+def run_in_subprocess(name, directory, url):
+    # A fresh HOME keeps the image and response caches (and any user config) out of the numbers
+    env = dict(os.environ, ANTHROPIC_API_URL=url, ANTHROPIC_API_KEY='mock', HOME=tempfile.mkdtemp())
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run', name, '--fixtures', directory],
+        env=env, capture_output=True, text=True, check=True, cwd=tempfile.gettempdir()
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def compare(results, baseline, tolerance):
+    failures = []
+    for name, metrics in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for metric, value in metrics.items():
+            reference = expected.get(metric)
+            if value is None or not reference:
+                continue
+            if metric == 'requests_per_s' and value < reference * (1 - tolerance):
+                failures.append(f"{name} {metric} {value} < baseline {reference}")
+            elif metric in LOWER_IS_BETTER and value > reference * (1 + tolerance):
+                failures.append(f"{name} {metric} {value} > baseline {reference}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 429 or 529")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--fixtures', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(asyncio.run(run_workload(args.run, args.fixtures))))
+        return
+
+    from claude_vision.mock_server import MockAnthropicServer
+    settings = {'latency': args.latency, 'token_delay': args.token_delay, 'error_rate': args.error_rate}
+    directory = tempfile.mkdtemp()
+    make_fixtures(directory)
+    results = {}
+    with MockAnthropicServer(
+        latency=args.latency, token_delay=args.token_delay,
+        rate_limit_rate=args.error_rate / 2, overload_rate=args.error_rate / 2, seed=0
+    ) as server:
+        print(f"{'workload':>8} {'requests':>8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'ttft ms':>8} {'rss MB':>7}")
+        for name in args.workloads.split(','):
+            metrics = results[name] = run_in_subprocess(name, directory, server.url)
+            ttft = f"{metrics['ttft_ms']:>8.1f}" if metrics['ttft_ms'] is not None else f"{'-':>8}"
+            print(f"{name:>8} {metrics['requests']:>8} {metrics['requests_per_s']:>7.2f} {metrics['p50_ms']:>8.1f} {metrics['p95_ms']:>8.1f} {ttft} {metrics['peak_rss_mb']:>7.1f}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'settings': settings, 'workloads': results}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {BASELINE_PATH}")
+
+    if args.check:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print(f"FAIL: baseline was recorded with {baseline['settings']}, not {settings}")
+            sys.exit(1)
+        failures = compare(results, baseline['workloads'], args.tolerance)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,46 @@
-from .image_processing import (
-    convert_image_to_base64,
-    check_and_resize_image,
-    estimate_image_tokens,
-    process_image_source,
-    process_multiple_images
-)
-from .claude_integration import claude_vision_analysis
-from .exceptions import (
-    AnthropicError,
-    InvalidRequestError,
-    AuthenticationError,
-    PermissionError,
-    NotFoundError,
-    RateLimitError,
-    APIError,
-    OverloadedError
-)
-from .config import (
-    ANTHROPIC_API_KEY,
-    DEFAULT_PROMPT,
-    MAX_IMAGE_SIZE,
-    SUPPORTED_FORMATS,
-    DEFAULT_PERSONAS,
-    DEFAULT_STYLES
-)
-from .advanced_features import (
-    visual_judge,
-    image_evolution_analyzer,
-    persona_based_analysis,
-    comparative_time_series_analysis,
-    generate_alt_text
-)
-from .utils import logger
+import importlib
+
+# Submodules are imported on first attribute access, so `import claude_vision` (and the CLI,
+# which imports it as a side effect) doesn't pay for Pillow, httpx or OpenCV up front.
+_LAZY_ATTRIBUTES = {
+    'convert_image_to_base64': '.image_processing',
+    'check_and_resize_image': '.image_processing',
+    'estimate_image_tokens': '.image_processing',
+    'process_image_source': '.image_processing',
+    'process_multiple_images': '.image_processing',
+    'claude_vision_analysis': '.claude_integration',
+    'AnthropicError': '.exceptions',
+    'InvalidRequestError': '.exceptions',
+    'AuthenticationError': '.exceptions',
+    'PermissionError': '.exceptions',
+    'NotFoundError': '.exceptions',
+    'RateLimitError': '.exceptions',
+    'APIError': '.exceptions',
+    'OverloadedError': '.exceptions',
+    'ANTHROPIC_API_KEY': '.config',
+    'DEFAULT_PROMPT': '.config',
+    'MAX_IMAGE_SIZE': '.config',
+    'SUPPORTED_FORMATS': '.config',
+    'DEFAULT_PERSONAS': '.config',
+    'DEFAULT_STYLES': '.config',
+    'visual_judge': '.advanced_features',
+    'image_evolution_analyzer': '.advanced_features',
+    'persona_based_analysis': '.advanced_features',
+    'comparative_time_series_analysis': '.advanced_features',
+    'generate_alt_text': '.advanced_features',
+    'logger': '.utils',
+}
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
 
 __all__ = [
     'convert_image_to_base64',
@@ -60,4 +69,4 @@ __all__ = [
     'comparative_time_series_analysis',
     'generate_alt_text',
     'logger'
-]
\ No newline at end of file
+]
@@ -1,8 +1,9 @@
 from .claude_integration import claude_vision_analysis
 from .config import DEFAULT_PERSONAS, DEFAULT_STYLES
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
+import httpx
 
-async def visual_judge(base64_images: List[str], criteria: List[str], weights: List[float], output_type: str, stream: bool, user_prompt: str = None) -> AsyncGenerator[str, None]:
+async def visual_judge(base64_images: List[str], criteria: List[str], weights: List[float], output_type: str, stream: bool, user_prompt: str = None, client: Optional[httpx.AsyncClient] = None) -> AsyncGenerator[str, None]:
     """
     Judge and rank multiple images based on user-defined criteria and weights.
     """
@@ -13,10 +14,10 @@ async def visual_judge(base64_images: List[str], criteria: List[str], weights: L
     if user_prompt:
         prompt += f"<USER_PROMPT>{user_prompt}</USER_PROMPT>"
         
-    result = await claude_vision_analysis(base64_images, prompt, output_type, stream)
+    result = await claude_vision_analysis(base64_images, prompt, output_type, stream, client=client)
     return result
 
-async def image_evolution_analyzer(base64_images: List[str], time_points: List[str], output_type: str, stream: bool, user_prompt: str = None) -> AsyncGenerator[str, None]:
+async def image_evolution_analyzer(base64_images: List[str], time_points: List[str], output_type: str, stream: bool, user_prompt: str = None, client: Optional[httpx.AsyncClient] = None) -> AsyncGenerator[str, None]:
     """
     Analyze a series of images to describe changes over time.
     """
@@ -26,11 +27,11 @@ async def image_evolution_analyzer(base64_images: List[str], time_points: List[s
     if user_prompt:
         prompt += f"<USER_PROMPT>{user_prompt}</USER_PROMPT>"
 
-    result = await claude_vision_analysis(base64_images, prompt, output_type, stream)
+    result = await claude_vision_analysis(base64_images, prompt, output_type, stream, client=client)
     return result
 
 
-async def comparative_time_series_analysis(base64_images: List[str], time_points: List[str], metrics: List[str], output_type: str, stream: bool, user_prompt: str = None) -> AsyncGenerator[str, None]:
+async def comparative_time_series_analysis(base64_images: List[str], time_points: List[str], metrics: List[str], output_type: str, stream: bool, user_prompt: str = None, client: Optional[httpx.AsyncClient] = None) -> AsyncGenerator[str, None]:
     """
     Analyze multiple images to identify trends, anomalies, or patterns across a dataset with a temporal dimension.
     """
@@ -41,12 +42,15 @@ async def comparative_time_series_analysis(base64_images: List[str], time_points
     if user_prompt:
         prompt += f"<USER_NOTE>{user_prompt}</USER_NOTE>"
         
-    result = await claude_vision_analysis(base64_images, prompt, output_type, stream)
+    result = await claude_vision_analysis(base64_images, prompt, output_type, stream, client=client)
     return result
 
-async def persona_based_analysis(base64_image: str, persona: str, output_type: str, stream: bool, user_prompt: str = None) -> AsyncGenerator[str, None]:
+async def persona_based_analysis(base64_image: str, persona: str, output_type: str, stream: bool, user_prompt: str = None, client: Optional[httpx.AsyncClient] = None, prompt_cache: bool = False) -> AsyncGenerator[str, None]:
     """
     Analyze an image using a specified professional persona.
+
+    With prompt_cache, the persona follows the image in the message instead of being the system
+    prompt, so analyzing one image with several personas sends it as a shared cached prefix.
     """
     system = f"{DEFAULT_PERSONAS.get(persona, '')}"
     
@@ -54,10 +58,13 @@ async def persona_based_analysis(base64_image: str, persona: str, output_type: s
     if user_prompt:
         prompt += f"<USER_PROMPT>{user_prompt}</USER_PROMPT>"
 
-    result = await claude_vision_analysis([base64_image], prompt, output_type, stream, system=system)
+    if prompt_cache:
+        result = await claude_vision_analysis([base64_image], f"{system}\n\n{prompt}", output_type, stream, client=client, prompt_cache=True, cached_images=1)
+    else:
+        result = await claude_vision_analysis([base64_image], prompt, output_type, stream, system=system, client=client)
     return result
 
-async def generate_alt_text(base64_image: str, output_type: str, stream: bool, user_prompt: str = None) -> AsyncGenerator[str, None]:
+async def generate_alt_text(base64_image: str, output_type: str, stream: bool, user_prompt: str = None, client: Optional[httpx.AsyncClient] = None) -> AsyncGenerator[str, None]:
     """
     Generate detailed, context-aware alt-text for an image.
     """
@@ -66,5 +73,5 @@ async def generate_alt_text(base64_image: str, output_type: str, stream: bool, u
     if user_prompt:
         prompt += f"<USER_NOTE>{user_prompt}</USER_NOTE>"
 
-    result = await claude_vision_analysis([base64_image], prompt, output_type, stream)
+    result = await claude_vision_analysis([base64_image], prompt, output_type, stream, client=client)
     return result
\ No newline at end of file
@@ -0,0 +1,168 @@
+import os
+import json
+import asyncio
+import collections
+from typing import List, Dict, Any, Set, Optional, Tuple
+from .image_processing import process_multiple_images
+from .claude_integration import claude_vision_analysis
+from .json_utils import format_json_output, dumps
+from .metrics import span, count
+from .utils import logger, generate_prompt
+from .config import BATCH_CONCURRENCY
+
+DEFAULT_CONCURRENCY = BATCH_CONCURRENCY
+
+def load_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """
+    Read a JSONL manifest with one analysis request per line.
+
+    Each line is an object with "files" (a path or list of paths) and optional "id",
+    "prompt", "system", "output", "persona", "prefill" and "max_tokens" fields.
+    Entries without an id are identified by their line number.
+    """
+    entries = []
+    seen_ids = set()
+    with open(manifest_path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on manifest line {line_number}: {e}")
+            if not isinstance(entry, dict) or not entry.get('files'):
+                raise ValueError(f"Manifest line {line_number} must be an object with a 'files' field")
+            if isinstance(entry['files'], str):
+                entry['files'] = [entry['files']]
+            entry.setdefault('id', line_number)
+            if entry['id'] in seen_ids:
+                raise ValueError(f"Duplicate id {entry['id']!r} on manifest line {line_number}")
+            seen_ids.add(entry['id'])
+            entries.append(entry)
+    return entries
+
+def completed_ids(output_path: str) -> Set[Any]:
+    """
+    Return the ids that already have a successful result in the output file.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if isinstance(record, dict) and 'result' in record:
+                done.add(record.get('id'))
+    return done
+
+def entry_prompt(entry: Dict[str, Any]) -> str:
+    return entry.get('prompt') or generate_prompt(entry.get('persona'), num_images=len(entry['files']))
+
+def entry_context(entry: Dict[str, Any]) -> tuple:
+    """
+    What decides an entry's system prompt, which comes before everything it can cache.
+    """
+    return entry.get('system'), entry.get('output', 'text')
+
+def cache_keys(entry: Dict[str, Any], shared_prompts: Set[tuple] = frozenset()) -> Tuple[tuple, tuple]:
+    """
+    The keys under which an entry's prompt and images would match another entry's cached
+    prefix: a cached block only matches if everything before it matches too, so the images'
+    key includes the system prompt and the prompt prefix sent ahead of them, if any.
+    """
+    prompt_key = (entry_context(entry), entry_prompt(entry))
+    prefix = entry_prompt(entry) if prompt_key in shared_prompts else None
+    return prompt_key, (entry_context(entry), prefix, tuple(entry['files']))
+
+def prompt_cache_hints(entry: Dict[str, Any], shared_prompts: Set[tuple], shared_files: Set[tuple]) -> Dict[str, Any]:
+    """
+    Cache breakpoints for an entry: its prompt if another entry with the same system prompt
+    uses the same one, and its images if another entry sends the same files after the same
+    system prompt and prompt prefix. Unshared content isn't marked, since cache writes cost
+    more than plain input tokens.
+    """
+    hints = {}
+    prompt_key, files_key = cache_keys(entry, shared_prompts)
+    if prompt_key in shared_prompts:
+        hints['prompt_prefix'] = entry_prompt(entry)
+    if files_key in shared_files:
+        hints['cached_images'] = len(entry['files'])
+    return hints
+
+async def analyze_entry(entry: Dict[str, Any], cached_images: int = 0, prompt_prefix: Optional[str] = None, **analysis_options) -> Any:
+    output = entry.get('output', 'text')
+    if output == 'markdown':
+        output = 'md'
+    base64_images = await process_multiple_images(entry['files'])
+    prompt = entry_prompt(entry)
+    if prompt_prefix == prompt:
+        prompt = None
+    request = claude_vision_analysis(
+        base64_images, prompt, output,
+        system=entry.get('system'),
+        max_tokens=entry.get('max_tokens', 1000),
+        prefill=entry.get('prefill'),
+        cached_images=cached_images,
+        prompt_prefix=prompt_prefix,
+        **analysis_options
+    )
+    # Only the request holds the images, so a batch-api request can drop them once it's queued
+    del base64_images
+    result = await request
+    if output == 'json':
+        return format_json_output(result, "description")['result']
+    return result
+
+async def run_batch(manifest_path: str, output_path: str, concurrency: int = DEFAULT_CONCURRENCY, limit: Optional[int] = None, **analysis_options) -> Dict[str, int]:
+    """
+    Run every manifest entry not yet in output_path, at most `concurrency` at a time.
+    With `limit`, only the first `limit` pending entries are run; the rest are left for a later run.
+
+    Results are appended to output_path as JSONL in completion order, one
+    {"id", "result"} or {"id", "error"} object per entry. Failed entries are
+    retried on the next run; successful ones are skipped.
+
+    With prompt_cache, images and prompts that several pending entries share are sent as
+    cache breakpoints.
+    """
+    entries = load_manifest(manifest_path)
+    done = completed_ids(output_path)
+    pending = [entry for entry in entries if entry['id'] not in done]
+    summary = {'total': len(entries), 'skipped': len(entries) - len(pending), 'succeeded': 0, 'failed': 0}
+    logger.info(f"Batch {manifest_path}: {len(pending)} pending, {summary['skipped']} already done")
+    if limit is not None and limit < len(pending):
+        logger.info(f"Running only the first {limit} pending entries")
+        pending = pending[:limit]
+
+    shared_prompts, shared_files = set(), set()
+    if analysis_options.get('prompt_cache'):
+        prompt_counts = collections.Counter(cache_keys(entry)[0] for entry in pending)
+        shared_prompts = {key for key, uses in prompt_counts.items() if uses > 1}
+        file_counts = collections.Counter(cache_keys(entry, shared_prompts)[1] for entry in pending)
+        shared_files = {key for key, uses in file_counts.items() if uses > 1}
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with open(output_path, 'a') as out:
+        async def run_entry(entry):
+            async with semaphore:
+                try:
+                    record = {"id": entry['id'], "result": await analyze_entry(entry, **prompt_cache_hints(entry, shared_prompts, shared_files), **analysis_options)}
+                    summary['succeeded'] += 1
+                except Exception as e:
+                    logger.error(f"Batch entry {entry['id']!r} failed: {e}")
+                    record = {"id": entry['id'], "error": str(e)}
+                    summary['failed'] += 1
+            count('batch_entries_failed' if 'error' in record else 'batch_entries_succeeded')
+            with span('output.write'):
+                out.write(dumps(record) + "\n")
+                out.flush()
+
+        await asyncio.gather(*(run_entry(entry) for entry in pending))
+
+    return summary
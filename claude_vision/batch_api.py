@@ -0,0 +1,309 @@
+import json
+import time
+import asyncio
+import tempfile
+import itertools
+import httpx
+from typing import Dict, Any, List, Optional, Tuple, Union, AsyncIterator
+from .config import (
+    ANTHROPIC_API_KEY, ANTHROPIC_API_URL, BATCH_API_MAX_REQUESTS, BATCH_API_MAX_BYTES,
+    BATCH_API_LINGER, BATCH_API_POLL_INTERVAL, BATCH_API_MAX_POLL_INTERVAL
+)
+from .http_client import get_client
+from .rate_limit import get_scheduler
+from .json_utils import JSONBody
+from .metrics import count, record
+from .utils import logger
+from .exceptions import (
+    InvalidRequestError, AuthenticationError, PermissionError,
+    NotFoundError, RateLimitError, APIError, OverloadedError
+)
+
+# Per-request errors in batch results, by their error type
+ERROR_TYPES = {
+    'invalid_request_error': InvalidRequestError,
+    'authentication_error': AuthenticationError,
+    'permission_error': PermissionError,
+    'not_found_error': NotFoundError,
+    'rate_limit_error': RateLimitError,
+    'overloaded_error': OverloadedError,
+}
+
+def batches_url() -> str:
+    """
+    The Message Batches endpoint that sits next to the configured Messages endpoint.
+    """
+    return ANTHROPIC_API_URL.rstrip('/') + '/batches'
+
+def api_headers(beta: Optional[str] = None) -> Dict[str, str]:
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": ANTHROPIC_API_KEY,
+        "anthropic-version": "2023-06-01"
+    }
+    if beta:
+        headers["anthropic-beta"] = beta
+    return headers
+
+def result_error(custom_id: str, result: Dict[str, Any]) -> Exception:
+    """
+    The exception for a batch result that didn't succeed: errored, canceled or expired.
+    """
+    if result.get('type') == 'errored':
+        error = result.get('error', {})
+        # Errors come wrapped as {"type": "error", "error": {"type": ..., "message": ...}}
+        error = error.get('error', error)
+        return ERROR_TYPES.get(error.get('type'), APIError)(error.get('message', f"Batch request {custom_id} failed"))
+    return APIError(f"Batch request {custom_id} {result.get('type', 'failed')}")
+
+async def _call(method: str, url: str, client: httpx.AsyncClient, **kwargs) -> httpx.Response:
+    async def send():
+        count('requests')
+        response = await client.request(method, url, timeout=180.0, **kwargs)
+        response.raise_for_status()
+        return response
+    try:
+        return await get_scheduler().run(send)
+    except httpx.HTTPStatusError as e:
+        raise APIError(f"Message Batches API {method} {url} failed: {e.response.status_code} {e.response.text}")
+    except httpx.RequestError as e:
+        raise APIError(f"Request error: {str(e)}")
+
+class RequestSpool:
+    """
+    Batch requests serialized to a temporary file as they are queued, so a submission that is
+    still filling up holds none of its images in memory. It reads back, as many times as the
+    upload is retried, as the {"requests": [...]} body of the submission.
+    """
+
+    OPEN = b'{"requests":['
+    CLOSE = b']}'
+    READ_BYTES = 1024 * 1024
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.length = len(self.OPEN) + len(self.CLOSE)
+        self.count = 0
+
+    def add(self, request: JSONBody) -> None:
+        if self.count:
+            self.file.write(b',')
+            self.length += 1
+        for chunk in request.chunks():
+            self.file.write(chunk)
+        self.length += len(request)
+        self.count += 1
+
+    def __len__(self):
+        return self.length
+
+    async def __aiter__(self):
+        yield self.OPEN
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(self.READ_BYTES)
+            if not chunk:
+                break
+            yield chunk
+        yield self.CLOSE
+
+    def close(self) -> None:
+        self.file.close()
+
+async def create_batch(requests: Union[List[Dict[str, Any]], RequestSpool], client: Optional[httpx.AsyncClient] = None, beta: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Submit {"custom_id", "params"} requests, or a RequestSpool of them, as one batch and
+    return the new batch.
+    """
+    body = requests if isinstance(requests, RequestSpool) else JSONBody({'requests': requests}, separators=(',', ':'))
+    headers = {**api_headers(beta), "Content-Length": str(len(body))}
+    response = await _call('POST', batches_url(), client or get_client(), content=body, headers=headers)
+    return response.json()
+
+async def get_batch(batch_id: str, client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    response = await _call('GET', f"{batches_url()}/{batch_id}", client or get_client(), headers=api_headers())
+    return response.json()
+
+async def cancel_batch(batch_id: str, client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    response = await _call('POST', f"{batches_url()}/{batch_id}/cancel", client or get_client(), headers=api_headers())
+    return response.json()
+
+async def wait_for_batch(
+    batch_id: str,
+    client: Optional[httpx.AsyncClient] = None,
+    poll_interval: float = BATCH_API_POLL_INTERVAL,
+    max_poll_interval: float = BATCH_API_MAX_POLL_INTERVAL,
+) -> Dict[str, Any]:
+    """
+    Poll a batch until it has ended, doubling the wait between polls up to max_poll_interval.
+    """
+    interval = poll_interval
+    while True:
+        batch = await get_batch(batch_id, client)
+        if batch.get('processing_status') == 'ended':
+            return batch
+        counts = batch.get('request_counts', {})
+        logger.info(f"Batch {batch_id}: {batch.get('processing_status')}, {counts.get('processing', '?')} requests processing")
+        await asyncio.sleep(interval)
+        interval = min(max_poll_interval, interval * 2)
+
+async def iter_batch_results(batch: Dict[str, Any], client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream an ended batch's JSONL results and yield (custom_id, result) pairs, without holding
+    the whole results file in memory.
+    """
+    client = client or get_client()
+    url = batch.get('results_url') or f"{batches_url()}/{batch['id']}/results"
+    try:
+        async with client.stream('GET', url, headers=api_headers(), timeout=180.0) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    record_line = json.loads(line)
+                    yield record_line['custom_id'], record_line['result']
+    except httpx.HTTPStatusError as e:
+        raise APIError(f"Downloading results of batch {batch['id']} failed: {e.response.status_code}")
+    except httpx.RequestError as e:
+        raise APIError(f"Request error: {str(e)}")
+
+class MessageBatcher:
+    """
+    Packs Messages API requests into Message Batches submissions and hands each caller its
+    own message once the batch it went into has ended.
+
+    A submission is sent as soon as it would exceed
+    `max_requests` requests or `max_bytes` of JSON, or once no request has arrived for
+    `linger` seconds, so a pipeline that queues work faster than that fills whole batches.
+    Every submission is polled and its results downloaded on its own, so later batches can
+    be submitted while earlier ones are still processing.
+
+    Requests are written to a RequestSpool on disk as they are queued, so neither the batcher
+    nor callers that let go of their images hold them while their batch runs.
+    """
+
+    def __init__(
+        self,
+        max_requests: int = BATCH_API_MAX_REQUESTS,
+        max_bytes: int = BATCH_API_MAX_BYTES,
+        linger: float = BATCH_API_LINGER,
+        poll_interval: float = BATCH_API_POLL_INTERVAL,
+        max_poll_interval: float = BATCH_API_MAX_POLL_INTERVAL,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.client = client
+        self.ids = itertools.count()
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.spool: Optional[RequestSpool] = None
+        self.pending_betas = set()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+        self.submitted: List[str] = []
+
+    def submit(self, params: Dict[str, Any], beta: Optional[str] = None) -> asyncio.Future:
+        """
+        Write one request's Messages API params to the pending submission and return a future
+        of its message, done once its batch has ended. The future raises the matching
+        AnthropicError if the request errored, was canceled or expired. params is serialized
+        before this returns, so the caller can drop its images while it waits.
+        """
+        # custom_id must be 1-64 characters of [a-zA-Z0-9_-]
+        custom_id = f"req-{next(self.ids)}"
+        request = JSONBody({'custom_id': custom_id, 'params': params}, separators=(',', ':'))
+        if self.pending and len(self.spool) + len(request) + 1 > self.max_bytes:
+            self.flush()
+        if self.spool is None:
+            self.spool = RequestSpool()
+        self.spool.add(request)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[custom_id] = future
+        if beta:
+            self.pending_betas.add(beta)
+        if len(self.pending) >= self.max_requests:
+            self.flush()
+        else:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = asyncio.get_event_loop().call_later(self.linger, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """
+        Submit everything queued so far as one batch.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        futures, spool, betas = self.pending, self.spool, self.pending_betas
+        self.pending, self.spool, self.pending_betas = {}, None, set()
+        task = asyncio.ensure_future(self._run(futures, spool, ','.join(sorted(betas)) or None))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, futures: Dict[str, asyncio.Future], spool: RequestSpool, beta: Optional[str]) -> None:
+        batch_id = None
+        try:
+            started = time.perf_counter()
+            try:
+                batch = await create_batch(spool, self.client, beta)
+            finally:
+                spool.close()
+            batch_id = batch['id']
+            self.submitted.append(batch_id)
+            count('batch_api_batches')
+            count('batch_api_requests', len(futures))
+            logger.info(f"Submitted batch {batch_id} with {len(futures)} requests")
+            batch = await wait_for_batch(batch_id, self.client, self.poll_interval, self.max_poll_interval)
+            record('batch_api.wait', time.perf_counter() - started)
+            async for custom_id, result in iter_batch_results(batch, self.client):
+                future = futures.pop(custom_id, None)
+                if future is None or future.done():
+                    continue
+                if result.get('type') == 'succeeded':
+                    future.set_result(result['message'])
+                else:
+                    count('batch_api_errored')
+                    future.set_exception(result_error(custom_id, result))
+            for custom_id, future in futures.items():
+                if not future.done():
+                    future.set_exception(APIError(f"Batch {batch_id} has no result for {custom_id}"))
+        except asyncio.CancelledError:
+            if batch_id:
+                logger.warning(f"Stopped waiting for batch {batch_id}; it keeps running on the server until it ends or is canceled")
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Batch {batch_id or 'submission'} failed: {e}")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+_batcher: Optional[MessageBatcher] = None
+_batcher_loop: Optional[asyncio.AbstractEventLoop] = None
+_batcher_settings: Dict[str, Any] = {}
+
+def configure_batch_api(**settings) -> None:
+    """
+    Override the MessageBatcher arguments used by get_message_batcher.
+    """
+    global _batcher
+    _batcher_settings.update({key: value for key, value in settings.items() if value is not None})
+    _batcher = None
+
+def get_message_batcher() -> MessageBatcher:
+    """
+    Return the batcher shared by all batch-api requests on the running event loop.
+    """
+    global _batcher, _batcher_loop
+    loop = asyncio.get_event_loop()
+    if _batcher is None or _batcher_loop is not loop:
+        _batcher = MessageBatcher(**_batcher_settings)
+        _batcher_loop = loop
+    return _batcher
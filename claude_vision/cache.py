@@ -0,0 +1,163 @@
+import os
+import time
+import hashlib
+import tempfile
+from typing import Optional, Dict, Any, AsyncGenerator
+from .config import CACHE_DIR, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, IMAGE_CACHE_MAX_BYTES
+from .json_utils import JSONBody
+from .utils import logger
+
+STREAM_REPLAY_CHUNK_SIZE = 32
+
+class DiskCache:
+    """
+    A size-bounded, content-addressed cache of byte blobs stored one file per key.
+
+    A file's mtime records when it was written (used for the TTL) and its atime records
+    when it was last read (used for LRU eviction once the cache grows past max_bytes).
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: Optional[float] = None):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                self._remove(path, stat.st_size)
+                self.misses += 1
+                return None
+            with open(path, 'rb') as f:
+                value = f.read()
+            # Mark as recently used without touching the write time
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+            return
+        self._size = self.size() + len(value) - previous_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def size(self) -> int:
+        if self._size is None:
+            self._size = sum(entry[2] for entry in self._entries())
+        return self._size
+
+    def evict(self) -> None:
+        """
+        Remove expired entries, then least recently used ones until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(entry[2] for entry in entries)
+        now = time.time()
+        for path, atime, size, mtime in entries:
+            expired = self.ttl is not None and now - mtime > self.ttl
+            if not expired and total <= self.max_bytes:
+                continue
+            self._remove(path, 0)
+            total -= size
+            self.evictions += 1
+        self._size = total
+        logger.debug(f"Cache {self.directory} evicted down to {total} bytes")
+
+    def clear(self) -> None:
+        for path, _, _, _ in self._entries():
+            self._remove(path, 0)
+        self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes': self.size(),
+        }
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_atime, stat.st_size, stat.st_mtime
+
+    def _remove(self, path: str, size: int) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        if self._size is not None and size:
+            self._size -= size
+
+_response_cache: Optional[DiskCache] = None
+_image_cache: Optional[DiskCache] = None
+
+def get_response_cache() -> DiskCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = DiskCache(
+            os.path.join(CACHE_DIR, 'responses'),
+            max_bytes=RESPONSE_CACHE_MAX_BYTES,
+            ttl=RESPONSE_CACHE_TTL,
+        )
+    return _response_cache
+
+def get_image_cache() -> DiskCache:
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = DiskCache(os.path.join(CACHE_DIR, 'images'), max_bytes=IMAGE_CACHE_MAX_BYTES)
+    return _image_cache
+
+def response_cache_key(data: Dict[str, Any]) -> str:
+    """
+    Hash everything in a Messages API request that determines the response:
+    model, system prompt, max_tokens and the messages (prompt, images and prefill).
+    """
+    digest = hashlib.sha256()
+    for field in ('model', 'system', 'max_tokens', 'messages'):
+        # Same bytes as json.dumps(..., sort_keys=True), without copying the images
+        for chunk in JSONBody(data.get(field), sort_keys=True).chunks():
+            digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+async def replay_stream(text: str, chunk_size: int = STREAM_REPLAY_CHUNK_SIZE) -> AsyncGenerator[str, None]:
+    """
+    Re-emit a cached response as a stream of chunks, like a live streaming response.
+    """
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+from typing import Dict, Any
+from .config import CACHE_DIR
+from .json_utils import dumps
+from .utils import logger
+
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, 'checkpoints')
+# Bytes hashed from each end of a video to identify it without reading the whole file
+FINGERPRINT_BYTES = 1 << 20
+
+def video_fingerprint(video_path: str) -> str:
+    """
+    Identify a video by its size and the content of its first and last megabyte, so a
+    renamed or copied file still matches but a re-encoded one doesn't.
+    """
+    digest = hashlib.sha256()
+    size = os.path.getsize(video_path)
+    digest.update(str(size).encode('ascii'))
+    with open(video_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def checkpoint_key(video_path: str, params: Dict[str, Any]) -> str:
+    """
+    Hash the video and everything that decides which frames are sampled and what is asked about them.
+    """
+    identity = {'video': video_fingerprint(video_path), 'params': params}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class VideoCheckpoint:
+    """
+    Append-only JSONL record of the frame results of one video analysis.
+
+    The first line identifies the run; every later line is one frame result, flushed as soon
+    as it arrives so an interrupted run loses at most the requests that were in flight.
+    """
+
+    def __init__(self, path: str, key: str):
+        self.path = os.path.expanduser(path)
+        self.key = key
+        self._file = None
+
+    @classmethod
+    def for_video(cls, video_path: str, params: Dict[str, Any], directory: str = CHECKPOINT_DIR) -> 'VideoCheckpoint':
+        key = checkpoint_key(video_path, params)
+        return cls(os.path.join(os.path.expanduser(directory), f"{key}.jsonl"), key)
+
+    def load(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Return the frame results saved so far, keyed by frame number.
+        """
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a truncated last line
+                    continue
+                if 'checkpoint' in record:
+                    if record['checkpoint'] != self.key:
+                        logger.warning(f"Ignoring checkpoint {self.path}: it belongs to a different run")
+                        return {}
+                elif 'frame_number' in record:
+                    results[record['frame_number']] = record
+        return results
+
+    def append(self, result: Dict[str, Any]) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            self._file = open(self.path, 'a')
+            if size == 0:
+                self._file.write(json.dumps({'checkpoint': self.key}) + "\n")
+            else:
+                with open(self.path, 'rb') as f:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        # Don't glue the first new record onto a truncated one
+                        self._file.write("\n")
+        self._file.write(dumps(result) + "\n")
+        self._file.flush()
+
+    def clear(self) -> None:
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,18 +1,64 @@
 
 import httpx
 import json
+import time
 import traceback
-from typing import List, Dict, Any, AsyncGenerator, Union
-from .config import ANTHROPIC_API_KEY
+from typing import List, Dict, Any, AsyncGenerator, Union, Optional, Callable, Awaitable, Tuple
+from .config import ANTHROPIC_API_KEY, ANTHROPIC_API_URL, BACKENDS
+from .http_client import get_client
+from .batch_api import get_message_batcher
+from .cache import get_response_cache, response_cache_key, replay_stream
+from .rate_limit import get_scheduler, estimate_request_tokens
+from .json_utils import JSONBody
+from .metrics import record, count
 from .utils import logger
 from .exceptions import (
     InvalidRequestError, AuthenticationError, PermissionError,
     NotFoundError, RateLimitError, APIError, OverloadedError
 )
 
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+# Leading base64 characters of each supported image format's magic bytes
+MEDIA_TYPE_SIGNATURES = {
+    'iVBORw0KGgo': 'image/png',
+    '/9j/': 'image/jpeg',
+    'R0lGOD': 'image/gif',
+    'UklGR': 'image/webp',
+}
 
-async def claude_vision_analysis(
+# Cache breakpoint marking everything up to and including a block as a reusable prefix
+EPHEMERAL_CACHE = {"type": "ephemeral"}
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+
+def detect_media_type(base64_image: str) -> str:
+    for signature, media_type in MEDIA_TYPE_SIGNATURES.items():
+        if base64_image.startswith(signature):
+            return media_type
+    return 'image/png'
+
+SYSTEM_PROMPTS = {
+    'text': "You are Claude 3.5 Sonnet, an AI assistant with vision capabilities. Describe the image.",
+    'json': "Analyze the image and provide output in valid JSON format only. No additional text.",
+    'md': "Analyze the image and provide output in valid Markdown format only. No additional text."
+}
+
+# The shortest prefix the API caches (Claude 3.5 Sonnet and Opus; Haiku models need 2048)
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+def warn_if_uncacheable(output_type: str, system: Optional[str] = None, *texts: Optional[str]) -> bool:
+    """
+    Check that a prefix of the system prompt and texts, shared by many requests, is long enough
+    for the API to cache, and warn if it isn't: shorter prefixes are silently billed in full.
+    """
+    tokens = estimate_request_tokens([], system or SYSTEM_PROMPTS.get(output_type, SYSTEM_PROMPTS['text']), *texts)
+    if tokens < PROMPT_CACHE_MIN_TOKENS:
+        logger.warning(
+            f"Prompt caching: the text shared by every request is about {tokens} tokens, below the "
+            f"{PROMPT_CACHE_MIN_TOKENS}-token minimum the API caches, so only shared images will be cached"
+        )
+        return False
+    return True
+
+def build_request(
     base64_images: List[str],
     prompt: str,
     output_type: str,
@@ -20,29 +66,26 @@ async def claude_vision_analysis(
     system: str = None,
     max_tokens: int = 1000,
     prefill: str = None,
-) -> Union[str, AsyncGenerator[str, None]]:
+    prompt_cache: bool = False,
+    cached_images: int = 0,
+    prompt_prefix: Optional[str] = None,
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Return the (headers, body) of a Messages API request for images and a prompt.
+    """
     headers = {
         "Content-Type": "application/json",
         "x-api-key": ANTHROPIC_API_KEY,
         "anthropic-version": "2023-06-01"
     }
 
-    systems = {
-        'text': "You are Claude 3.5 Sonnet, an AI assistant with vision capabilities. Describe the image.",
-        'json': "Analyze the image and provide output in valid JSON format only. No additional text.",
-        'md': "Analyze the image and provide output in valid Markdown format only. No additional text."
-    }
-
-    content = [{"type": "text", "text": prompt}]
-    for base64_image in base64_images:
-        content.append({
-            "type": "image",
-            "source": {
-                "type": "base64",
-                "media_type": "image/png",
-                "data": base64_image
-            }
-        })
+    system = system or SYSTEM_PROMPTS.get(output_type, SYSTEM_PROMPTS['text'])
+    if prompt_cache:
+        content = cached_content(base64_images, prompt, cached_images, prompt_prefix)
+        headers["anthropic-beta"] = PROMPT_CACHING_BETA
+    else:
+        content = [{"type": "text", "text": " ".join(part for part in (prompt_prefix, prompt) if part)}]
+        content += [image_block(base64_image) for base64_image in base64_images]
 
     messages = [{"role": "user", "content": content}]
     if output_type == 'json' and not prefill:
@@ -54,49 +97,186 @@ async def claude_vision_analysis(
     data = {
         "model": "claude-3-5-sonnet-20240620",
         "max_tokens": max_tokens,
-        "system": system or systems.get(output_type, systems['text']),
+        "system": [{"type": "text", "text": system, "cache_control": EPHEMERAL_CACHE}] if prompt_cache else system,
         "messages": messages,
         "stream": stream
     }
+    return headers, data
+
+async def claude_vision_analysis(
+    base64_images: List[str],
+    prompt: str,
+    output_type: str,
+    stream: bool = False,
+    system: str = None,
+    max_tokens: int = 1000,
+    prefill: str = None,
+    client: Optional[httpx.AsyncClient] = None,
+    use_cache: bool = False,
+    refresh_cache: bool = False,
+    prompt_cache: bool = False,
+    cached_images: int = 0,
+    prompt_prefix: Optional[str] = None,
+    backend: str = 'messages',
+) -> Union[str, AsyncGenerator[str, None]]:
+    """
+    Send images and a prompt to the Messages API and return the text, or an async generator of
+    text chunks with stream.
+
+    With prompt_cache, the system prompt, `prompt_prefix` and the first `cached_images` images
+    are marked as cache breakpoints, in that order, ahead of the remaining images and the
+    prompt, so requests that share them are billed at the cache-read rate. The API only caches
+    prefixes of at least PROMPT_CACHE_MIN_TOKENS tokens. Without it,
+    prompt_prefix is simply prepended to the prompt.
+
+    With backend='batch-api', the request is queued into a Message Batches submission and this
+    returns once its batch has ended, which can take hours; a stream is replayed from the
+    finished text.
+    """
+    started = time.perf_counter()
+    system = system or SYSTEM_PROMPTS.get(output_type, SYSTEM_PROMPTS['text'])
+    headers, data = build_request(
+        base64_images, prompt, output_type, stream, system, max_tokens, prefill,
+        prompt_cache=prompt_cache, cached_images=cached_images, prompt_prefix=prompt_prefix
+    )
+    record('request.build', time.perf_counter() - started)
+
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = response_cache_key(data)
+        cached = None if refresh_cache else cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Response cache hit: {cache_key}")
+            count('response_cache_hits')
+            text = cached.decode('utf-8')
+            return replay_stream(text) if stream else finalize_content(text, output_type)
+        store = lambda text: cache.set(cache_key, text.encode('utf-8'))
+    else:
+        store = None
+
+    if backend == 'batch-api':
+        # Batch results arrive whole, so the request itself is never streamed
+        params = {key: value for key, value in data.items() if key != 'stream'}
+        message = get_message_batcher().submit(params, headers.get("anthropic-beta"))
+        # The request is on disk now; don't hold its images for the hours its batch can take
+        del base64_images, data, params
+        return await finish_batch_api_request(message, output_type, stream, store, started)
+
+    client = client or get_client()
+    # Written straight from the base64 strings instead of from a serialized copy of the payload
+    body = JSONBody(data)
+    headers["Content-Length"] = str(len(body))
+
+    async def send():
+        logger.debug(f"Sending request to Anthropic API: {ANTHROPIC_API_URL}")
+        count('requests')
+        response = await client.post(ANTHROPIC_API_URL, headers=headers, content=body, timeout=180.0)
+        logger.debug(f"Received response from Anthropic API. Status code: {response.status_code}")
+        response.raise_for_status()
+        return response
+
+    try:
+        response = await get_scheduler().run(send, tokens=estimate_request_tokens(base64_images, prompt_prefix, prompt, system))
+
+        if stream:
+            return handle_stream_response(response, on_complete=store, started=started)
+        else:
+            result = response.json()
+            content = result['content'][0]['text']
+            record_usage(result.get('usage'))
+            if store:
+                store(content)
+            record('request.total', time.perf_counter() - started)
+            return finalize_content(content, output_type)
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error occurred: {e}")
+        logger.error(f"Response content: {e.response.text}")
+        handle_http_error(e)
+    except httpx.RequestError as e:
+        logger.error(f"Request error occurred: {e}")
+        raise APIError(f"Request error: {str(e)}")
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error: {e}")
+        logger.error(f"Response content: {response.text}")
+        raise APIError(f"Invalid JSON response from API: {str(e)}")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise APIError(f"An unexpected error occurred: {str(e)}")
+
+async def finish_batch_api_request(message: Awaitable[Dict[str, Any]], output_type: str, stream: bool, store: Optional[Callable[[str], None]], started: float) -> Union[str, AsyncGenerator[str, None]]:
+    message = await message
+    content = message['content'][0]['text']
+    record_usage(message.get('usage'))
+    if store:
+        store(content)
+    record('request.total', time.perf_counter() - started)
+    text = finalize_content(content, output_type)
+    return replay_stream(text) if stream else text
+
+def image_block(base64_image: str) -> Dict[str, Any]:
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": detect_media_type(base64_image),
+            "data": base64_image
+        }
+    }
+
+def cached_content(base64_images: List[str], prompt: str, cached_images: int = 0, prompt_prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Order user content for prompt caching: the stable prompt prefix and the stable leading
+    images first, each ending in a cache breakpoint, then the images and text that vary.
+
+    The prefix goes first because a cached prefix only matches requests that agree on
+    everything before it: requests sharing instructions but not images still share the prefix.
+    """
+    content = []
+    if prompt_prefix:
+        content.append({"type": "text", "text": prompt_prefix, "cache_control": EPHEMERAL_CACHE})
+    content += [image_block(base64_image) for base64_image in base64_images[:cached_images]]
+    if cached_images and base64_images:
+        content[-1]["cache_control"] = EPHEMERAL_CACHE
+    content += [image_block(base64_image) for base64_image in base64_images[cached_images:]]
+    if prompt:
+        content.append({"type": "text", "text": prompt})
+    return content
+
+def finalize_content(content: str, output_type: str) -> str:
+    if output_type == 'json':
+        content = '{' + content.lstrip('{')  # Ensure it starts with '{'
+    return content
+
+def record_usage(usage: Optional[Dict[str, Any]]) -> None:
+    for key in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'):
+        if usage and usage.get(key):
+            count(key, usage[key])
 
-    async with httpx.AsyncClient() as client:
-        try:
-            logger.debug(f"Sending request to Anthropic API: {ANTHROPIC_API_URL}")
-            response = await client.post(ANTHROPIC_API_URL, headers=headers, json=data, timeout=180.0)
-            logger.debug(f"Received response from Anthropic API. Status code: {response.status_code}")
-            response.raise_for_status()
-
-            if stream:
-                return handle_stream_response(response)
-            else:
-                result = response.json()
-                content = result['content'][0]['text']
-                if output_type == 'json':
-                    content = '{' + content.lstrip('{')  # Ensure it starts with '{'
-                return content
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error occurred: {e}")
-            logger.error(f"Response content: {e.response.text}")
-            handle_http_error(e)
-        except httpx.RequestError as e:
-            logger.error(f"Request error occurred: {e}")
-            raise APIError(f"Request error: {str(e)}")
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            logger.error(f"Response content: {response.text}")
-            raise APIError(f"Invalid JSON response from API: {str(e)}")
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            raise APIError(f"An unexpected error occurred: {str(e)}")
-
-async def handle_stream_response(response: httpx.Response) -> AsyncGenerator[str, None]:
+async def handle_stream_response(response: httpx.Response, on_complete: Optional[Callable[[str], None]] = None, started: Optional[float] = None) -> AsyncGenerator[str, None]:
+    """
+    Yield the text deltas of a streamed response. With `started` (a perf_counter time), records
+    time to the first token and the request's total time.
+    """
+    chunks = []
     async for line in response.aiter_lines():
         if line.startswith('data: '):
             event = json.loads(line[6:])
             if event['type'] == 'content_block_delta':
-                yield event['delta'].get('text', '')
+                text = event['delta'].get('text', '')
+                if not chunks and started is not None:
+                    record('request.ttft', time.perf_counter() - started)
+                chunks.append(text)
+                yield text
+            elif event['type'] == 'message_start':
+                record_usage(event.get('message', {}).get('usage'))
+            elif event['type'] == 'message_delta':
+                record_usage(event.get('usage'))
             elif event['type'] == 'message_stop':
+                if started is not None:
+                    record('request.total', time.perf_counter() - started)
+                if on_complete:
+                    on_complete(''.join(chunks))
                 break
 
 def handle_http_error(e: httpx.HTTPStatusError):
@@ -110,5 +290,9 @@ def handle_http_error(e: httpx.HTTPStatusError):
         529: OverloadedError
     }
     error_class = error_map.get(e.response.status_code, APIError)
-    error_message = e.response.json().get('error', {}).get('message', str(e))
+    try:
+        error_message = e.response.json().get('error', {}).get('message', str(e))
+    except json.JSONDecodeError:
+        # Proxies and load balancers can answer 5xx with a non-JSON body
+        error_message = str(e)
     raise error_class(error_message)
\ No newline at end of file
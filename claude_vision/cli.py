@@ -1,45 +1,159 @@
+import os
 import sys
 import io
-from PIL import Image
-import json
+import glob
+import textwrap
 from typing import AsyncGenerator
 import click
 import asyncio
-from .video_utils import is_video_file
-from .video_processing import analyze_video
-from .json_utils import parse_json_input, format_json_output, parse_video_json_input, format_video_json_output
-from .image_processing import process_multiple_images, convert_image_to_base64
-from .claude_integration import claude_vision_analysis
-from .advanced_features import visual_judge, image_evolution_analyzer, persona_based_analysis, comparative_time_series_analysis, generate_alt_text
-from .config import CONFIG, save_config
+# Pillow, httpx and the modules built on them are imported by the commands that use them, so
+# --help, config and mock-server start without loading them
+from .json_utils import parse_json_input, format_json_output, parse_video_json_input, format_video_json_output, format_frame_result, dumps
+from .rate_limit import configure_scheduler, estimate_request_tokens
+from .cache import get_response_cache
+from .planner import MAX_IMAGES_PER_REQUEST
+from .utils import logger, generate_prompt, is_video_file, expand_image_paths, DECODE_STRATEGIES
+from .config import (
+    CONFIG, save_config, REQUEST_TOKEN_BUDGET, VIDEO_CONCURRENCY, BATCH_CONCURRENCY, PROMPT_CACHE, BATCH_API_MAX_REQUESTS,
+    WATCH_SETTLE, WATCH_POLL_INTERVAL, IMAGE_FORMATS, IMAGE_EXECUTORS, BACKENDS
+)
+from .checkpoint import CHECKPOINT_DIR
+from .metrics import get_metrics, span
 
 @click.group()
 def cli():
     pass
 
+def check_input_paths(ctx, param, paths):
+    """
+    Reject missing files like click.Path(exists=True) does, and directories and glob patterns
+    without any images, while letting URLs through.
+    """
+    for path in paths:
+        if path.startswith(('http://', 'https://')) or os.path.isfile(path):
+            continue
+        if os.path.isdir(path) or glob.has_magic(path):
+            if not expand_image_paths([path]):
+                raise click.BadParameter(f"'{path}' contains or matches no images.")
+        else:
+            raise click.BadParameter(f"Path '{path}' does not exist.")
+    return paths
+
 @cli.command()
-@click.argument('input_files', nargs=-1, type=click.Path(exists=True), required=False)
+@click.argument('input_files', nargs=-1, type=click.Path(), required=False, callback=check_input_paths)
 @click.option('--persona', help="Optional persona for analysis")
 @click.option('--json-input', type=click.File('r'), help="JSON input for chained operations")
-@click.option('--output', type=click.Choice(['json', 'md', 'markdown', 'text']), default='text', help="Output format")
-@click.option('--stream', is_flag=True, help="Stream the response in real-time")
+@click.option('--output', type=click.Choice(['json', 'ndjson', 'md', 'markdown', 'text']), default='text', help="Output format; 'ndjson' writes one JSON object per line, and per video frame as soon as it is analyzed")
+@click.option('--stream', is_flag=True, help="Stream the response in real-time; for video, write each frame result as soon as it is analyzed")
 @click.option('--video', is_flag=True, help="Treat input as a video file")
 @click.option('--frame-interval', type=int, default=30, help="Interval between frames to analyze in video")
-@click.option('--num-workers', type=int, default=None, help="Number of worker processes for video analysis")
+@click.option('--num-workers', type=int, default=None, help="Number of worker threads encoding video frames")
+@click.option('--concurrency', type=click.IntRange(1), default=VIDEO_CONCURRENCY, show_default=True, help="Video frame or image chunk requests kept in flight at once")
+@click.option('--progress/--no-progress', default=None, help="Report video progress on stderr (default: when stderr is a terminal)")
+@click.option('--checkpoint/--no-checkpoint', default=True, help="Save video frame results as they arrive and resume an interrupted run from them")
+@click.option('--restart', is_flag=True, help="Discard the video's checkpoint and analyze every frame again")
+@click.option('--decode-strategy', type=click.Choice(DECODE_STRATEGIES), default='auto', help="Read video frames sequentially, seek to each one, or pick automatically from the GOP length")
+@click.option('--dedup-threshold', type=click.IntRange(0, 64), default=None, help="Skip frames or images whose perceptual hash is within this Hamming distance of the last one kept")
 @click.option('--prompt', help="Custom prompt for analysis")
 @click.option('--system', help="Custom system prompt for Claude")
 @click.option('--prefill', help="Prefill Claude's response")
 @click.option('--max-tokens', type=int, default=1000, help="Maximum number of tokens in the response")
 @click.option('--group', is_flag=True, help="Process frames or images as a group")
+@click.option('--chunk-size', type=click.IntRange(1, MAX_IMAGES_PER_REQUEST), default=None, help=f"Analyze any number of images (files, directories or globs) this many per request, streaming one result per chunk; used automatically, {MAX_IMAGES_PER_REQUEST} per request, for more than {MAX_IMAGES_PER_REQUEST} images")
+@click.option('--as-completed', is_flag=True, help="With --chunk-size, write each chunk's result as soon as it's done rather than in input order")
+@click.option('--mosaic', type=click.IntRange(2, 36), default=None, help="Tile this many video frames into one labelled grid image per request")
 @click.option('--multi-angle', is_flag=True, help="Treat multiple images as different angles of the same object")
 @click.option('--multi-object', is_flag=True, help="Treat multiple images as different objects")
-def analyze(input_files, persona, json_input, output, stream, video, frame_interval, num_workers, prompt, system, prefill, max_tokens, group, multi_angle, multi_object):
+@click.option('--http2/--no-http2', default=None, help="Multiplex API requests over HTTP/2 (requires the 'h2' package)")
+@click.option('--no-cache', is_flag=True, help="Don't read or write the response cache")
+@click.option('--refresh', is_flag=True, help="Ignore cached responses and overwrite them with fresh ones")
+@click.option('--prompt-cache/--no-prompt-cache', default=PROMPT_CACHE, help="Mark the system prompt, shared images and shared instructions as prompt-cache breakpoints")
+@click.option('--backend', type=click.Choice(BACKENDS), default='messages', show_default=True, help="Send each request to the Messages API, or pack them into Message Batches for cheaper offline runs that can take hours; with batch-api every image is its own request unless --group")
+@click.option('--requests-per-minute', type=int, default=None, help="Client-side limit on API requests per minute")
+@click.option('--tokens-per-minute', type=int, default=None, help="Client-side limit on estimated input tokens per minute")
+@click.option('--image-format', type=click.Choice(IMAGE_FORMATS), default=None, help="Encoding for uploaded images; 'auto' picks the smallest of JPEG/WebP within the byte budget")
+@click.option('--image-quality', type=click.IntRange(1, 100), default=None, help="JPEG/WebP quality for uploaded images")
+@click.option('--image-executor', type=click.Choice(IMAGE_EXECUTORS), default=None, help="Prepare images on a thread pool or a process pool")
+@click.option('--image-workers', type=click.IntRange(0), default=None, help="Size of the image preparation pool (0 for one worker per CPU)")
+@click.option('--token-budget', type=click.IntRange(1), default=REQUEST_TOKEN_BUDGET or None, help="Input-token budget per request; images are downscaled and video frames grouped to fit it")
+@click.option('--dry-run', is_flag=True, help="Sample, resize and estimate tokens and cost locally without calling the API")
+@click.option('--max-cost', type=float, default=None, help="Refuse, or stop early, if the estimated cost in USD would exceed this")
+@click.option('--max-tokens-total', type=int, default=None, help="Refuse, or stop early, if the estimated input plus maximum output tokens would exceed this")
+@click.option('--metrics', is_flag=True, help="Print per-stage timings and counters as JSON on stderr when the run ends")
+def analyze(input_files, persona, json_input, output, stream, video, frame_interval, num_workers, concurrency, progress, checkpoint, restart, decode_strategy, dedup_threshold, prompt, system, prefill, max_tokens, group, chunk_size, as_completed, mosaic, multi_angle, multi_object, http2, no_cache, refresh, prompt_cache, backend, requests_per_minute, tokens_per_minute, image_format, image_quality, image_executor, image_workers, token_budget, dry_run, max_cost, max_tokens_total, metrics):
     if not input_files and not sys.stdin.isatty():
         input_data = sys.stdin.buffer.read()
         input_files = [io.BytesIO(input_data)]
-    asyncio.run(claude_vision_async(input_files, persona, json_input, output, stream, video, frame_interval, num_workers, prompt, system, prefill, max_tokens, group, multi_angle, multi_object))
+    from .http_client import configure_client
+    from .image_processing import configure_image_encoding, configure_image_executor
+    configure_client(http2=http2)
+    configure_scheduler(requests_per_minute=requests_per_minute, input_tokens_per_minute=tokens_per_minute)
+    configure_image_encoding(image_format=image_format, quality=image_quality)
+    configure_image_executor(kind=image_executor, workers=image_workers)
+    asyncio.run(claude_vision_async(input_files, persona, json_input, output, stream, video, frame_interval, num_workers, prompt, system, prefill, max_tokens, group, multi_angle, multi_object, use_cache=not no_cache, refresh_cache=refresh, decode_strategy=decode_strategy, dedup_threshold=dedup_threshold, token_budget=token_budget, dry_run=dry_run, max_cost=max_cost, max_tokens_total=max_tokens_total, mosaic=mosaic, concurrency=concurrency, progress=progress, checkpoint=checkpoint, restart_checkpoint=restart, prompt_cache=prompt_cache, backend=backend, chunk_size=chunk_size, as_completed=as_completed))
+    if prompt_cache:
+        report_prompt_cache()
+    if metrics:
+        click.echo(dumps(get_metrics().summary(), indent=2), err=True)
+
+def echo_frame_result(result, output):
+    with span('output.write'):
+        if output in ('json', 'ndjson'):
+            click.echo(dumps(format_frame_result(result)))
+        else:
+            duplicate = f" [same as frame {result['duplicate_of']}]" if 'duplicate_of' in result else ""
+            click.echo(f"Frame {result['frame_number']} ({result['timestamp']:.2f}s){duplicate}: {result['result']}")
+
+async def echo_image_set_results(records, output):
+    """
+    Write chunk records as they arrive: one object per line for ndjson, a JSON array written
+    incrementally for json, or one line per chunk.
+    """
+    first = True
+    async for record in records:
+        with span('output.write'):
+            if output == 'json':
+                click.echo(('[\n' if first else ',\n') + textwrap.indent(dumps(record, indent=2), '  '), nl=False)
+            elif output == 'ndjson':
+                click.echo(dumps(record))
+            else:
+                files = ', '.join(file or '<stdin>' for file in record['files'])
+                click.echo(f"{files}: {record['result'] if 'result' in record else 'Error: ' + record['error']}")
+        first = False
+    if output == 'json':
+        click.echo('[]' if first else '\n]')
+
+def report_prompt_cache():
+    counters = get_metrics().counters
+    click.echo(
+        f"Prompt cache: {counters.get('cache_read_input_tokens', 0):,.0f} input tokens read from cache, "
+        f"{counters.get('cache_creation_input_tokens', 0):,.0f} written, {counters.get('input_tokens', 0):,.0f} uncached",
+        err=True
+    )
+
+def report_progress(done, total):
+    total = f"/{total}" if total else ""
+    click.echo(f"\rAnalyzed {done}{total} frames", nl=False, err=True)
 
-async def claude_vision_async(input_files, persona, json_input, output, stream, video, frame_interval, num_workers, prompt, system, prefill, max_tokens, group, multi_angle, multi_object):
+def preflight(requests, dry_run, max_cost, max_tokens_total):
+    """
+    Print the plan for a dry run and return how many of the planned requests fit the limits.
+    Raises ValueError if not even the first one does.
+    """
+    from .preflight import affordable_requests, summarize_requests, format_summary
+    allowed = affordable_requests(requests, max_cost, max_tokens_total)
+    if dry_run:
+        click.echo(format_summary(summarize_requests(requests)))
+        if allowed < len(requests):
+            click.echo(f"Within limits:   {allowed:,} of {len(requests):,} requests")
+    elif allowed == 0 and requests:
+        raise ValueError("Estimated usage exceeds --max-cost/--max-tokens-total; nothing was sent")
+    return allowed
+
+async def claude_vision_async(input_files, persona, json_input, output, stream, video, frame_interval, num_workers, prompt, system, prefill, max_tokens, group, multi_angle, multi_object, use_cache=True, refresh_cache=False, decode_strategy='auto', dedup_threshold=None, token_budget=None, dry_run=False, max_cost=None, max_tokens_total=None, mosaic=None, concurrency=VIDEO_CONCURRENCY, progress=None, checkpoint=True, restart_checkpoint=False, prompt_cache=False, backend='messages', chunk_size=None, as_completed=False):
+    from .http_client import close_client
+    from .claude_integration import claude_vision_analysis, finalize_content
+    from .preflight import plan_image_job, plan_video_job
     try:
         if json_input:
             data = parse_video_json_input(json_input) if video else parse_json_input(json_input)
@@ -50,38 +164,132 @@ async def claude_vision_async(input_files, persona, json_input, output, stream,
         elif not input_files:
             raise click.UsageError("Please provide input files, pipe input, or JSON input.")
 
+        check_budget = dry_run or max_cost is not None or max_tokens_total is not None
+        # NDJSON wraps each JSON answer in a line of its own
+        analysis_output = 'json' if output == 'ndjson' else output
+
         if video or (isinstance(input_files[0], str) and is_video_file(input_files[0])):
-            metadata, frame_results = await analyze_video(input_files[0], frame_interval, persona, output, stream, num_workers, prompt=prompt, system=system, process_as_group=group)
+            # OpenCV and numpy are only loaded for video
+            from .video_processing import analyze_video, iter_video_results
+            if chunk_size or as_completed:
+                raise click.UsageError("--chunk-size and --as-completed apply to images, not video")
+            if progress is None:
+                progress = sys.stderr.isatty()
+            max_frames = None
+            if check_budget:
+                requests, starts = plan_video_job(input_files[0], frame_interval, persona, prompt, system, max_tokens, group, token_budget, dedup_threshold, decode_strategy, mosaic)
+                allowed = preflight(requests, dry_run, max_cost, max_tokens_total)
+                if dry_run:
+                    return
+                if allowed < len(requests):
+                    max_frames = starts[allowed]
+                    click.echo(f"Estimated cost limit reached: analyzing only the first {max_frames} sampled frames ({allowed} of {len(requests)} requests)", err=True)
+            if backend == 'batch-api':
+                # Requests wait hours for their batch, without their images, so fill whole submissions
+                concurrency = BATCH_API_MAX_REQUESTS
+            video_options = dict(prompt=prompt, system=system, process_as_group=group, decode_strategy=decode_strategy, dedup_threshold=dedup_threshold, token_budget=token_budget, max_frames=max_frames, mosaic=mosaic, concurrency=concurrency, progress=report_progress if progress else None, checkpoint_dir=CHECKPOINT_DIR if checkpoint else None, restart_checkpoint=restart_checkpoint, use_cache=use_cache, refresh_cache=refresh_cache, prompt_cache=prompt_cache, backend=backend)
+            if output == 'ndjson' or stream:
+                # Write each frame as soon as it and every earlier frame are done, without holding the video's results
+                async for result in iter_video_results(input_files[0], frame_interval, persona, analysis_output, stream, num_workers, **video_options):
+                    echo_frame_result(result, output)
+                if progress:
+                    click.echo(err=True)
+                return
+
+            metadata, frame_results = await analyze_video(input_files[0], frame_interval, persona, output, stream, num_workers, **video_options)
+            if progress:
+                click.echo(err=True)
             
             if output == 'json':
-                formatted_result = format_video_json_output(metadata, frame_results, "video_description")
-                click.echo(json.dumps(formatted_result, indent=2, ensure_ascii=False))
+                with span('output.write'):
+                    formatted_result = format_video_json_output(metadata, frame_results, "video_description")
+                    click.echo(dumps(formatted_result, indent=2))
             else:
                 for result in frame_results:
-                    click.echo(f"Frame {result['frame_number']} ({result['timestamp']:.2f}s): {result['result']}")
+                    echo_frame_result(result, output)
         else:
+            from .image_processing import process_multiple_images, plan_image_requests, convert_image_to_base64
+            from .image_sets import iter_image_set_results
+            from .dedup import dedupe_base64_images
+            input_files = expand_image_paths(input_files)
+            if not input_files:
+                raise ValueError("No images found in the given directories or patterns")
+            if chunk_size is None and backend == 'batch-api' and not group and len(input_files) > 1:
+                # Batches pay off for many independent requests, so each image is its own
+                chunk_size = 1
+            elif chunk_size is None and len(input_files) > MAX_IMAGES_PER_REQUEST:
+                chunk_size = MAX_IMAGES_PER_REQUEST
+                click.echo(f"{len(input_files)} images: analyzing them {chunk_size} per request", err=True)
+            elif chunk_size is None and token_budget and len(input_files) > 1 and all(isinstance(file, str) for file in input_files):
+                text_tokens = estimate_request_tokens([], prompt or generate_prompt(persona, multi_angle, multi_object, len(input_files)), system)
+                requests_needed = len(plan_image_requests(input_files, token_budget, text_tokens))
+                if requests_needed > 1:
+                    # Rather than shrinking every image to squeeze them into one request
+                    chunk_size = MAX_IMAGES_PER_REQUEST
+                    click.echo(f"{len(input_files)} images don't fit one request of {token_budget} tokens: analyzing them in {requests_needed} requests", err=True)
+            if check_budget:
+                requests = plan_image_job(input_files, prompt or generate_prompt(persona, multi_angle, multi_object, chunk_size or len(input_files)), system, max_tokens, token_budget, chunk_size=chunk_size)
+                preflight(requests, dry_run, max_cost, max_tokens_total)
+                if dry_run:
+                    return
+
+            if chunk_size:
+                if stream or dedup_threshold is not None:
+                    raise click.UsageError(f"--stream and --dedup-threshold can't be used when images are analyzed {chunk_size} per request; use --output ndjson to see each chunk's result as it's ready")
+                if backend == 'batch-api':
+                    # Requests wait hours for their batch, without their images, so fill whole submissions
+                    concurrency = BATCH_API_MAX_REQUESTS
+                text_tokens = estimate_request_tokens([], prompt or generate_prompt(persona, multi_angle, multi_object, chunk_size), system)
+                records = iter_image_set_results(
+                    input_files, analysis_output, prompt=prompt, persona=persona, multi_angle=multi_angle, multi_object=multi_object, chunk_size=chunk_size,
+                    concurrency=concurrency, ordered=not as_completed, token_budget=token_budget, text_tokens=text_tokens,
+                    system=system, max_tokens=max_tokens, prefill=prefill, use_cache=use_cache, refresh_cache=refresh_cache,
+                    prompt_cache=prompt_cache, backend=backend
+                )
+                await echo_image_set_results(records, output)
+                return
+            if as_completed:
+                raise click.UsageError(f"--as-completed only applies when images are analyzed in chunks (--chunk-size, or more than {MAX_IMAGES_PER_REQUEST} images)")
+
             if all(isinstance(file, io.BytesIO) for file in input_files):
+                from PIL import Image
                 base64_images = [convert_image_to_base64(Image.open(file)) for file in input_files]
             else:
-                base64_images = await process_multiple_images(input_files, process_as_group=group)
+                text_tokens = estimate_request_tokens([], prompt or generate_prompt(persona, multi_angle, multi_object, len(input_files)), system)
+                base64_images = await process_multiple_images(input_files, process_as_group=group, token_budget=token_budget, text_tokens=text_tokens)
+
+            if dedup_threshold is not None and len(base64_images) > 1:
+                base64_images, duplicate_of = dedupe_base64_images(base64_images, dedup_threshold)
+                for index, original in duplicate_of.items():
+                    click.echo(f"Skipping input {index + 1}: near-duplicate of input {original + 1}", err=True)
             
             if not prompt:
                 prompt = generate_prompt(persona, multi_angle, multi_object, len(base64_images))
 
             result = await claude_vision_analysis(
-                base64_images, prompt, output, stream, 
+                base64_images, prompt, analysis_output, stream, 
                 system=system, 
                 max_tokens=max_tokens, 
-                prefill=prefill
+                prefill=prefill,
+                use_cache=use_cache,
+                refresh_cache=refresh_cache,
+                prompt_cache=prompt_cache,
+                # Asking about the same images again within the cache lifetime reads them from the cache
+                cached_images=len(base64_images) if prompt_cache else 0,
+                backend=backend
             )
-            if output == 'json':
+            if output == 'ndjson':
+                if stream:
+                    result = finalize_content(''.join([chunk async for chunk in result]), analysis_output)
+                click.echo(dumps(format_json_output(result, "description")))
+            elif output == 'json':
                 if stream:
                     async for chunk in result:
                         click.echo(chunk, nl=False)
                     click.echo()
                 else:
                     formatted_result = format_json_output(result, "description")
-                    click.echo(json.dumps(formatted_result, indent=2, ensure_ascii=False))
+                    click.echo(dumps(formatted_result, indent=2))
             elif output in ['md', 'markdown']:
                 if stream:
                     async for chunk in result:
@@ -97,25 +305,173 @@ async def claude_vision_async(input_files, persona, json_input, output, stream,
                 else:
                     click.echo(result)
 
+    except click.UsageError:
+        raise
     except ValueError as e:
         click.echo(f"Error: {str(e)}", err=True)
     except Exception as e:
         click.echo(f"An unexpected error occurred: {str(e)}", err=True)
+    finally:
+        await close_client()
+        if use_cache:
+            cache = get_response_cache()
+            logger.info(f"Response cache: {cache.hits} hits, {cache.misses} misses")
 
-def generate_prompt(persona=None, multi_angle=False, multi_object=False, num_images=1):
-    if num_images == 1:
-        base_prompt = "Analyze this image and provide a detailed description."
-    else:
-        if multi_angle:
-            base_prompt = f"Analyze these {num_images} images as different angles of the same object. Provide a detailed description of the object based on all angles."
-        elif multi_object:
-            base_prompt = f"Analyze these {num_images} images as different objects. Provide a detailed description of each object separately."
-        else:
-            base_prompt = f"Analyze these {num_images} images and provide a detailed description for each."
+@cli.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output-file', '-o', type=click.Path(dir_okay=False), help="JSONL file to append results to (default: MANIFEST with a .results.jsonl suffix)")
+@click.option('--concurrency', type=int, default=BATCH_CONCURRENCY, show_default=True, help="Maximum number of requests in flight")
+@click.option('--http2/--no-http2', default=None, help="Multiplex API requests over HTTP/2 (requires the 'h2' package)")
+@click.option('--no-cache', is_flag=True, help="Don't read or write the response cache")
+@click.option('--refresh', is_flag=True, help="Ignore cached responses and overwrite them with fresh ones")
+@click.option('--prompt-cache/--no-prompt-cache', default=PROMPT_CACHE, help="Mark the system prompt, and prompts and images shared by several entries, as prompt-cache breakpoints")
+@click.option('--backend', type=click.Choice(BACKENDS), default='messages', show_default=True, help="Send each entry to the Messages API, or pack them into Message Batches for cheaper offline runs that can take hours")
+@click.option('--requests-per-minute', type=int, default=None, help="Client-side limit on API requests per minute")
+@click.option('--tokens-per-minute', type=int, default=None, help="Client-side limit on estimated input tokens per minute")
+@click.option('--image-format', type=click.Choice(IMAGE_FORMATS), default=None, help="Encoding for uploaded images; 'auto' picks the smallest of JPEG/WebP within the byte budget")
+@click.option('--image-quality', type=click.IntRange(1, 100), default=None, help="JPEG/WebP quality for uploaded images")
+@click.option('--image-executor', type=click.Choice(IMAGE_EXECUTORS), default=None, help="Prepare images on a thread pool or a process pool")
+@click.option('--image-workers', type=click.IntRange(0), default=None, help="Size of the image preparation pool (0 for one worker per CPU)")
+@click.option('--dry-run', is_flag=True, help="Sample, resize and estimate tokens and cost locally without calling the API")
+@click.option('--max-cost', type=float, default=None, help="Refuse, or stop early, if the estimated cost in USD would exceed this")
+@click.option('--max-tokens-total', type=int, default=None, help="Refuse, or stop early, if the estimated input plus maximum output tokens would exceed this")
+@click.option('--metrics', is_flag=True, help="Print per-stage timings and counters as JSON on stderr when the run ends")
+@click.option('--metrics-file', type=click.Path(dir_okay=False), default=None, help="Write per-stage timings and counters to this file for a Prometheus textfile collector")
+@click.option('--metrics-format', type=click.Choice(['prometheus', 'openmetrics']), default='prometheus', show_default=True, help="Exposition format for --metrics-file")
+def batch(manifest, output_file, concurrency, http2, no_cache, refresh, prompt_cache, backend, requests_per_minute, tokens_per_minute, image_format, image_quality, image_executor, image_workers, dry_run, max_cost, max_tokens_total, metrics, metrics_file, metrics_format):
+    """Run every request in a JSONL MANIFEST, resuming where a previous run stopped."""
+    if not output_file:
+        output_file = os.path.splitext(manifest)[0] + '.results.jsonl'
+    from .http_client import configure_client
+    from .image_processing import configure_image_encoding, configure_image_executor
+    from .preflight import plan_batch_job
+    configure_client(http2=http2)
+    configure_scheduler(requests_per_minute=requests_per_minute, input_tokens_per_minute=tokens_per_minute)
+    configure_image_encoding(image_format=image_format, quality=image_quality)
+    configure_image_executor(kind=image_executor, workers=image_workers)
+    try:
+        limit = None
+        if dry_run or max_cost is not None or max_tokens_total is not None:
+            requests = plan_batch_job(manifest, output_file)
+            allowed = preflight(requests, dry_run, max_cost, max_tokens_total)
+            if dry_run:
+                return
+            if allowed < len(requests):
+                limit = allowed
+        if backend == 'batch-api':
+            # Entries wait hours for their batch, without their images, so fill whole submissions
+            concurrency = BATCH_API_MAX_REQUESTS
+        summary = asyncio.run(batch_async(manifest, output_file, concurrency, limit=limit, use_cache=not no_cache, refresh_cache=refresh, prompt_cache=prompt_cache, backend=backend))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    deferred = summary['total'] - summary['skipped'] - summary['succeeded'] - summary['failed']
+    click.echo(
+        f"{summary['succeeded']} succeeded, {summary['failed']} failed, "
+        f"{summary['skipped']} skipped" + (f", {deferred} deferred by the cost limit" if deferred else "") +
+        f" of {summary['total']} -> {output_file}",
+        err=True
+    )
+    if prompt_cache:
+        report_prompt_cache()
+    if metrics:
+        click.echo(dumps(get_metrics().summary(), indent=2), err=True)
+    if metrics_file:
+        # Write then rename, so a collector never reads a half-written file
+        with open(metrics_file + '.tmp', 'w') as f:
+            f.write(get_metrics().prometheus(openmetrics=metrics_format == 'openmetrics'))
+        os.replace(metrics_file + '.tmp', metrics_file)
 
-    if persona:
-        return f"As a {persona}, {base_prompt}"
-    return base_prompt
+async def batch_async(manifest, output_file, concurrency, limit=None, **analysis_options):
+    from .http_client import close_client
+    from .batch import run_batch
+    try:
+        return await run_batch(manifest, output_file, concurrency, limit=limit, **analysis_options)
+    finally:
+        await close_client()
+
+@cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--output-file', '-o', type=click.Path(dir_okay=False), help="JSONL file to append results to (default: DIRECTORY with a .results.jsonl suffix)")
+@click.option('--output', type=click.Choice(['json', 'md', 'markdown', 'text']), default='text', help="Format of each result")
+@click.option('--persona', help="Optional persona for analysis")
+@click.option('--prompt', help="Custom prompt for analysis")
+@click.option('--system', help="Custom system prompt for Claude")
+@click.option('--prefill', help="Prefill Claude's response")
+@click.option('--max-tokens', type=int, default=1000, help="Maximum number of tokens in the response")
+@click.option('--concurrency', type=click.IntRange(1), default=BATCH_CONCURRENCY, show_default=True, help="Maximum number of files analyzed at once")
+@click.option('--settle', type=click.FloatRange(0), default=WATCH_SETTLE, show_default=True, help="Seconds a file's size and modification time must stay unchanged before it is analyzed")
+@click.option('--poll-interval', type=click.FloatRange(0.01), default=WATCH_POLL_INTERVAL, show_default=True, help="Seconds between directory scans when inotify isn't used")
+@click.option('--inotify/--poll', 'use_inotify', default=None, help="Watch with inotify or by rescanning the directory (default: inotify where available)")
+@click.option('--once', is_flag=True, help="Analyze the files not yet analyzed and exit instead of watching")
+@click.option('--ledger', type=click.Path(dir_okay=False), default=None, help="File recording which files have been analyzed (default: one per directory and output file under the cache directory)")
+@click.option('--http2/--no-http2', default=None, help="Multiplex API requests over HTTP/2 (requires the 'h2' package)")
+@click.option('--no-cache', is_flag=True, help="Don't read or write the response cache")
+@click.option('--prompt-cache/--no-prompt-cache', default=PROMPT_CACHE, help="Mark the system prompt and the prompt shared by every file as prompt-cache breakpoints")
+@click.option('--requests-per-minute', type=int, default=None, help="Client-side limit on API requests per minute")
+@click.option('--tokens-per-minute', type=int, default=None, help="Client-side limit on estimated input tokens per minute")
+@click.option('--image-format', type=click.Choice(IMAGE_FORMATS), default=None, help="Encoding for uploaded images; 'auto' picks the smallest of JPEG/WebP within the byte budget")
+@click.option('--image-quality', type=click.IntRange(1, 100), default=None, help="JPEG/WebP quality for uploaded images")
+@click.option('--image-executor', type=click.Choice(IMAGE_EXECUTORS), default=None, help="Prepare images on a thread pool or a process pool")
+@click.option('--image-workers', type=click.IntRange(0), default=None, help="Size of the image preparation pool (0 for one worker per CPU)")
+@click.option('--metrics', is_flag=True, help="Print per-stage timings and counters as JSON on stderr when the watch ends")
+def watch(directory, output_file, output, persona, prompt, system, prefill, max_tokens, concurrency, settle, poll_interval, use_inotify, once, ledger, http2, no_cache, prompt_cache, requests_per_minute, tokens_per_minute, image_format, image_quality, image_executor, image_workers, metrics):
+    """Analyze the images in DIRECTORY, then each new or changed one as it arrives."""
+    if not output_file:
+        output_file = os.path.normpath(directory) + '.results.jsonl'
+    from .http_client import configure_client
+    from .image_processing import configure_image_encoding, configure_image_executor
+    from .watch import WatchLedger
+    configure_client(http2=http2)
+    configure_scheduler(requests_per_minute=requests_per_minute, input_tokens_per_minute=tokens_per_minute)
+    configure_image_encoding(image_format=image_format, quality=image_quality)
+    configure_image_executor(kind=image_executor, workers=image_workers)
+    watch_options = dict(
+        ledger=WatchLedger(ledger) if ledger else None, output=output, prompt=prompt, persona=persona,
+        system=system, max_tokens=max_tokens, prefill=prefill, concurrency=concurrency, settle=settle,
+        poll_interval=poll_interval, use_inotify=use_inotify, once=once, use_cache=not no_cache, prompt_cache=prompt_cache
+    )
+    if not once:
+        click.echo(f"Watching {directory} -> {output_file} (Ctrl-C to stop)", err=True)
+    try:
+        summary = asyncio.run(watch_async(directory, output_file, **watch_options))
+    except KeyboardInterrupt:
+        summary = None
+    except OSError as e:
+        raise click.ClickException(str(e))
+    if summary is not None:
+        click.echo(f"{summary['succeeded']} succeeded, {summary['failed']} failed -> {output_file}", err=True)
+    if prompt_cache:
+        report_prompt_cache()
+    if metrics:
+        click.echo(dumps(get_metrics().summary(), indent=2), err=True)
+
+async def watch_async(directory, output_file, **watch_options):
+    from .http_client import close_client
+    from .watch import run_watch
+    try:
+        return await run_watch(directory, output_file, **watch_options)
+    finally:
+        await close_client()
+
+@cli.command('mock-server')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=8765, show_default=True)
+@click.option('--latency', type=float, default=0.0, help="Seconds before each response starts")
+@click.option('--token-delay', type=float, default=0.0, help="Seconds between streamed words")
+@click.option('--rate-limit-rate', type=click.FloatRange(0, 1), default=0.0, help="Fraction of requests answered with 429")
+@click.option('--overload-rate', type=click.FloatRange(0, 1), default=0.0, help="Fraction of requests answered with 529")
+@click.option('--retry-after', type=float, default=0.0, help="retry-after seconds sent with injected errors")
+def mock_server(host, port, latency, token_delay, rate_limit_rate, overload_rate, retry_after):
+    """Serve a local stand-in for the Messages API; point ANTHROPIC_API_URL at it."""
+    from .mock_server import MockAnthropicServer
+    server = MockAnthropicServer(host, port, latency=latency, token_delay=token_delay, rate_limit_rate=rate_limit_rate, overload_rate=overload_rate, retry_after=retry_after)
+    click.echo(f"export ANTHROPIC_API_URL={server.url}", err=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
 
 # ... (rest of the file content)
 
@@ -1,22 +1,99 @@
 import os
-import yaml
+import functools
 from typing import Dict, List, Tuple
 
-# Custom YAML loader to handle !!python/tuple
-class CustomLoader(yaml.SafeLoader):
-    pass
-
 def construct_python_tuple(loader, node):
     return tuple(loader.construct_sequence(node))
 
-CustomLoader.add_constructor('tag:yaml.org,2002:python/tuple', construct_python_tuple)
+@functools.lru_cache(maxsize=None)
+def _custom_loader():
+    # yaml is only imported when there is a config file to read or write
+    import yaml
+
+    # Custom YAML loader to handle !!python/tuple
+    class CustomLoader(yaml.SafeLoader):
+        pass
+
+    CustomLoader.add_constructor('tag:yaml.org,2002:python/tuple', construct_python_tuple)
+    return CustomLoader
 
 # Default values
 ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
+# Point at a local stand-in such as `claude-vision mock-server` to test without the real API
+ANTHROPIC_API_URL: str = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
 DEFAULT_PROMPT: str = "Describe this image in detail."
 MAX_IMAGE_SIZE: Tuple[int, int] = (1568, 1568)
 SUPPORTED_FORMATS: List[str] = ['JPEG', 'PNG', 'GIF', 'WEBP']
 
+# Image payload encoding: 'png', 'jpeg', 'webp' or 'auto' (smallest of jpeg/webp within the byte budget)
+IMAGE_FORMAT: str = 'png'
+IMAGE_FORMATS = ('png', 'jpeg', 'webp', 'auto')
+IMAGE_QUALITY: int = 85
+IMAGE_BYTE_BUDGET: int = 3_750_000  # ~5MB once base64-encoded, the API's per-image limit
+
+# Pool that decodes, resizes and encodes images: 'thread' or 'process' (0 workers = one per CPU)
+IMAGE_EXECUTOR: str = 'thread'
+IMAGE_EXECUTORS = ('thread', 'process')
+IMAGE_WORKERS: int = 0
+
+# Token-budget planning (0 disables the per-request budget)
+REQUEST_TOKEN_BUDGET: int = 0
+MIN_IMAGE_TOKENS: int = 400
+
+# Pricing used for cost estimates, in USD per million tokens
+INPUT_TOKEN_PRICE: float = 3.0
+OUTPUT_TOKEN_PRICE: float = 15.0
+
+# Mark shared system prompts, images and prompt prefixes as prompt-cache breakpoints
+PROMPT_CACHE: bool = False
+
+# Serializer for JSON output: 'json' (standard library), 'orjson', or 'auto' (orjson when installed)
+JSON_BACKEND: str = 'auto'
+
+# HTTP connection pool
+HTTP_MAX_CONNECTIONS: int = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+HTTP_KEEPALIVE_EXPIRY: float = 30.0
+HTTP2: bool = False
+
+# Client-side rate limiting (0 disables a limit)
+REQUESTS_PER_MINUTE: int = 0
+INPUT_TOKENS_PER_MINUTE: int = 0
+MAX_CONCURRENCY: int = 16
+# Video frame requests in flight at once
+VIDEO_CONCURRENCY: int = 4
+# Manifest entries (batch) and watched files analyzed at once
+BATCH_CONCURRENCY: int = 4
+MAX_RETRIES: int = 5
+
+# How requests are sent: one Messages API call each, or packed into Message Batches submissions
+BACKENDS = ('messages', 'batch-api')
+
+# Message Batches backend (--backend batch-api). A submission is sent once it holds
+# BATCH_API_MAX_REQUESTS requests or BATCH_API_MAX_BYTES of JSON (API limits: 100,000 and 256MB),
+# or after BATCH_API_LINGER seconds without a new request. Queued requests are spooled to a
+# temporary file rather than kept in memory, and BATCH_API_MAX_REQUESTS of them are kept in flight.
+BATCH_API_MAX_REQUESTS: int = 10_000
+BATCH_API_MAX_BYTES: int = 200 * 1024 * 1024
+BATCH_API_LINGER: float = 2.0
+# Batch status polling starts at the first interval and backs off to the second, in seconds
+BATCH_API_POLL_INTERVAL: float = 10.0
+BATCH_API_MAX_POLL_INTERVAL: float = 300.0
+
+# Watch mode: a new or changed file is analyzed once its size and modification time have
+# stayed the same for WATCH_SETTLE seconds. Without inotify the directory is rescanned every
+# WATCH_POLL_INTERVAL seconds.
+WATCH_SETTLE: float = 2.0
+WATCH_POLL_INTERVAL: float = 1.0
+
+# On-disk caches
+CACHE_DIR: str = "~/.cache/claude_vision"
+RESPONSE_CACHE_MAX_BYTES: int = 100 * 1024 * 1024
+RESPONSE_CACHE_TTL: int = 7 * 24 * 60 * 60
+IMAGE_CACHE_ENABLED: bool = True
+IMAGE_CACHE_MAX_BYTES: int = 500 * 1024 * 1024
+IMAGE_CACHE_CONTENT_HASH: bool = False
+
 DEFAULT_PERSONAS: Dict[str, str] = {
     "art_critic": "You are an experienced art critic with a keen eye for detail and composition.",
     "botanist": "You are a knowledgeable botanist specializing in plant identification and ecology.",
@@ -34,43 +111,80 @@ def get_config_path() -> str:
     home = os.path.expanduser("~")
     return os.path.join(home, ".config", "claude_vision", "config.yaml")
 
-def load_config() -> Dict:
-    """Load the config from file or return an empty dict if not found."""
-    config_path = get_config_path()
+@functools.lru_cache(maxsize=None)
+def _read_config(config_path: str) -> Dict:
     if os.path.exists(config_path):
+        import yaml
         try:
             with open(config_path, 'r') as f:
-                return yaml.load(f, Loader=CustomLoader)
+                return yaml.load(f, Loader=_custom_loader()) or {}
         except yaml.YAMLError as e:
             print(f"Error loading config file: {e}")
     return {}
 
+def load_config() -> Dict:
+    """Load the config from file or return an empty dict if not found. The file is read once per process."""
+    return dict(_read_config(get_config_path()))
+
 def save_config(config: Dict) -> None:
     """Save the config to file."""
+    import yaml
     config_path = get_config_path()
     os.makedirs(os.path.dirname(config_path), exist_ok=True)
     with open(config_path, 'w') as f:
         yaml.dump(config, f, default_flow_style=False)
+    _read_config.cache_clear()
 
-# Load the config
-CONFIG: Dict = load_config()
-
-# Update the config with default values if they're missing
+# Default values, overridden by any keys set in the config file
 default_values = {
     'ANTHROPIC_API_KEY': ANTHROPIC_API_KEY,
+    'ANTHROPIC_API_URL': ANTHROPIC_API_URL,
     'DEFAULT_PROMPT': DEFAULT_PROMPT,
     'MAX_IMAGE_SIZE': MAX_IMAGE_SIZE,
     'SUPPORTED_FORMATS': SUPPORTED_FORMATS,
+    'IMAGE_FORMAT': IMAGE_FORMAT,
+    'IMAGE_QUALITY': IMAGE_QUALITY,
+    'IMAGE_BYTE_BUDGET': IMAGE_BYTE_BUDGET,
+    'IMAGE_EXECUTOR': IMAGE_EXECUTOR,
+    'IMAGE_WORKERS': IMAGE_WORKERS,
+    'REQUEST_TOKEN_BUDGET': REQUEST_TOKEN_BUDGET,
+    'MIN_IMAGE_TOKENS': MIN_IMAGE_TOKENS,
+    'INPUT_TOKEN_PRICE': INPUT_TOKEN_PRICE,
+    'OUTPUT_TOKEN_PRICE': OUTPUT_TOKEN_PRICE,
+    'PROMPT_CACHE': PROMPT_CACHE,
+    'JSON_BACKEND': JSON_BACKEND,
+    'HTTP_MAX_CONNECTIONS': HTTP_MAX_CONNECTIONS,
+    'HTTP_MAX_KEEPALIVE_CONNECTIONS': HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    'HTTP_KEEPALIVE_EXPIRY': HTTP_KEEPALIVE_EXPIRY,
+    'HTTP2': HTTP2,
+    'REQUESTS_PER_MINUTE': REQUESTS_PER_MINUTE,
+    'INPUT_TOKENS_PER_MINUTE': INPUT_TOKENS_PER_MINUTE,
+    'MAX_CONCURRENCY': MAX_CONCURRENCY,
+    'MAX_RETRIES': MAX_RETRIES,
+    'VIDEO_CONCURRENCY': VIDEO_CONCURRENCY,
+    'BATCH_CONCURRENCY': BATCH_CONCURRENCY,
+    'BATCH_API_MAX_REQUESTS': BATCH_API_MAX_REQUESTS,
+    'BATCH_API_MAX_BYTES': BATCH_API_MAX_BYTES,
+    'BATCH_API_LINGER': BATCH_API_LINGER,
+    'BATCH_API_POLL_INTERVAL': BATCH_API_POLL_INTERVAL,
+    'BATCH_API_MAX_POLL_INTERVAL': BATCH_API_MAX_POLL_INTERVAL,
+    'WATCH_SETTLE': WATCH_SETTLE,
+    'WATCH_POLL_INTERVAL': WATCH_POLL_INTERVAL,
+    'CACHE_DIR': CACHE_DIR,
+    'RESPONSE_CACHE_MAX_BYTES': RESPONSE_CACHE_MAX_BYTES,
+    'RESPONSE_CACHE_TTL': RESPONSE_CACHE_TTL,
+    'IMAGE_CACHE_ENABLED': IMAGE_CACHE_ENABLED,
+    'IMAGE_CACHE_MAX_BYTES': IMAGE_CACHE_MAX_BYTES,
+    'IMAGE_CACHE_CONTENT_HASH': IMAGE_CACHE_CONTENT_HASH,
     'DEFAULT_PERSONAS': DEFAULT_PERSONAS,
     'DEFAULT_STYLES': DEFAULT_STYLES,
 }
 
-for key, value in default_values.items():
-    if key not in CONFIG:
-        CONFIG[key] = value
-
-# Save the updated config
-save_config(CONFIG)
+# Loading never writes: missing keys fall back to the defaults above
+CONFIG: Dict = {**default_values, **load_config()}
+# A saved config file holds every key, so let the environment still redirect the client
+if os.getenv("ANTHROPIC_API_URL"):
+    CONFIG['ANTHROPIC_API_URL'] = os.environ["ANTHROPIC_API_URL"]
 
 # Update global variables with loaded config
-globals().update(CONFIG)
\ No newline at end of file
+globals().update(CONFIG)
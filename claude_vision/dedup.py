@@ -0,0 +1,83 @@
+import io
+import base64
+from PIL import Image
+from typing import List, Optional, Tuple, Dict
+from .metrics import span
+
+HASH_SIZE = 8
+
+def difference_hash(image, hash_size: int = HASH_SIZE) -> int:
+    """
+    Compute a difference hash (dHash): shrink to (hash_size + 1) x hash_size greyscale pixels
+    and record whether each pixel is brighter than its right-hand neighbour.
+
+    Accepts a PIL image or an RGB numpy array.
+    """
+    with span('dedup.hash'):
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+        small = image.convert('L').resize((hash_size + 1, hash_size), Image.BOX)
+        pixels = small.tobytes()
+        value = 0
+        for row in range(hash_size):
+            for col in range(hash_size):
+                left = pixels[row * (hash_size + 1) + col]
+                right = pixels[row * (hash_size + 1) + col + 1]
+                value = (value << 1) | (left > right)
+        return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class FrameDeduplicator:
+    """
+    Collapse runs of near-identical frames onto the first frame of the run.
+
+    Each frame is compared with the last frame that was kept rather than the previous frame,
+    so a slow drift can't chain an entire video onto a single reference.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.reference_hash: Optional[int] = None
+        self.reference_key = None
+        self.skipped = 0
+
+    def check(self, key, frame_hash: int):
+        """
+        Return the key of the kept frame that this one duplicates, or None if it should be kept.
+        """
+        if self.reference_hash is not None and hamming_distance(frame_hash, self.reference_hash) <= self.threshold:
+            self.skipped += 1
+            return self.reference_key
+        self.reference_hash = frame_hash
+        self.reference_key = key
+        return None
+
+    def restore(self, key, frame_hash: Optional[int]) -> None:
+        """
+        Make a frame kept by an earlier run the reference, as check() did when it kept it.
+        Without its hash, the next frame is kept.
+        """
+        self.reference_hash = frame_hash
+        self.reference_key = key
+
+def dedupe_base64_images(base64_images: List[str], threshold: int) -> Tuple[List[str], Dict[int, int]]:
+    """
+    Drop near-duplicate images from a list of encoded images.
+
+    Returns the kept images and a mapping from each dropped image's index to the index of
+    the kept image it was collapsed into.
+    """
+    deduplicator = FrameDeduplicator(threshold)
+    kept = []
+    duplicate_of = {}
+    for index, base64_image in enumerate(base64_images):
+        with Image.open(io.BytesIO(base64.b64decode(base64_image))) as image:
+            frame_hash = difference_hash(image)
+        original = deduplicator.check(index, frame_hash)
+        if original is None:
+            kept.append(base64_image)
+        else:
+            duplicate_of[index] = original
+    return kept, duplicate_of
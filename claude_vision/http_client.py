@@ -0,0 +1,87 @@
+import time
+import asyncio
+import httpx
+from typing import Optional, Dict, Any
+from .config import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY, HTTP2
+from .metrics import record
+from .utils import logger
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_client_settings: Dict[str, Any] = {
+    'max_connections': HTTP_MAX_CONNECTIONS,
+    'max_keepalive_connections': HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    'keepalive_expiry': HTTP_KEEPALIVE_EXPIRY,
+    'http2': HTTP2,
+}
+
+async def _mark_sent(request: httpx.Request) -> None:
+    request.extensions['claude_vision_sent'] = time.perf_counter()
+
+async def _record_first_byte(response: httpx.Response) -> None:
+    # Response hooks run once the headers are in, before the body is read
+    sent = response.request.extensions.get('claude_vision_sent')
+    if sent is not None:
+        record('request.ttfb', time.perf_counter() - sent)
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def create_client(
+    max_connections: int = HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+    http2: bool = HTTP2,
+) -> httpx.AsyncClient:
+    """
+    Create an AsyncClient with the given connection pool limits.
+    """
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 requested but the 'h2' package is not installed; falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    logger.debug(f"Creating shared HTTP client: limits={limits}, http2={http2}")
+    return httpx.AsyncClient(limits=limits, http2=http2, event_hooks={'request': [_mark_sent], 'response': [_record_first_byte]})
+
+def configure_client(**settings) -> None:
+    """
+    Override the pool settings used by get_client. Takes effect the next time a client is created.
+    """
+    unknown = set(settings) - set(_client_settings)
+    if unknown:
+        raise ValueError(f"Unknown HTTP client settings: {', '.join(sorted(unknown))}")
+    _client_settings.update({key: value for key, value in settings.items() if value is not None})
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the shared AsyncClient for the running event loop, creating it on first use.
+
+    Connections are bound to the loop they were opened on, so a new client is created
+    whenever the running loop changes (e.g. across separate asyncio.run calls).
+    """
+    global _client, _client_loop
+    loop = asyncio.get_event_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = create_client(**_client_settings)
+        _client_loop = loop
+    return _client
+
+async def close_client() -> None:
+    """
+    Close the shared client and release its pooled connections.
+    """
+    global _client, _client_loop
+    client, loop = _client, _client_loop
+    _client, _client_loop = None, None
+    # A client opened on another (finished) loop can't be closed from this one
+    if client is not None and not client.is_closed and loop is asyncio.get_event_loop():
+        await client.aclose()
@@ -1,32 +1,140 @@
 import io
+import os
 import base64
+import hashlib
 from PIL import Image
 import httpx
 import asyncio
-from typing import List, Union
-from .config import MAX_IMAGE_SIZE, SUPPORTED_FORMATS
+import sys
+from typing import List, Union, Optional, Tuple, TYPE_CHECKING
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from .config import MAX_IMAGE_SIZE, SUPPORTED_FORMATS, IMAGE_CACHE_ENABLED, IMAGE_CACHE_CONTENT_HASH, IMAGE_FORMAT, IMAGE_FORMATS, IMAGE_QUALITY, IMAGE_BYTE_BUDGET, IMAGE_EXECUTOR, IMAGE_EXECUTORS, IMAGE_WORKERS
 from .utils import logger
 from .exceptions import InvalidRequestError
-import numpy as np
-import cv2
+from .http_client import get_client
+from .cache import get_image_cache
+from .planner import plan_requests, MAX_IMAGES_PER_REQUEST
+from .metrics import span, get_metrics, call_with_spans
 
-async def fetch_image_from_url(url: str, client: httpx.AsyncClient) -> Image.Image:
+if TYPE_CHECKING:
+    import numpy as np
+
+async def fetch_image_data(url: str, client: httpx.AsyncClient) -> bytes:
     try:
         response = await client.get(url)
         response.raise_for_status()
-        return Image.open(io.BytesIO(response.content))
+        return response.content
     except httpx.HTTPStatusError as e:
         logger.error(f"Error fetching image from URL {url}: {str(e)}")
         raise InvalidRequestError(f"Failed to fetch image from URL: {url}")
 
-def convert_image_to_base64(image: Image.Image) -> str:
+async def fetch_image_from_url(url: str, client: httpx.AsyncClient) -> Image.Image:
+    return Image.open(io.BytesIO(await fetch_image_data(url, client)))
+
+_executor_settings = {
+    'kind': IMAGE_EXECUTOR,
+    'workers': IMAGE_WORKERS,
+}
+_image_executor: Optional[Executor] = None
+
+def configure_image_executor(**settings) -> None:
+    """
+    Choose the pool that decodes, resizes and encodes images: 'thread' or 'process', and its size
+    (0 for one worker per CPU).
+    """
+    global _image_executor
+    if settings.get('kind') not in (None,) + IMAGE_EXECUTORS:
+        raise ValueError(f"Unsupported image executor: {settings['kind']}")
+    _executor_settings.update({key: value for key, value in settings.items() if value is not None})
+    if _image_executor is not None:
+        _image_executor.shutdown(wait=False)
+        _image_executor = None
+
+def get_image_executor() -> Executor:
+    """
+    Return the shared image preparation pool, creating it on first use.
+
+    Pillow releases the GIL while decoding, resampling and compressing, so threads scale
+    across cores for most images; a process pool avoids the remaining Python overhead at
+    the cost of pickling each source and result.
+    """
+    global _image_executor
+    if _image_executor is None:
+        workers = _executor_settings['workers'] or os.cpu_count() or 1
+        if _executor_settings['kind'] == 'process':
+            _image_executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _image_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='claude-vision-image')
+    return _image_executor
+
+LOSSY_FORMATS = ('jpeg', 'webp')
+MIN_IMAGE_QUALITY = 40
+QUALITY_STEP = 10
+
+_encoding_settings = {
+    'image_format': IMAGE_FORMAT,
+    'quality': IMAGE_QUALITY,
+    'byte_budget': IMAGE_BYTE_BUDGET,
+}
+
+def configure_image_encoding(**settings) -> None:
+    """
+    Override the default payload encoding used by convert_image_to_base64.
+    """
+    if settings.get('image_format') not in (None,) + IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {settings['image_format']}")
+    _encoding_settings.update({key: value for key, value in settings.items() if value is not None})
+
+def encoding_settings() -> dict:
+    return dict(_encoding_settings)
+
+def _save(image: Image.Image, image_format: str, quality: int) -> bytes:
+    if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image_format == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
     buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    if image_format in LOSSY_FORMATS:
+        image.save(buffered, format=image_format.upper(), quality=quality)
+    else:
+        image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def encode_image(image: Image.Image, image_format: str = 'png', quality: int = IMAGE_QUALITY, byte_budget: Optional[int] = None) -> Tuple[bytes, str]:
+    """
+    Encode an image for upload and return (data, format).
+
+    'auto' tries JPEG and WebP (WebP and PNG for images with transparency) and keeps the
+    smallest. Lossy encodings over byte_budget are retried at lower quality.
+    """
+    if image_format == 'auto':
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        candidates = ('webp', 'png') if has_alpha else LOSSY_FORMATS
+    else:
+        candidates = (image_format,)
+
+    data, chosen = min(((_save(image, fmt, quality), fmt) for fmt in candidates), key=lambda encoded: len(encoded[0]))
+    while byte_budget and len(data) > byte_budget and chosen in LOSSY_FORMATS and quality > MIN_IMAGE_QUALITY:
+        quality = max(MIN_IMAGE_QUALITY, quality - QUALITY_STEP)
+        data = _save(image, chosen, quality)
+    if byte_budget and len(data) > byte_budget:
+        logger.warning(f"Encoded image is {len(data)} bytes, over the {byte_budget} byte budget")
+    return data, chosen
+
+def convert_image_to_base64(image: Image.Image, image_format: Optional[str] = None, quality: Optional[int] = None, byte_budget: Optional[int] = None) -> str:
+    with span('image.encode'):
+        data, _ = encode_image(
+            image,
+            image_format or _encoding_settings['image_format'],
+            quality or _encoding_settings['quality'],
+            byte_budget or _encoding_settings['byte_budget'],
+        )
+        return base64.b64encode(data).decode('utf-8')
 
 def check_and_resize_image(image: Image.Image, max_size: tuple = MAX_IMAGE_SIZE) -> Image.Image:
     if image.width > max_size[0] or image.height > max_size[1]:
-        image.thumbnail(max_size, Image.LANCZOS)
+        with span('image.resize'):
+            image.thumbnail(max_size, Image.LANCZOS)
     return image
 
 def estimate_image_tokens(image: Image.Image) -> int:
@@ -40,41 +148,145 @@ def open_image(image_path: str) -> Image.Image:
         logger.error(f"Error opening image {image_path}: {str(e)}")
         raise InvalidRequestError(f"Failed to open image: {image_path}")
 
-async def process_image_source(source: Union[str, Image.Image, io.BytesIO, np.ndarray], client: httpx.AsyncClient) -> str:
+def image_cache_key(source: Union[str, io.BytesIO], max_size: tuple = MAX_IMAGE_SIZE, encoding: Optional[dict] = None) -> Optional[str]:
+    """
+    Identify the encoded payload a local file or in-memory buffer will produce.
+
+    Files are keyed by path, size and mtime (or by content when IMAGE_CACHE_CONTENT_HASH is
+    set); buffers by their content. Returns None for sources that can't be cached.
+    """
+    digest = hashlib.sha256()
+    encoding = encoding or _encoding_settings
+    digest.update(repr((tuple(max_size), sorted(encoding.items()))).encode('utf-8'))
+    if isinstance(source, io.BytesIO):
+        digest.update(source.getbuffer())
+    elif isinstance(source, str) and not source.startswith(('http://', 'https://')):
+        try:
+            stat = os.stat(source)
+            if IMAGE_CACHE_CONTENT_HASH:
+                with open(source, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+            else:
+                digest.update(repr((os.path.abspath(source), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        except OSError:
+            return None
+    else:
+        return None
+    return digest.hexdigest()
+
+def is_array(source) -> bool:
+    # A numpy array can only exist if numpy was imported by the caller, so don't import it here
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(source, numpy.ndarray)
+
+def probe_image_size(source: Union[str, Image.Image, io.BytesIO, 'np.ndarray']) -> Tuple[int, int]:
+    """
+    Read an image's dimensions without decoding it. URLs are assumed to be as large as MAX_IMAGE_SIZE.
+    """
+    if isinstance(source, Image.Image):
+        return source.size
+    if is_array(source):
+        return source.shape[1], source.shape[0]
+    if isinstance(source, str) and source.startswith(('http://', 'https://')):
+        return tuple(MAX_IMAGE_SIZE)
     try:
+        with Image.open(source) as image:
+            size = image.size
+    except Exception as e:
+        logger.error(f"Error reading image size: {str(e)}")
+        raise InvalidRequestError(f"Failed to open image: {source}")
+    if isinstance(source, io.BytesIO):
+        source.seek(0)
+    return size
+
+def prepare_image(source: Union[str, Image.Image, io.BytesIO, 'np.ndarray'], max_size: tuple = MAX_IMAGE_SIZE, encoding: Optional[dict] = None) -> str:
+    """
+    Open, resize and base64-encode a local image source. Runs in the image executor, so it
+    takes the encoding settings explicitly rather than reading this process's globals.
+    """
+    with span('image.decode'):
         if isinstance(source, str):
-            if source.startswith(('http://', 'https://')):
-                image = await fetch_image_from_url(source, client)
-            else:
-                image = open_image(source)
+            image = open_image(source)
         elif isinstance(source, Image.Image):
             image = source
         elif isinstance(source, io.BytesIO):
             image = Image.open(source)
-        elif isinstance(source, np.ndarray):
-            image = Image.fromarray(cv2.cvtColor(source, cv2.COLOR_BGR2RGB))
+        elif is_array(source):
+            # OpenCV arrays are BGR
+            image = Image.fromarray(source[:, :, ::-1])
         else:
             raise InvalidRequestError(f"Unsupported image source type: {type(source)}")
-        
+
         if image.format not in SUPPORTED_FORMATS:
             image = image.convert('RGB')
 
-        image = check_and_resize_image(image)
-        estimated_tokens = estimate_image_tokens(image)
-        logger.info(f"Estimated tokens for image: {estimated_tokens}")
-        
-        return convert_image_to_base64(image)
+    image = check_and_resize_image(image, max_size)
+    estimated_tokens = estimate_image_tokens(image)
+    logger.info(f"Estimated tokens for image: {estimated_tokens}")
+
+    return convert_image_to_base64(image, **(encoding or _encoding_settings))
+
+async def process_image_source(source: Union[str, Image.Image, io.BytesIO, 'np.ndarray'], client: httpx.AsyncClient, use_cache: bool = IMAGE_CACHE_ENABLED, max_size: tuple = MAX_IMAGE_SIZE) -> str:
+    with span('image.cache'):
+        cache_key = image_cache_key(source, max_size) if use_cache else None
+        cached = get_image_cache().get(cache_key) if cache_key else None
+    if cached is not None:
+        logger.debug(f"Image cache hit for {source if isinstance(source, str) else type(source).__name__}")
+        return cached.decode('ascii')
+
+    try:
+        if isinstance(source, str) and source.startswith(('http://', 'https://')):
+            with span('image.fetch'):
+                source = io.BytesIO(await fetch_image_data(source, client))
+        # Decoding, resizing and encoding are CPU-bound; keep them off the event loop. Their
+        # spans are recorded in the worker and merged here, since it may be another process.
+        with span('image.prepare'):
+            base64_image, spans = await asyncio.get_event_loop().run_in_executor(
+                get_image_executor(), call_with_spans, prepare_image, source, max_size, encoding_settings()
+            )
+        get_metrics().merge(spans)
+        if cache_key:
+            get_image_cache().set(cache_key, base64_image.encode('ascii'))
+        return base64_image
     except Exception as e:
         logger.error(f"Error processing image source: {str(e)}")
-        raise InvalidRequestError(f"Failed to process image: {str(e)}")    
-    
-    
-async def process_multiple_images(image_sources: List[Union[str, Image.Image, io.BytesIO]], process_as_group: bool = False) -> List[str]:
-    MAX_IMAGES = 20
+        raise InvalidRequestError(f"Failed to process image: {str(e)}")
+
+
+async def process_multiple_images(image_sources: List[Union[str, Image.Image, io.BytesIO]], process_as_group: bool = False, client: Optional[httpx.AsyncClient] = None, token_budget: Optional[int] = None, text_tokens: int = 0) -> List[str]:
+    """
+    Prepare up to MAX_IMAGES images for a single request.
+
+    With token_budget, each image is resized so that together they fit in that many input tokens.
+    """
+    MAX_IMAGES = MAX_IMAGES_PER_REQUEST
 
     if len(image_sources) > MAX_IMAGES:
         raise InvalidRequestError(f"Too many images. Maximum allowed is {MAX_IMAGES}, but {len(image_sources)} were provided.")
 
-    async with httpx.AsyncClient() as client:
-        tasks = [process_image_source(source, client) for source in image_sources[:MAX_IMAGES]]
-        return await asyncio.gather(*tasks)
+    client = client or get_client()
+    if token_budget:
+        sizes = [probe_image_size(source) for source in image_sources]
+        plan = plan_requests(sizes, token_budget, max_images=MAX_IMAGES, min_tokens=0, text_tokens=text_tokens)
+        max_sizes = [size for group in plan for _, size in group]
+    else:
+        max_sizes = [MAX_IMAGE_SIZE] * len(image_sources)
+    tasks = [process_image_source(source, client, max_size=max_size) for source, max_size in zip(image_sources[:MAX_IMAGES], max_sizes)]
+    return await asyncio.gather(*tasks)
+
+def plan_image_requests(image_sources: List[Union[str, Image.Image, io.BytesIO]], token_budget: int, text_tokens: int = 0, max_images: int = MAX_IMAGES_PER_REQUEST) -> List[List[Tuple[Union[str, Image.Image, io.BytesIO], Tuple[int, int]]]]:
+    """
+    Split any number of images into the fewest requests that fit token_budget, reading only
+    their headers. Returns each request's images paired with the size planned for them.
+    """
+    sizes = [probe_image_size(source) for source in image_sources]
+    plan = plan_requests(sizes, token_budget, max_images=max_images, text_tokens=text_tokens)
+    return [[(image_sources[index], size) for index, size in group] for group in plan]
+
+async def prepare_planned_images(planned: List[Tuple[Union[str, Image.Image, io.BytesIO], Tuple[int, int]]], client: Optional[httpx.AsyncClient] = None) -> List[str]:
+    """
+    Prepare one request's images, each at its planned size.
+    """
+    client = client or get_client()
+    return await asyncio.gather(*(process_image_source(source, client, max_size=size) for source, size in planned))
@@ -0,0 +1,144 @@
+import io
+import asyncio
+import itertools
+from typing import Iterable, List, Dict, Any, Optional, Tuple, Union, AsyncIterator
+from PIL import Image
+from .image_processing import plan_image_requests, prepare_planned_images
+from .claude_integration import claude_vision_analysis, warn_if_uncacheable
+from .json_utils import format_json_output
+from .planner import MAX_IMAGES_PER_REQUEST
+from .config import VIDEO_CONCURRENCY, MAX_IMAGE_SIZE
+from .exceptions import InvalidRequestError
+from .utils import logger, generate_prompt
+
+_DONE = object()
+# Images planned together when splitting by token budget. Packing is only contiguous, so each
+# window boundary costs at most one extra request.
+PLAN_WINDOW = 10 * MAX_IMAGES_PER_REQUEST
+
+def chunked(sources: Iterable, size: int) -> Iterable[List]:
+    iterator = iter(sources)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def plan_chunks(
+    sources: Iterable,
+    chunk_size: int,
+    token_budget: Optional[int] = None,
+    text_tokens: int = 0,
+) -> Iterable[List[Tuple[Any, Tuple[int, int]]]]:
+    """
+    Lazily split sources into requests of (source, size) pairs: chunk_size images at a time, or
+    with token_budget into the fewest requests of at most chunk_size images that fit it.
+    """
+    if not token_budget:
+        for chunk in chunked(sources, chunk_size):
+            yield [(source, MAX_IMAGE_SIZE) for source in chunk]
+        return
+    for window in chunked(sources, max(PLAN_WINDOW, chunk_size)):
+        try:
+            planned = plan_image_requests(window, token_budget, text_tokens, max_images=chunk_size)
+        except InvalidRequestError as e:
+            # An unreadable image fails its own chunk when prepared, not the whole run
+            logger.warning(f"Can't plan {len(window)} images by token budget ({e}); sending them {chunk_size} per request")
+            planned = [[(source, MAX_IMAGE_SIZE) for source in chunk] for chunk in chunked(window, chunk_size)]
+        yield from planned
+
+def source_name(source: Union[str, Image.Image, io.BytesIO]) -> Optional[str]:
+    return source if isinstance(source, str) else None
+
+async def iter_image_set_results(
+    image_sources: Iterable[Union[str, Image.Image, io.BytesIO]],
+    output: str,
+    prompt: Optional[str] = None,
+    persona: Optional[str] = None,
+    multi_angle: bool = False,
+    multi_object: bool = False,
+    chunk_size: int = MAX_IMAGES_PER_REQUEST,
+    concurrency: int = VIDEO_CONCURRENCY,
+    ordered: bool = True,
+    token_budget: Optional[int] = None,
+    text_tokens: int = 0,
+    **analysis_options
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Analyze any number of images, chunk_size per request, and yield one
+    {"index", "files", "result"} or {"index", "files", "error"} record per chunk.
+
+    `image_sources` is read lazily and at most `concurrency` chunks are prepared or in
+    flight at once, so only the images of those requests are ever held in memory. With
+    token_budget, images are instead split into the fewest requests of at most chunk_size
+    that fit it, and resized to share each request's budget. Records
+    are yielded in input order, or as their requests complete with `ordered=False`. A chunk
+    that fails gets an "error" record and doesn't stop the others.
+
+    Without a prompt, each chunk gets the persona prompt for its number of images, with
+    multi_angle or multi_object as given. With JSON
+    output, each result is the parsed JSON object.
+    """
+    if analysis_options.get('prompt_cache'):
+        warn_if_uncacheable(output, analysis_options.get('system'), prompt or generate_prompt(persona, multi_angle, multi_object, chunk_size))
+    chunks = asyncio.Queue(maxsize=concurrency)
+    results = asyncio.Queue()
+
+    async def read_stage():
+        for index, chunk in enumerate(plan_chunks(image_sources, chunk_size, token_budget, text_tokens)):
+            await chunks.put((index, chunk))
+        for _ in range(concurrency):
+            await chunks.put(_DONE)
+
+    async def request_stage():
+        while True:
+            item = await chunks.get()
+            if item is _DONE:
+                return
+            index, chunk = item
+            record = {"index": index, "files": [source_name(source) for source, _ in chunk]}
+            try:
+                base64_images = await prepare_planned_images(chunk)
+                chunk_prompt = prompt or generate_prompt(persona, multi_angle, multi_object, len(chunk))
+                if analysis_options.get('prompt_cache'):
+                    # Every chunk shares the instructions, so they go first as a cached prefix
+                    request = claude_vision_analysis(base64_images, None, output, prompt_prefix=chunk_prompt, **analysis_options)
+                else:
+                    request = claude_vision_analysis(base64_images, chunk_prompt, output, **analysis_options)
+                # Only the request holds the images, so a batch-api request can drop them once it's queued
+                del base64_images
+                result = await request
+                record["result"] = format_json_output(result, "description")['result'] if output == 'json' else result
+            except Exception as e:
+                logger.error(f"Images {record['files']} failed: {e}")
+                record["error"] = str(e)
+            await results.put(record)
+
+    tasks = [asyncio.ensure_future(read_stage())]
+    tasks += [asyncio.ensure_future(request_stage()) for _ in range(concurrency)]
+
+    async def supervise():
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await results.put(_DONE)
+
+    supervisor = asyncio.ensure_future(supervise())
+    pending = {}
+    next_index = 0
+    try:
+        while True:
+            record = await results.get()
+            if record is _DONE:
+                break
+            if not ordered:
+                yield record
+                continue
+            pending[record['index']] = record
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+        await supervisor
+    finally:
+        for task in tasks + [supervisor]:
+            task.cancel()
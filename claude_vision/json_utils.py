@@ -1,7 +1,18 @@
 
+import re
 import json
-import jsonschema
-from jsonschema import validate
+import uuid
+import functools
+from .config import JSON_BACKEND
+from .utils import logger
+
+JSON_BACKENDS = ('json', 'orjson')
+
+# Strings at least this long that need no escaping (base64 image data) are written into a
+# JSONBody straight from the original string, a slice at a time, instead of being copied
+SPLICE_MIN_CHARS = 4096
+SPLICE_CHUNK_CHARS = 256 * 1024
+_NEEDS_ESCAPE = re.compile(r'[^\x20-\x7e]|["\\]')
 
 INPUT_SCHEMA = {
     "type": "object",
@@ -28,15 +39,122 @@ OUTPUT_SCHEMA = {
     "required": ["result", "analysis_type"]
 }
 
+# Compiled validators by schema, so each schema is checked and compiled once rather than per document
+_validators = {}
+
+def get_validator(schema):
+    entry = _validators.get(id(schema))
+    if entry is None or entry[0] is not schema:
+        # jsonschema is slow to import, and most commands never validate anything
+        import jsonschema
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        entry = _validators[id(schema)] = (schema, cls(schema))
+    return entry[1]
+
+def validate(instance, schema, message):
+    """
+    Validate instance against a JSON schema, raising ValueError with message on failure.
+    """
+    error = next(get_validator(schema).iter_errors(instance), None)
+    if error is not None:
+        raise ValueError(f"{message}: {error}")
+
+def json_backend(name=JSON_BACKEND):
+    """
+    Resolve a JSON_BACKEND setting to 'json' or 'orjson'.
+    """
+    if name not in JSON_BACKENDS + ('auto',):
+        raise ValueError(f"Unknown JSON backend {name!r}; expected one of {', '.join(JSON_BACKENDS + ('auto',))}")
+    if name == 'json':
+        return name
+    try:
+        import orjson  # noqa: F401
+        return 'orjson'
+    except ImportError:
+        if name == 'orjson':
+            logger.warning("JSON backend 'orjson' requested but it is not installed; falling back to json")
+        return 'json'
+
+def dumps(obj, indent=None, backend=None):
+    """
+    Serialize obj to a JSON string, keeping non-ASCII characters as they are. With the orjson
+    backend, indent may only be None or 2.
+    """
+    backend = backend or _default_backend()
+    if backend == 'orjson' and indent in (None, 2):
+        import orjson
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode('utf-8')
+        except TypeError:
+            # Types orjson doesn't know (e.g. numpy scalars) still go through the json module
+            pass
+    return json.dumps(obj, indent=indent, ensure_ascii=False)
+
+@functools.lru_cache(maxsize=None)
+def _default_backend():
+    return json_backend()
+
+class JSONBody:
+    """
+    A JSON document serialized lazily, for request bodies carrying multi-megabyte strings.
+
+    Only the document's skeleton is serialized up front; long strings that need no escaping,
+    such as base64 image data, stay where they are and are encoded a slice at a time as the
+    body is read, so no full copy of the payload is ever built. The bytes match
+    json.dumps(value, sort_keys=sort_keys, separators=separators).encode(). It is async
+    iterable, and can be iterated again, e.g. when a request is retried.
+    """
+
+    def __init__(self, value, sort_keys=False, separators=None):
+        marker = uuid.uuid4().hex
+        strings = []
+
+        def swap(item):
+            if isinstance(item, str):
+                if len(item) >= SPLICE_MIN_CHARS and not _NEEDS_ESCAPE.search(item):
+                    strings.append(item)
+                    return f"{marker}:{len(strings) - 1}"
+                return item
+            if isinstance(item, dict):
+                return {key: swap(member) for key, member in item.items()}
+            if isinstance(item, (list, tuple)):
+                return [swap(member) for member in item]
+            return item
+
+        skeleton = json.dumps(swap(value), sort_keys=sort_keys, separators=separators)
+        pieces = re.split(f'"{marker}:(\\d+)"', skeleton)
+        # Alternating serialized text and the index of the string spliced in after it
+        self.parts = [
+            piece.encode('utf-8') if position % 2 == 0 else strings[int(piece)]
+            for position, piece in enumerate(pieces)
+        ]
+        self.length = sum(len(part) + (0 if isinstance(part, bytes) else 2) for part in self.parts)
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            yield b'"'
+            for start in range(0, len(part), SPLICE_CHUNK_CHARS):
+                yield part[start:start + SPLICE_CHUNK_CHARS].encode('ascii')
+            yield b'"'
+
+    async def __aiter__(self):
+        for chunk in self.chunks():
+            yield chunk
+
 def parse_json_input(json_input):
     try:
         data = json.load(json_input)
-        validate(instance=data, schema=INPUT_SCHEMA)
-        return data
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON input")
-    except jsonschema.exceptions.ValidationError as e:
-        raise ValueError(f"JSON input does not match schema: {e}")
+    validate(data, INPUT_SCHEMA, "JSON input does not match schema")
+    return data
 
 def format_json_output(result, analysis_type):
     if isinstance(result, str):
@@ -51,10 +169,7 @@ def format_json_output(result, analysis_type):
         "analysis_type": analysis_type
     }
     
-    try:
-        validate(instance=output, schema=OUTPUT_SCHEMA)
-    except jsonschema.exceptions.ValidationError as e:
-        raise ValueError(f"Output does not match schema: {e}")
+    validate(output, OUTPUT_SCHEMA, "Output does not match schema")
     
     return output
 
@@ -71,77 +186,91 @@ VIDEO_INPUT_SCHEMA = {
     "required": ["file_path", "analysis_type"]
 }
 
-VIDEO_OUTPUT_SCHEMA = {
+VIDEO_METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "fps": {"type": "number"},
+        "frame_count": {"type": "integer"},
+        "duration": {"type": "number"},
+        "width": {"type": "integer"},
+        "height": {"type": "integer"}
+    }
+}
+
+VIDEO_FRAME_SCHEMA = {
     "type": "object",
     "properties": {
-        "video_metadata": {
-            "type": "object",
-            "properties": {
-                "fps": {"type": "number"},
-                "frame_count": {"type": "integer"},
-                "duration": {"type": "number"},
-                "width": {"type": "integer"},
-                "height": {"type": "integer"}
-            }
+        "frame_number": {"type": "integer"},
+        "timestamp": {"type": "number"},
+        "result": {
+            "oneOf": [
+                {"type": "string"},
+                {"type": "object"}
+            ]
         },
+        "duplicate_of": {"type": "integer"}
+    }
+}
+
+VIDEO_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "video_metadata": VIDEO_METADATA_SCHEMA,
         "frame_results": {
             "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "frame_number": {"type": "integer"},
-                    "timestamp": {"type": "number"},
-                    "result": {
-                        "oneOf": [
-                            {"type": "string"},
-                            {"type": "object"}
-                        ]
-                    }
-                }
-            }
+            "items": VIDEO_FRAME_SCHEMA
         },
         "analysis_type": {"type": "string"}
     },
     "required": ["video_metadata", "frame_results", "analysis_type"]
 }
 
+# VIDEO_OUTPUT_SCHEMA without descending into frame_results, whose items are checked one by one
+# as they are formatted
+VIDEO_ENVELOPE_SCHEMA = {
+    **VIDEO_OUTPUT_SCHEMA,
+    "properties": {**VIDEO_OUTPUT_SCHEMA["properties"], "frame_results": {"type": "array"}}
+}
+
 def parse_video_json_input(json_input):
     try:
         data = json.load(json_input)
-        validate(instance=data, schema=VIDEO_INPUT_SCHEMA)
-        return data
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON input")
-    except jsonschema.exceptions.ValidationError as e:
-        raise ValueError(f"JSON input does not match schema: {e}")
+    validate(data, VIDEO_INPUT_SCHEMA, "JSON input does not match schema")
+    return data
+
+def format_frame_result(frame):
+    """
+    Format one frame result for output, validating it on its own so a video's frames are
+    checked as they are produced rather than all at once at the end.
+    """
+    formatted_frame = {
+        "frame_number": frame["frame_number"],
+        "timestamp": frame["timestamp"],
+        "result": frame["result"]
+    }
+    if "duplicate_of" in frame:
+        formatted_frame["duplicate_of"] = frame["duplicate_of"]
+    
+    # Parse the nested JSON string in the result
+    if isinstance(formatted_frame["result"], str):
+        try:
+            formatted_frame["result"] = json.loads(formatted_frame["result"])
+        except json.JSONDecodeError:
+            # If it's not valid JSON, keep it as is
+            pass
+    
+    validate(formatted_frame, VIDEO_FRAME_SCHEMA, f"Frame {frame['frame_number']} output does not match schema")
+    return formatted_frame
 
 def format_video_json_output(video_metadata, frame_results, analysis_type):
     output = {
         "video_metadata": video_metadata,
-        "frame_results": [],
+        "frame_results": [format_frame_result(frame) for frame in frame_results],
         "analysis_type": analysis_type
     }
     
-    for frame in frame_results:
-        formatted_frame = {
-            "frame_number": frame["frame_number"],
-            "timestamp": frame["timestamp"],
-            "result": frame["result"]
-        }
-        
-        # Parse the nested JSON string in the result
-        if isinstance(formatted_frame["result"], str):
-            try:
-                formatted_frame["result"] = json.loads(formatted_frame["result"])
-            except json.JSONDecodeError:
-                # If it's not valid JSON, keep it as is
-                pass
-        
-        output["frame_results"].append(formatted_frame)
+    validate(output, VIDEO_ENVELOPE_SCHEMA, "Output does not match schema")
     
-    try:
-        validate(instance=output, schema=VIDEO_OUTPUT_SCHEMA)
-    except jsonschema.exceptions.ValidationError as e:
-        raise ValueError(f"Output does not match schema: {e}")
-    
-    return output
\ No newline at end of file
+    return output
@@ -0,0 +1,160 @@
+import time
+import random
+import threading
+import contextlib
+from typing import Dict, List, Tuple, Any, Callable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+# Durations kept per stage for quantiles; longer runs keep a uniform random sample of this size
+RESERVOIR_SIZE = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = 'claude_vision'
+
+class StageTimer:
+    """
+    Count, total, maximum and a reservoir sample of the durations recorded for one stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: List[float] = []
+
+    def add(self, seconds: float, rng: random.Random) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        else:
+            index = rng.randrange(self.count)
+            if index < RESERVOIR_SIZE:
+                self.samples[index] = seconds
+
+    def quantile(self, fraction: float) -> float:
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] if samples else 0.0
+
+# Spans recorded while a thread runs call_with_spans are collected here instead of the registry,
+# so work done in a process pool can be shipped back and merged
+_capture = threading.local()
+
+def format_value(value: float) -> str:
+    """
+    Write a counter exactly: whole numbers as integers, however large, and others in full.
+    """
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metrics:
+    """
+    Per-stage timings and counters for one process, safe to record into from worker threads.
+
+    Stages are dotted names such as "video.decode" or "request.ttfb"; counters are plain
+    names such as "requests" or "input_tokens".
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+        self.stages: Dict[str, StageTimer] = {}
+        self.counters: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        captured = getattr(_capture, 'spans', None)
+        if captured is not None:
+            captured.append((stage, seconds))
+            return
+        with self.lock:
+            timer = self.stages.get(stage)
+            if timer is None:
+                timer = self.stages[stage] = StageTimer()
+            timer.add(seconds, self.random)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def merge(self, spans: List[Tuple[str, float]]) -> None:
+        for stage, seconds in spans:
+            self.record(stage, seconds)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return {'stages': {stage: timings in ms}, 'counters': {name: value}} for --metrics.
+        """
+        with self.lock:
+            stages = {
+                stage: {
+                    'count': timer.count,
+                    'total_ms': round(timer.total * 1000, 3),
+                    'mean_ms': round(timer.total / timer.count * 1000, 3),
+                    'p50_ms': round(timer.quantile(0.5) * 1000, 3),
+                    'p95_ms': round(timer.quantile(0.95) * 1000, 3),
+                    'max_ms': round(timer.max * 1000, 3),
+                }
+                for stage, timer in sorted(self.stages.items())
+            }
+            return {'stages': stages, 'counters': dict(sorted(self.counters.items()))}
+
+    def prometheus(self, openmetrics: bool = False) -> str:
+        """
+        Render every stage as one summary metric labelled by stage, and every counter as a
+        counter, in the Prometheus text format or, with openmetrics, in OpenMetrics.
+        """
+        name = f'{METRIC_PREFIX}_stage_seconds'
+        lines = [f'# HELP {name} Time spent in each pipeline stage.', f'# TYPE {name} summary']
+        with self.lock:
+            for stage, timer in sorted(self.stages.items()):
+                for fraction in QUANTILES:
+                    lines.append(f'{name}{{stage="{stage}",quantile="{fraction}"}} {timer.quantile(fraction):.6f}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {timer.total:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {timer.count}')
+            for counter, value in sorted(self.counters.items()):
+                family = f'{METRIC_PREFIX}_{counter}'
+                lines.append(f'# TYPE {family if openmetrics else family + "_total"} counter')
+                lines.append(f'{family}_total {format_value(value)}')
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+_metrics = Metrics()
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+def span(stage: str):
+    return _metrics.span(stage)
+
+def record(stage: str, seconds: float) -> None:
+    _metrics.record(stage, seconds)
+
+def count(name: str, value: float = 1) -> None:
+    _metrics.count(name, value)
+
+def call_with_spans(function: Callable[..., T], *args) -> Tuple[T, List[Tuple[str, float]]]:
+    """
+    Run function(*args) and return (result, spans it recorded), for executor workers whose
+    spans would otherwise be lost in another process. Merge them with get_metrics().merge.
+    """
+    _capture.spans = spans = []
+    try:
+        return function(*args), spans
+    finally:
+        _capture.spans = None
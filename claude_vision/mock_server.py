@@ -0,0 +1,305 @@
+import json
+import time
+import hashlib
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional
+from .rate_limit import estimate_request_tokens
+from .utils import logger
+
+MESSAGES_PATH = '/v1/messages'
+BATCHES_PATH = MESSAGES_PATH + '/batches'
+
+def response_text(request: Dict[str, Any]) -> str:
+    """
+    A canned answer that is valid for the request's output type: requests ending in a '{'
+    prefill get the rest of a JSON object.
+    """
+    messages = request.get('messages', [])
+    images = sum(
+        1 for message in messages if message.get('role') == 'user' and isinstance(message.get('content'), list)
+        for block in message['content'] if block.get('type') == 'image'
+    )
+    description = f"Mock analysis of {images} image{'s' if images != 1 else ''}."
+    prefill = messages[-1].get('content') if messages and messages[-1].get('role') == 'assistant' else None
+    if isinstance(prefill, str) and prefill.rstrip().endswith('{'):
+        return f' "description": "{description}"}}'
+    return description
+
+def request_blocks(request: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Flatten the system prompt and every message into content blocks, in the order the API
+    reads them for prompt caching.
+    """
+    system = request.get('system') or []
+    blocks = [{'type': 'text', 'text': system}] if isinstance(system, str) else list(system)
+    for message in request.get('messages', []):
+        content = message.get('content')
+        blocks += [{'type': 'text', 'text': content}] if isinstance(content, str) else list(content or [])
+    return blocks
+
+def block_tokens(block: Dict[str, Any]) -> int:
+    """
+    Estimate a block's input tokens the same way the client's rate limiter does.
+    """
+    if block.get('type') == 'image':
+        return estimate_request_tokens([block['source']['data']])
+    return estimate_request_tokens([], block.get('text'))
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+class MockAnthropicServer:
+    """
+    Local stand-in for the Messages API, for benchmarks and tests that shouldn't spend money
+    or depend on the network.
+
+    Every request waits `latency` seconds, plus `input_latency` seconds per 1000 input tokens
+    not read from the prompt cache, before its first byte. Streamed responses then send one
+    content_block_delta per word, `token_delay` seconds apart. A `rate_limit_rate` /
+    `overload_rate` fraction of requests is answered with 429 / 529 and a retry-after of
+    `retry_after` seconds instead. Responses carry usage with an input-token estimate.
+
+    Message Batches are answered too: a batch stays in_progress for `batch_latency` seconds
+    after it is created, then ends with one succeeded result per request.
+
+    Prompt caching is simulated: the prefix up to each cache_control breakpoint that is at least
+    `min_cache_tokens` long is remembered, and later requests starting with it report those
+    tokens as cache reads instead of cache writes.
+
+        with MockAnthropicServer(latency=0.2) as server:
+            os.environ['ANTHROPIC_API_URL'] = server.url
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, token_delay: float = 0.0,
+                 rate_limit_rate: float = 0.0, overload_rate: float = 0.0, retry_after: float = 0.0, seed: Optional[int] = None,
+                 input_latency: float = 0.0, min_cache_tokens: int = 1024, batch_latency: float = 0.0):
+        self.latency = latency
+        self.batch_latency = batch_latency
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.input_latency = input_latency
+        self.min_cache_tokens = min_cache_tokens
+        self.cached_prefixes = set()
+        self.token_delay = token_delay
+        self.rate_limit_rate = rate_limit_rate
+        self.overload_rate = overload_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: List[Dict[str, Any]] = []
+        self.status_counts: Dict[int, int] = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url(self) -> str:
+        return self.base_url + MESSAGES_PATH
+
+    def start(self) -> 'MockAnthropicServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Mock Anthropic API listening on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self) -> 'MockAnthropicServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _record(self, request: Dict[str, Any], status: int) -> None:
+        with self.lock:
+            self.requests.append(request)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def usage(self, request: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Split a request's input tokens into cache reads, cache writes and uncached tokens,
+        and remember its breakpoint prefixes for later requests.
+        """
+        blocks = request_blocks(request)
+        hasher = hashlib.sha256(json.dumps(request.get('model')).encode('utf-8'))
+        prefix_tokens = read = written = 0
+        for block in blocks:
+            prefix_tokens += block_tokens(block)
+            hasher.update(json.dumps({key: value for key, value in block.items() if key != 'cache_control'}, sort_keys=True).encode('utf-8'))
+            if 'cache_control' not in block or prefix_tokens < self.min_cache_tokens:
+                continue
+            key = hasher.copy().hexdigest()
+            with self.lock:
+                if key in self.cached_prefixes:
+                    read = prefix_tokens
+                else:
+                    self.cached_prefixes.add(key)
+                    written = prefix_tokens
+        written = max(0, written - read)
+        return {
+            'input_tokens': prefix_tokens - read - written,
+            'cache_creation_input_tokens': written,
+            'cache_read_input_tokens': read,
+        }
+
+    def message(self, request: Dict[str, Any], usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        text = response_text(request)
+        usage = self.usage(request) if usage is None else usage
+        return {
+            'id': f"msg_mock_{len(self.requests)}", 'type': 'message', 'role': 'assistant',
+            'model': request.get('model'), 'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn', 'stop_sequence': None,
+            'usage': {**usage, 'output_tokens': len(text.split())},
+        }
+
+    def create_batch(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        results = [{'custom_id': request['custom_id'], 'result': {'type': 'succeeded', 'message': self.message(request['params'])}} for request in requests]
+        with self.lock:
+            batch_id = f"msgbatch_mock_{len(self.batches)}"
+            self.batches[batch_id] = {'created': time.monotonic(), 'results': results, 'canceled': False}
+        return self.batch_status(batch_id)
+
+    def batch_status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.batches[batch_id]
+        ended = batch['canceled'] or time.monotonic() - batch['created'] >= self.batch_latency
+        results = batch['results']
+        counts = {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+        if ended:
+            for result in results:
+                counts[result['result']['type']] += 1
+        else:
+            counts['processing'] = len(results)
+        return {
+            'id': batch_id, 'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': counts,
+            'results_url': f"{self.base_url}{BATCHES_PATH}/{batch_id}/results" if ended else None,
+        }
+
+    def cancel_batch(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.batches[batch_id]
+        if self.batch_status(batch_id)['processing_status'] != 'ended':
+            batch['canceled'] = True
+            batch['results'] = [{'custom_id': result['custom_id'], 'result': {'type': 'canceled'}} for result in batch['results']]
+        return self.batch_status(batch_id)
+
+    def _injected_error(self) -> Optional[int]:
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.overload_rate:
+            return 529
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so client connection pooling behaves as it does against the real API
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug(f"Mock API: {format % args}")
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                batch_id, _, rest = path[len(BATCHES_PATH) + 1:].partition('/')
+                if not path.startswith(BATCHES_PATH + '/') or batch_id not in server.batches or rest not in ('', 'results'):
+                    return self._not_found()
+                server._record({'batch': batch_id}, 200)
+                if rest == '':
+                    return self._send_json(200, server.batch_status(batch_id))
+                if server.batch_status(batch_id)['processing_status'] != 'ended':
+                    return self._send_json(400, {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': f"Batch {batch_id} has not ended"}})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-jsonl')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for result in server.batches[batch_id]['results']:
+                    self._send_chunk((json.dumps(result) + "\n").encode('utf-8'))
+                self._send_chunk(b'')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                path = self.path.split('?')[0]
+                if path.startswith(BATCHES_PATH + '/') and path.endswith('/cancel'):
+                    batch_id = path[len(BATCHES_PATH) + 1:-len('/cancel')]
+                    if batch_id not in server.batches:
+                        return self._not_found()
+                    server._record({'batch': batch_id}, 200)
+                    return self._send_json(200, server.cancel_batch(batch_id))
+                if path not in (MESSAGES_PATH, BATCHES_PATH):
+                    return self._not_found()
+                try:
+                    request = json.loads(body)
+                except json.JSONDecodeError as e:
+                    return self._send_json(400, {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': str(e)}})
+                if path == BATCHES_PATH:
+                    server._record(request, 200)
+                    return self._send_json(200, server.create_batch(request['requests']))
+
+                status = server._injected_error()
+                usage = server.usage(request) if status is None else {}
+                time.sleep(server.latency + server.input_latency * (usage.get('input_tokens', 0) + usage.get('cache_creation_input_tokens', 0)) / 1000)
+                server._record(request, status or 200)
+                if status == 429:
+                    return self._send_json(429, {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': "Injected rate limit"}}, retry_after=server.retry_after)
+                if status == 529:
+                    return self._send_json(529, {'type': 'error', 'error': {'type': 'overloaded_error', 'message': "Injected overload"}}, retry_after=server.retry_after)
+
+                message = server.message(request, usage)
+                if request.get('stream'):
+                    self._send_stream(request, message['content'][0]['text'], message['usage'])
+                else:
+                    self._send_json(200, message)
+
+            def _not_found(self):
+                self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': f"No route for {self.path}"}})
+
+            def _send_json(self, status, payload, retry_after=None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if retry_after is not None:
+                    self.send_header('retry-after', str(retry_after))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_stream(self, request, text, usage):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                self._send_chunk(sse_event('message_start', {'type': 'message_start', 'message': {
+                    'id': f"msg_mock_{len(server.requests)}", 'type': 'message', 'role': 'assistant', 'model': request.get('model'),
+                    'content': [], 'usage': {**usage, 'output_tokens': 0},
+                }}))
+                self._send_chunk(sse_event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}))
+                words = text.split(' ')
+                for index, word in enumerate(words):
+                    if index:
+                        time.sleep(server.token_delay)
+                    delta = word if index == 0 else ' ' + word
+                    self._send_chunk(sse_event('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': delta}}))
+                self._send_chunk(sse_event('content_block_stop', {'type': 'content_block_stop', 'index': 0}))
+                self._send_chunk(sse_event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': usage['output_tokens']}}))
+                self._send_chunk(sse_event('message_stop', {'type': 'message_stop'}))
+                self._send_chunk(b'')
+
+        return Handler
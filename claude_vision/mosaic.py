@@ -0,0 +1,112 @@
+import json
+import math
+from typing import List, Tuple, Any
+from PIL import Image, ImageDraw, ImageFont
+from .config import MAX_IMAGE_SIZE
+from .planner import fit_to_tokens, image_tokens
+from .rate_limit import MAX_IMAGE_TOKENS
+from .utils import logger
+
+# Pixels of black between tiles, and around each tile's label
+TILE_GAP = 4
+LABEL_PADDING = 2
+
+Size = Tuple[int, int]
+
+def grid_shape(count: int, frame_size: Size) -> Tuple[int, int]:
+    """
+    Pick (columns, rows) for count tiles so the grid is as close to square as possible,
+    preferring grids with fewer empty cells.
+    """
+    width, height = frame_size
+    def score(columns):
+        rows = math.ceil(count / columns)
+        return abs(math.log(columns * width / (rows * height))), columns * rows - count
+    columns = min(range(1, count + 1), key=score)
+    return columns, math.ceil(count / columns)
+
+def mosaic_layout(frame_size: Size, count: int, max_tokens: int = MAX_IMAGE_TOKENS, max_size: tuple = MAX_IMAGE_SIZE) -> Tuple[int, int, Size]:
+    """
+    Return (columns, rows, tile size) for a grid of count frames that stays within max_size
+    and costs at most max_tokens as a single image.
+    """
+    width, height = frame_size
+    columns, rows = grid_shape(count, frame_size)
+    canvas_width, _ = fit_to_tokens((columns * width, rows * height), max_tokens, max_size)
+    tile_width = max(1, (canvas_width - (columns - 1) * TILE_GAP) // columns)
+    # The gaps between rows can push the canvas back over the limits; shave tiles until it fits
+    while tile_width > 1:
+        tile_size = (tile_width, max(1, tile_width * height // width))
+        canvas = canvas_size(columns, rows, tile_size)
+        if image_tokens(canvas) <= max_tokens and canvas[0] <= max_size[0] and canvas[1] <= max_size[1]:
+            break
+        tile_width -= 1
+    return columns, rows, (tile_width, max(1, tile_width * height // width))
+
+def canvas_size(columns: int, rows: int, tile_size: Size) -> Size:
+    return columns * tile_size[0] + (columns - 1) * TILE_GAP, rows * tile_size[1] + (rows - 1) * TILE_GAP
+
+def make_tile(frame_rgb, tile_size: Size) -> Image.Image:
+    return Image.fromarray(frame_rgb).resize(tile_size, Image.LANCZOS, reducing_gap=2.0)
+
+def frame_label(frame_number: int, timestamp: float) -> str:
+    return f"#{frame_number}  {timestamp:.1f}s"
+
+def _label_font(tile_height: int):
+    try:
+        return ImageFont.load_default(size=max(10, tile_height // 10))
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+def build_mosaic(tiles: List[Image.Image], labels: List[str], columns: int) -> Image.Image:
+    """
+    Paste tiles into a grid, left to right and top to bottom, with each label drawn in
+    white on black in the tile's top-left corner.
+    """
+    tile_width, tile_height = tiles[0].size
+    columns = min(columns, len(tiles))
+    rows = math.ceil(len(tiles) / columns)
+    canvas = Image.new('RGB', canvas_size(columns, rows, tiles[0].size))
+    draw = ImageDraw.Draw(canvas)
+    font = _label_font(tile_height)
+    for index, (tile, label) in enumerate(zip(tiles, labels)):
+        x = (index % columns) * (tile_width + TILE_GAP)
+        y = (index // columns) * (tile_height + TILE_GAP)
+        canvas.paste(tile, (x, y))
+        origin = (x + 2 * LABEL_PADDING, y + 2 * LABEL_PADDING)
+        left, top, right, bottom = draw.textbbox(origin, label, font=font)
+        draw.rectangle((left - LABEL_PADDING, top - LABEL_PADDING, right + LABEL_PADDING, bottom + LABEL_PADDING), fill='black')
+        draw.text(origin, label, fill='white', font=font)
+    return canvas
+
+def mosaic_prompt(frame_numbers: List[int], prompt: str, output: str) -> str:
+    value = {
+        'json': "a JSON object with your analysis of that frame",
+        'md': "your analysis of that frame as a Markdown string",
+    }.get(output, "your analysis of that frame as a plain-text string")
+    return (
+        f"This image is a grid of {len(frame_numbers)} frames from a video, in order from left to right "
+        f"and top to bottom. Each frame is labelled in its top-left corner with its frame number and "
+        f"timestamp. {prompt} Analyze each frame separately. Respond with a JSON object whose keys are the "
+        f"frame numbers ({', '.join(str(number) for number in frame_numbers)}) and whose values are {value}."
+    )
+
+def split_mosaic_result(result: Any, frame_numbers: List[int]) -> List[Any]:
+    """
+    Map a mosaic response back to one result per frame. Frames the response doesn't
+    mention, or every frame if it isn't a JSON object, get the whole response.
+    """
+    parsed = result
+    if isinstance(result, str):
+        try:
+            parsed = json.loads(result)
+        except json.JSONDecodeError:
+            parsed = None
+    if not isinstance(parsed, dict):
+        logger.warning(f"Mosaic response for frames {frame_numbers[0]}-{frame_numbers[-1]} isn't a JSON object; using it for every frame")
+        return [result] * len(frame_numbers)
+    missing = [number for number in frame_numbers if str(number) not in parsed]
+    if missing:
+        logger.warning(f"Mosaic response has no entry for frames {missing}")
+    return [parsed.get(str(number), result) for number in frame_numbers]
@@ -0,0 +1,119 @@
+import math
+from typing import List, Tuple
+from .config import MAX_IMAGE_SIZE, MIN_IMAGE_TOKENS
+from .rate_limit import MAX_IMAGE_TOKENS
+
+MAX_IMAGES_PER_REQUEST = 20
+PIXELS_PER_TOKEN = 750
+
+Size = Tuple[int, int]
+
+def image_tokens(size: Size) -> int:
+    return (size[0] * size[1]) // PIXELS_PER_TOKEN
+
+def natural_size(size: Size, max_size: tuple = MAX_IMAGE_SIZE) -> Size:
+    """
+    The size an image is sent at with no budget: clamped to max_size, and no larger
+    than the API will use before downscaling it itself.
+    """
+    return fit_to_tokens(size, MAX_IMAGE_TOKENS, max_size)
+
+def fit_to_tokens(size: Size, max_tokens: int, max_size: tuple = MAX_IMAGE_SIZE) -> Size:
+    """
+    Scale size down (never up), keeping its aspect ratio, until it fits in max_size and costs at most max_tokens.
+    """
+    width, height = size
+    scale = min(1.0, max_size[0] / width, max_size[1] / height)
+    if image_tokens((int(width * scale), int(height * scale))) > max_tokens:
+        scale = min(scale, math.sqrt(max(max_tokens, 1) * PIXELS_PER_TOKEN / (width * height)))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def allocate_tokens(token_counts: List[int], budget: int) -> List[int]:
+    """
+    Split a token budget across images, water-filling so images that need less than an
+    equal share give the remainder to larger ones.
+    """
+    allocation = [0] * len(token_counts)
+    remaining = budget
+    order = sorted(range(len(token_counts)), key=lambda i: token_counts[i])
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        allocation[index] = min(token_counts[index], share)
+        remaining -= allocation[index]
+    return allocation
+
+def _group_fits(floors: List[int], budget: int, max_images: int) -> bool:
+    return len(floors) <= max_images and sum(floors) <= budget
+
+def pack_requests(floors: List[int], budget: int, max_images: int = MAX_IMAGES_PER_REQUEST) -> List[List[int]]:
+    """
+    Split images, in order, into the fewest contiguous requests where each request's
+    minimum token cost fits the budget, balancing the number of images per request.
+    """
+    # Greedy next-fit gives the fewest contiguous groups
+    groups = []
+    current = []
+    current_tokens = 0
+    for index, floor in enumerate(floors):
+        if current and (len(current) == max_images or current_tokens + floor > budget):
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += floor
+    if current:
+        groups.append(current)
+
+    # With the same number of requests, spread images evenly so no request is starved of resolution
+    count = len(groups)
+    if count > 1:
+        bounds = [i * len(floors) // count for i in range(count + 1)]
+        balanced = [list(range(bounds[i], bounds[i + 1])) for i in range(count)]
+        if all(_group_fits([floors[i] for i in group], budget, max_images) for group in balanced):
+            groups = balanced
+    return groups
+
+def plan_requests(
+    sizes: List[Size],
+    token_budget: int,
+    max_images: int = MAX_IMAGES_PER_REQUEST,
+    min_tokens: int = MIN_IMAGE_TOKENS,
+    text_tokens: int = 0,
+    max_size: tuple = MAX_IMAGE_SIZE,
+) -> List[List[Tuple[int, Size]]]:
+    """
+    Plan how to send a list of images within a per-request input-token budget.
+
+    Images are packed, in order, into the fewest requests in which every image still gets
+    at least min_tokens worth of resolution (or its full size, if smaller). Each request's
+    budget is then shared between its images. Returns one list of (image index, target size)
+    per request.
+    """
+    budget = max(token_budget - text_tokens, 1)
+    natural = [natural_size(size, max_size) for size in sizes]
+    wanted = [image_tokens(size) for size in natural]
+    floors = [min(tokens, min_tokens) for tokens in wanted]
+
+    plan = []
+    for group in pack_requests(floors, budget, max_images):
+        allocation = allocate_tokens([wanted[i] for i in group], budget)
+        plan.append([(index, fit_to_tokens(natural[index], tokens, max_size)) for index, tokens in zip(group, allocation)])
+    return plan
+
+def plan_uniform_requests(
+    size: Size,
+    token_budget: int,
+    max_images: int = MAX_IMAGES_PER_REQUEST,
+    min_tokens: int = MIN_IMAGE_TOKENS,
+    text_tokens: int = 0,
+    max_size: tuple = MAX_IMAGE_SIZE,
+) -> Tuple[int, Size]:
+    """
+    For a stream of same-sized images (video frames), return the most images that fit in
+    one request and the size to send each at.
+    """
+    budget = max(token_budget - text_tokens, 1)
+    natural = natural_size(size, max_size)
+    floor = min(image_tokens(natural), min_tokens)
+    images_per_request = max(1, min(max_images, budget // max(floor, 1)))
+    return images_per_request, fit_to_tokens(natural, budget // images_per_request, max_size)
@@ -0,0 +1,154 @@
+import math
+from typing import List, Optional, Tuple, Dict, Any
+from .config import INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE
+from .planner import plan_requests, natural_size, image_tokens
+from .image_processing import probe_image_size
+from .rate_limit import estimate_request_tokens
+from .batch import load_manifest, completed_ids, entry_prompt
+from .image_sets import plan_chunks
+from .dedup import FrameDeduplicator, difference_hash
+from .exceptions import InvalidRequestError
+from .utils import logger
+
+# (input tokens, maximum output tokens) for one planned API request
+RequestEstimate = Tuple[int, int]
+
+def estimate_cost(input_tokens: int, output_tokens: int) -> float:
+    return (input_tokens * INPUT_TOKEN_PRICE + output_tokens * OUTPUT_TOKEN_PRICE) / 1_000_000
+
+def summarize_requests(requests: List[Optional[RequestEstimate]]) -> Dict[str, Any]:
+    """
+    Totals for a list of planned requests. None entries (requests that would fail before
+    reaching the API) are left out. Output tokens and cost assume every response uses its
+    full max_tokens, so they are upper bounds.
+    """
+    planned = [request for request in requests if request is not None]
+    input_tokens = sum(request[0] for request in planned)
+    output_tokens = sum(request[1] for request in planned)
+    return {
+        'requests': len(planned),
+        'input_tokens': input_tokens,
+        'max_input_tokens_per_request': max((request[0] for request in planned), default=0),
+        'output_tokens': output_tokens,
+        'cost': estimate_cost(input_tokens, output_tokens),
+    }
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    mean = summary['input_tokens'] // summary['requests'] if summary['requests'] else 0
+    return "\n".join([
+        f"Requests:        {summary['requests']:,}",
+        f"Input tokens:    {summary['input_tokens']:,} total, {mean:,} per request on average, {summary['max_input_tokens_per_request']:,} at most",
+        f"Output tokens:   up to {summary['output_tokens']:,}",
+        f"Estimated cost:  up to ${summary['cost']:.4f}",
+    ])
+
+def affordable_requests(requests: List[Optional[RequestEstimate]], max_cost: Optional[float] = None, max_tokens_total: Optional[int] = None) -> int:
+    """
+    Return how many leading requests fit within the cost and total-token limits.
+    """
+    cost = 0.0
+    tokens = 0
+    for count, request in enumerate(requests):
+        if request is None:
+            continue
+        cost += estimate_cost(*request)
+        tokens += request[0] + request[1]
+        if (max_cost is not None and cost > max_cost) or (max_tokens_total is not None and tokens > max_tokens_total):
+            return count
+    return len(requests)
+
+def plan_image_job(sources, prompt: str, system: Optional[str] = None, max_tokens: int = 1000, token_budget: Optional[int] = None, chunk_size: Optional[int] = None) -> List[RequestEstimate]:
+    """
+    Estimate the single request process_multiple_images and claude_vision_analysis would make
+    for these images, or with chunk_size the request for each chunk iter_image_set_results
+    would send, reading only the image headers.
+    """
+    if chunk_size:
+        chunks = plan_chunks(sources, chunk_size, token_budget, estimate_request_tokens([], prompt, system))
+        return [
+            request for chunk in chunks
+            for request in plan_image_job([source for source, _ in chunk], prompt, system, max_tokens, token_budget)
+        ]
+    sizes = [probe_image_size(source) for source in sources]
+    text_tokens = estimate_request_tokens([], prompt, system)
+    if token_budget:
+        plan = plan_requests(sizes, token_budget, min_tokens=0, text_tokens=text_tokens)
+        sizes = [size for group in plan for _, size in group]
+    return [(text_tokens + sum(image_tokens(natural_size(size)) for size in sizes), max_tokens)]
+
+def plan_video_job(
+    video_path: str,
+    frame_interval: int,
+    persona: Optional[str] = None,
+    prompt: Optional[str] = None,
+    system: Optional[str] = None,
+    max_tokens: int = 1000,
+    process_as_group: bool = False,
+    token_budget: Optional[int] = None,
+    dedup_threshold: Optional[int] = None,
+    decode_strategy: str = 'auto',
+    mosaic: Optional[int] = None,
+) -> Tuple[List[RequestEstimate], List[int]]:
+    """
+    Estimate the requests analyze_video would make.
+
+    Frames are only decoded when deduplication needs them; otherwise the sampled frames are
+    worked out from the video's metadata. Returns the planned requests and, for each one,
+    how many sampled frames come before its first frame (for use as analyze_video's max_frames).
+    """
+    from .video_utils import get_video_metadata, iter_frames
+    from .video_processing import plan_frame_requests, plan_mosaic_layout, frame_batch_prompt, generate_prompt as generate_video_prompt
+
+    from .mosaic import canvas_size, mosaic_prompt
+
+    metadata = get_video_metadata(video_path)
+    frame_size = (metadata['width'], metadata['height'])
+    batch_size, max_size = plan_frame_requests(metadata, persona, prompt, system, process_as_group and not mosaic, None if mosaic else token_budget)
+    group_size = mosaic or (batch_size if process_as_group else 1)
+    frame_tokens = image_tokens(natural_size(frame_size, max_size))
+    if mosaic:
+        columns, rows, tile_size = plan_mosaic_layout(frame_size, mosaic, persona, prompt, system, token_budget, metadata['frame_count'])
+        mosaic_tokens = image_tokens(natural_size(canvas_size(columns, rows, tile_size)))
+
+    if dedup_threshold is None:
+        sampled = math.ceil(metadata['frame_count'] / frame_interval)
+        kept = [(position, position * frame_interval) for position in range(sampled)]
+    else:
+        deduplicator = FrameDeduplicator(dedup_threshold)
+        kept = []
+        for position, frame in enumerate(iter_frames(video_path, frame_interval, decode_strategy)):
+            if deduplicator.check(frame['frame_number'], difference_hash(frame['frame'])) is None:
+                kept.append((position, frame['frame_number']))
+        logger.info(f"Dry run: {deduplicator.skipped} near-duplicate frames would be skipped")
+
+    requests = []
+    starts = []
+    for i in range(0, len(kept), group_size):
+        group = kept[i:i + group_size]
+        if mosaic:
+            text = mosaic_prompt([number for _, number in group], prompt or generate_video_prompt(persona), 'json')
+            image_total = mosaic_tokens
+        else:
+            text = frame_batch_prompt(group[0][1], group[-1][1], persona, prompt, process_as_group)
+            image_total = len(group) * frame_tokens
+        requests.append((estimate_request_tokens([], text, system) + image_total, max_tokens))
+        starts.append(group[0][0])
+    return requests, starts
+
+def plan_batch_job(manifest_path: str, output_path: str) -> List[Optional[RequestEstimate]]:
+    """
+    Estimate one request per manifest entry that run_batch still has to run, in manifest order.
+    Entries whose images can't be read are None: they fail without calling the API.
+    """
+    done = completed_ids(output_path)
+    requests = []
+    for entry in load_manifest(manifest_path):
+        if entry['id'] in done:
+            continue
+        prompt = entry_prompt(entry)
+        try:
+            requests += plan_image_job(entry['files'], prompt, entry.get('system'), entry.get('max_tokens', 1000))
+        except InvalidRequestError as e:
+            logger.warning(f"Batch entry {entry['id']!r} would fail: {e}")
+            requests.append(None)
+    return requests
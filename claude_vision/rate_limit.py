@@ -0,0 +1,229 @@
+import time
+import random
+import base64
+import struct
+import asyncio
+from typing import Optional, Callable, Awaitable, TypeVar, List, Tuple
+from .config import REQUESTS_PER_MINUTE, INPUT_TOKENS_PER_MINUTE, MAX_CONCURRENCY, MAX_RETRIES
+from .metrics import count
+from .utils import logger
+
+T = TypeVar('T')
+
+OVERLOAD_STATUS_CODES = (429, 529)
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# The API downscales anything above ~1.15 megapixels, which caps an image at about this many tokens
+MAX_IMAGE_TOKENS = 1600
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate_per_minute`, holding at most one minute's worth.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: grows by roughly one slot per window of successful requests
+    and halves whenever the API reports it is rate limited or overloaded.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self) -> None:
+        self.limit = max(self.minimum, self.limit / 2)
+        logger.info(f"API overloaded; reducing concurrency limit to {int(self.limit)}")
+
+class RequestScheduler:
+    """
+    Client-side scheduler shared by every API request.
+
+    Requests wait for a request-per-minute and an input-token-per-minute budget and for a
+    free slot under the adaptive concurrency limit. 429/529 responses shrink the limit and
+    pause dispatch for the server's retry-after; 5xx responses and transport errors are
+    retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = REQUESTS_PER_MINUTE,
+        input_tokens_per_minute: Optional[float] = INPUT_TOKENS_PER_MINUTE,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self.retries = 0
+
+    async def run(self, send: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        # Only needed once requests are sent; the token estimators here are used without it
+        import httpx
+        attempt = 0
+        while True:
+            await self._wait_for_budget(tokens)
+            await self.concurrency.acquire()
+            try:
+                result = await send()
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                count('retries')
+                logger.warning(f"Request failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            else:
+                self.concurrency.on_success()
+                return result
+            finally:
+                await self.concurrency.release()
+            await asyncio.sleep(delay)
+
+    async def _wait_for_budget(self, tokens: int) -> None:
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+        if self.request_bucket:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket and tokens:
+            await self.token_bucket.acquire(tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        import httpx
+        backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if isinstance(error, httpx.TransportError):
+            return backoff
+        status = error.response.status_code
+        if status in OVERLOAD_STATUS_CODES:
+            self.concurrency.on_overload()
+            retry_after = parse_retry_after(error.response.headers.get('retry-after'))
+            delay = retry_after if retry_after is not None else backoff
+            # Hold back every other request too, not just this one
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            return delay
+        if status >= 500:
+            return backoff
+        return None
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_loop: Optional[asyncio.AbstractEventLoop] = None
+_scheduler_settings = {}
+
+def configure_scheduler(**settings) -> None:
+    """
+    Override the RequestScheduler arguments used by get_scheduler.
+    """
+    global _scheduler
+    _scheduler_settings.update({key: value for key, value in settings.items() if value is not None})
+    _scheduler = None
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Return the scheduler shared by all requests on the running event loop.
+    """
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_event_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler = RequestScheduler(**_scheduler_settings)
+        _scheduler_loop = loop
+    return _scheduler
+
+def _image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', data[6:10])
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    if data[:2] == b'\xff\xd8':
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset] != 0xFF:
+                return None
+            marker = data[offset + 1]
+            length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + length
+    return None
+
+def estimate_base64_image_tokens(base64_image: str) -> int:
+    """
+    Estimate an encoded image's input tokens from the dimensions in its header.
+    """
+    # Only decode enough of the payload to reach the header
+    prefix = base64_image[:65536]
+    try:
+        size = _image_size(base64.b64decode(prefix[:len(prefix) - len(prefix) % 4]))
+    except (ValueError, struct.error):
+        size = None
+    if not size:
+        return MAX_IMAGE_TOKENS
+    width, height = size
+    return min(MAX_IMAGE_TOKENS, (width * height) // 750)
+
+def estimate_request_tokens(base64_images: List[str], *texts: Optional[str]) -> int:
+    text_tokens = sum(len(text) for text in texts if text) // 4
+    return text_tokens + sum(estimate_base64_image_tokens(image) for image in base64_images)
@@ -1,7 +1,55 @@
+import os
+import glob
 import logging
 
 def setup_logging():
     logging.basicConfig(level=logging.DEBUG, filename="claude_vision_debug.log", filemode="w")
     return logging.getLogger(__name__)
 
-logger = setup_logging()
\ No newline at end of file
+logger = setup_logging()
+
+def generate_prompt(persona=None, multi_angle=False, multi_object=False, num_images=1):
+    if num_images == 1:
+        base_prompt = "Analyze this image and provide a detailed description."
+    else:
+        if multi_angle:
+            base_prompt = f"Analyze these {num_images} images as different angles of the same object. Provide a detailed description of the object based on all angles."
+        elif multi_object:
+            base_prompt = f"Analyze these {num_images} images as different objects. Provide a detailed description of each object separately."
+        else:
+            base_prompt = f"Analyze these {num_images} images and provide a detailed description for each."
+
+    if persona:
+        return f"As a {persona}, {base_prompt}"
+    return base_prompt
+
+# Defined here rather than in video_utils so checking a path doesn't import OpenCV
+DECODE_STRATEGIES = ('auto', 'sequential', 'seek')
+
+def is_video_file(file_path):
+    video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
+    _, ext = os.path.splitext(file_path)
+    return ext.lower() in video_extensions
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+def is_image_file(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS and os.path.isfile(path)
+
+def expand_image_paths(paths):
+    """
+    Replace each directory in paths with the image files directly inside it, and each glob
+    pattern (e.g. 'photos/**/*.jpg') with the image files it matches, in name order.
+    URLs, files and in-memory images are kept as they are.
+    """
+    expanded = []
+    for path in paths:
+        if not isinstance(path, str) or path.startswith(('http://', 'https://')) or os.path.isfile(path):
+            expanded.append(path)
+        elif os.path.isdir(path):
+            expanded += sorted(entry.path for entry in os.scandir(path) if is_image_file(entry.path))
+        elif glob.has_magic(path):
+            expanded += sorted(match for match in glob.iglob(os.path.expanduser(path), recursive=True) if is_image_file(match))
+        else:
+            raise ValueError(f"Path '{path}' does not exist.")
+    return expanded
@@ -1,62 +1,432 @@
-
-from .claude_integration import claude_vision_analysis
-from .video_utils import get_video_metadata, extract_frames
-from .image_processing import process_multiple_images
+from .claude_integration import claude_vision_analysis, finalize_content, warn_if_uncacheable
+from .video_utils import get_video_metadata, iter_frames
+from .image_processing import check_and_resize_image, convert_image_to_base64
+from .http_client import get_client
+from .utils import logger
+from .dedup import FrameDeduplicator, difference_hash
+from .planner import plan_uniform_requests
+from .rate_limit import estimate_request_tokens, MAX_IMAGE_TOKENS
+from .config import MAX_IMAGE_SIZE, VIDEO_CONCURRENCY
+from .checkpoint import VideoCheckpoint
+from .metrics import span
+from .mosaic import mosaic_layout, make_tile, build_mosaic, frame_label, mosaic_prompt, split_mosaic_result
+from PIL import Image
 import asyncio
+import math
+import itertools
+import collections
+import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
 
-# Todo: I want the option to analyze frames independently or as part of a set of max 20 images.
-    #   So that I can analyze differences between frames if need be.
-    # This should support --prompt and --system so that I can ask questions about video or guide the generation.
-async def process_video_frames(frames, persona, output, stream, batch_size=20, prompt=None, system=None, process_as_group=False):
-    results = []
-    base64_frames = await process_multiple_images([frame['frame'] for frame in frames])
-    
-    async def process_frame_batch(batch_frames, start_index):
-        batch_results = []
-        if process_as_group:
-            frame_numbers = [frames[i]['frame_number'] for i in range(start_index, start_index + len(batch_frames))]
-            frame_prompt = f"Analyze frames {frame_numbers[0]} to {frame_numbers[-1]} of the video as a group. {prompt or generate_prompt(persona)}"
-            result = await claude_vision_analysis(batch_frames, frame_prompt, output, stream, system=system)
-            for i in range(start_index, start_index + len(batch_frames)):
-                batch_results.append({
-                    "frame_number": frames[i]['frame_number'],
-                    "timestamp": frames[i]['timestamp'],
-                    "result": result
-                })
-        else:
-            for i, frame in enumerate(batch_frames, start=start_index):
-                frame_prompt = f"Analyze frame {frames[i]['frame_number']} of the video. {prompt or generate_prompt(persona)}"
-                result = await claude_vision_analysis([frame], frame_prompt, output, stream, system=system)
-                batch_results.append({
-                    "frame_number": frames[i]['frame_number'],
-                    "timestamp": frames[i]['timestamp'],
-                    "result": result
-                })
-        return batch_results
-
-    with ThreadPoolExecutor() as executor:
-        tasks = []
-        for i in range(0, len(base64_frames), batch_size):
-            batch_frames = base64_frames[i:i+batch_size]
-            task = asyncio.create_task(process_frame_batch(batch_frames, i))
-            tasks.append(task)
-        
-        batched_results = await asyncio.gather(*tasks)
-        for batch_result in batched_results:
-            results.extend(batch_result)
-    
-    return results
-
-
-async def analyze_video(video_path, frame_interval, persona, output, stream, num_workers=None, prompt=None, system=None, process_as_group=False):
+# Frames waiting between pipeline stages. Decoded 4K frames are ~25MB each, so keep this small.
+FRAME_QUEUE_SIZE = 4
+# Frame requests in flight at once, unless overridden with `concurrency`
+REQUEST_WORKERS = VIDEO_CONCURRENCY
+
+_DONE = object()
+
+def duplicate_result(frame, original_frame_number, result):
+    return {
+        "frame_number": frame['frame_number'],
+        "timestamp": frame['timestamp'],
+        "result": result,
+        "duplicate_of": original_frame_number
+    }
+
+def encode_frame(frame_rgb, max_size=MAX_IMAGE_SIZE):
+    image = check_and_resize_image(Image.fromarray(frame_rgb), max_size)
+    return convert_image_to_base64(image)
+
+def encode_tile(frame_rgb, tile_size):
+    with span('video.tile'):
+        return make_tile(frame_rgb, tile_size)
+
+def encode_mosaic(batch, columns):
+    with span('video.mosaic'):
+        mosaic = build_mosaic(
+            [frame['tile'] for frame in batch],
+            [frame_label(frame['frame_number'], frame['timestamp']) for frame in batch],
+            columns
+        )
+    return convert_image_to_base64(mosaic)
+
+def frame_batch_label(first_frame, last_frame, process_as_group=False):
+    if process_as_group:
+        return f"Analyze frames {first_frame} to {last_frame} of the video as a group."
+    return f"Analyze frame {first_frame} of the video."
+
+def frame_batch_prompt(first_frame, last_frame, persona=None, prompt=None, process_as_group=False):
+    return f"{frame_batch_label(first_frame, last_frame, process_as_group)} {prompt or generate_prompt(persona)}"
+
+async def analyze_frame_batch(batch, persona, output, stream, prompt=None, system=None, process_as_group=False, client=None, **analysis_options):
+    """
+    Send one batch of encoded frames to Claude, as a group or as a single frame.
+
+    With prompt_cache, the instructions shared by every frame are sent as a cached prefix
+    ahead of the frames, and only the frame numbers follow them.
+    """
+    # Taken out of the frames so only the request holds them, and a batch-api request can drop
+    # them once it's queued
+    images = [frame.pop('image') for frame in batch]
+    if analysis_options.get('prompt_cache'):
+        label = frame_batch_label(batch[0]['frame_number'], batch[-1]['frame_number'], process_as_group)
+        request = claude_vision_analysis(images, label, output, stream, system=system, client=client, prompt_prefix=prompt or generate_prompt(persona), **analysis_options)
+    else:
+        frame_prompt = frame_batch_prompt(batch[0]['frame_number'], batch[-1]['frame_number'], persona, prompt, process_as_group)
+        request = claude_vision_analysis(images, frame_prompt, output, stream, system=system, client=client, **analysis_options)
+    del images
+    result = await request
+    if stream:
+        # Drain the stream in this request worker, so each frame result is complete text by the
+        # time it's emitted and the response isn't held open while earlier frames finish
+        result = finalize_content(''.join([chunk async for chunk in result]), output)
+    return [
+        {
+            "frame_number": frame['frame_number'],
+            "timestamp": frame['timestamp'],
+            "result": result
+        }
+        for frame in batch
+    ]
+
+async def analyze_mosaic_batch(batch, columns, persona, output, prompt=None, system=None, client=None, executor=None, **analysis_options):
+    """
+    Tile a batch of frames into one labelled grid image, ask for a per-frame JSON answer
+    and split it back into one result per frame.
+    """
+    image = await asyncio.get_event_loop().run_in_executor(executor, encode_mosaic, batch, columns)
+    frame_numbers = [frame['frame_number'] for frame in batch]
+    for frame in batch:
+        del frame['tile']
+    # The per-frame mapping needs the whole response, so mosaics are never streamed
+    request = claude_vision_analysis([image], mosaic_prompt(frame_numbers, prompt or generate_prompt(persona), output), 'json', False, system=system, client=client, **analysis_options)
+    # Only the request holds the grid, so a batch-api request can drop it once it's queued
+    del image
+    result = await request
+    return [
+        {
+            "frame_number": frame['frame_number'],
+            "timestamp": frame['timestamp'],
+            "result": frame_result
+        }
+        for frame, frame_result in zip(batch, split_mosaic_result(result, frame_numbers))
+    ]
+
+async def iter_frame_results(frames, persona, output, stream, batch_size=20, prompt=None, system=None, process_as_group=False, client=None, num_workers=None, queue_size=FRAME_QUEUE_SIZE, dedup_threshold=None, max_size=MAX_IMAGE_SIZE, mosaic=None, concurrency=REQUEST_WORKERS, ordered=True, progress=None, total_frames=None, restored=None, frame_hashes=None, layout=None, **analysis_options):
+    """
+    Run frames through a decode -> encode -> request pipeline and yield frame results.
+
+    `frames` is any iterable of {'frame', 'frame_number', 'timestamp'} dicts, such as the lazy
+    iter_frames generator. Stages run concurrently and are joined by bounded queues, so only a
+    handful of decoded frames and in-flight batches are held in memory at once.
+
+    With `dedup_threshold`, frames whose difference hash is within that Hamming distance of the
+    last kept frame are never encoded or sent; they reuse the kept frame's result and are
+    marked with "duplicate_of". `restored` maps the numbers of frames an earlier run already
+    analyzed, and that aren't in `frames`, to their results; kept frames' results carry their
+    "frame_hash", and deduplication carries on from them as if they had been analyzed in this
+    run. The hash of every frame kept in this run is stored in the `frame_hashes` dict.
+
+    Frames are downscaled to fit within `max_size` before encoding.
+
+    With `mosaic`, every `mosaic` frames are downscaled into tiles of a single labelled grid
+    image and analyzed in one request. The grid is laid out once, as `layout` (columns, rows,
+    tile size) or by default from the first frame's size to fit within `max_size`.
+
+    `concurrency` request workers pull batches from a shared queue, so exactly that many
+    requests are in flight across the whole video. Results are yielded in frame order, or as
+    they complete with `ordered=False`. `progress(done, total_frames)` is called after each
+    frame result.
+    """
+    loop = asyncio.get_event_loop()
+    client = client or get_client()
+    num_workers = num_workers or min(4, multiprocessing.cpu_count())
+    group_size = mosaic or (batch_size if process_as_group else 1)
+
+    decoded = asyncio.Queue(maxsize=queue_size)
+    encoded = asyncio.Queue(maxsize=queue_size)
+    batches = asyncio.Queue(maxsize=concurrency)
+    results = asyncio.Queue()
+    executor = ThreadPoolExecutor(max_workers=num_workers + 1)
+
+    deduplicator = FrameDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+    reference_results = {}
+    waiting_duplicates = {}
+    # Frame numbers in decode order, for putting results back in order
+    frame_order = collections.deque()
+    restored_order = collections.deque(sorted(restored or {}))
+
+    async def emit(result):
+        await results.put(result)
+        if deduplicator is None:
+            return
+        frame_number = result['frame_number']
+        if frame_number == deduplicator.reference_key:
+            reference_results[frame_number] = result['result']
+        for frame in waiting_duplicates.pop(frame_number, []):
+            await results.put(duplicate_result(frame, frame_number, result['result']))
+
+    async def decode_stage():
+        nonlocal layout
+        iterator = iter(frames)
+        sequence = 0
+        while True:
+            # Decoding happens in a worker thread so the event loop stays free for network I/O
+            frame = await loop.run_in_executor(executor, next, iterator, _DONE)
+            if frame is _DONE:
+                break
+            frame_order.append(frame['frame_number'])
+            if mosaic and layout is None:
+                height, width = frame['frame'].shape[:2]
+                layout = mosaic_layout((width, height), mosaic, max_size=max_size)
+            if deduplicator is not None:
+                while restored_order and restored_order[0] < frame['frame_number']:
+                    number = restored_order.popleft()
+                    if restored[number].get('duplicate_of') is None:
+                        deduplicator.restore(number, restored[number].get('frame_hash'))
+                        reference_results.clear()
+                        reference_results[number] = restored[number]['result']
+                frame_hash = await loop.run_in_executor(executor, difference_hash, frame['frame'])
+                original = deduplicator.check(frame['frame_number'], frame_hash)
+                if original is not None:
+                    frame = {'frame_number': frame['frame_number'], 'timestamp': frame['timestamp']}
+                    if original in reference_results:
+                        await results.put(duplicate_result(frame, original, reference_results[original]))
+                    else:
+                        waiting_duplicates.setdefault(original, []).append(frame)
+                    continue
+                # Only the current reference frame can collect further duplicates
+                reference_results.clear()
+                if frame_hashes is not None:
+                    frame_hashes[frame['frame_number']] = frame_hash
+            await decoded.put((sequence, frame))
+            sequence += 1
+        for _ in range(num_workers):
+            await decoded.put(_DONE)
+
+    async def encode_stage():
+        while True:
+            item = await decoded.get()
+            if item is _DONE:
+                await encoded.put(_DONE)
+                return
+            sequence, frame = item
+            if mosaic:
+                key, value = 'tile', await loop.run_in_executor(executor, encode_tile, frame['frame'], layout[2])
+            else:
+                key, value = 'image', await loop.run_in_executor(executor, encode_frame, frame['frame'], max_size)
+            await encoded.put((sequence, {
+                "frame_number": frame['frame_number'],
+                "timestamp": frame['timestamp'],
+                key: value
+            }))
+
+    async def batch_stage():
+        # Encode workers finish out of order; restore frame order before grouping
+        pending = {}
+        next_sequence = 0
+        batch = []
+        finished_workers = 0
+        while finished_workers < num_workers:
+            item = await encoded.get()
+            if item is _DONE:
+                finished_workers += 1
+                continue
+            pending[item[0]] = item[1]
+            while next_sequence in pending:
+                batch.append(pending.pop(next_sequence))
+                next_sequence += 1
+                if len(batch) == group_size:
+                    await batches.put(batch)
+                    batch = []
+        if batch:
+            await batches.put(batch)
+        for _ in range(concurrency):
+            await batches.put(_DONE)
+
+    async def request_stage():
+        while True:
+            batch = await batches.get()
+            if batch is _DONE:
+                return
+            if mosaic:
+                frame_results = await analyze_mosaic_batch(batch, layout[0], persona, output, prompt=prompt, system=system, client=client, executor=executor, **analysis_options)
+            else:
+                frame_results = await analyze_frame_batch(batch, persona, output, stream, prompt=prompt, system=system, process_as_group=process_as_group, client=client, **analysis_options)
+            for result in frame_results:
+                await emit(result)
+
+    tasks = [asyncio.ensure_future(decode_stage()), asyncio.ensure_future(batch_stage())]
+    tasks += [asyncio.ensure_future(encode_stage()) for _ in range(num_workers)]
+    tasks += [asyncio.ensure_future(request_stage()) for _ in range(concurrency)]
+
+    async def supervise():
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await results.put(_DONE)
+
+    supervisor = asyncio.ensure_future(supervise())
+    completed = 0
+    pending = {}
+    try:
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                break
+            completed += 1
+            if progress:
+                progress(completed, total_frames)
+            if not ordered:
+                yield result
+                continue
+            pending[result['frame_number']] = result
+            while frame_order and frame_order[0] in pending:
+                yield pending.pop(frame_order.popleft())
+        await supervisor
+        if deduplicator is not None:
+            logger.info(f"Skipped {deduplicator.skipped} near-duplicate frames")
+    finally:
+        for task in tasks + [supervisor]:
+            task.cancel()
+        executor.shutdown(wait=False)
+
+async def process_video_frames(frames, persona, output, stream, batch_size=20, prompt=None, system=None, process_as_group=False, client=None, num_workers=None, **analysis_options):
+    return [
+        result async for result in iter_frame_results(
+            frames, persona, output, stream, batch_size=batch_size, prompt=prompt, system=system,
+            process_as_group=process_as_group, client=client, num_workers=num_workers, **analysis_options
+        )
+    ]
+
+def plan_frame_requests(metadata, persona=None, prompt=None, system=None, process_as_group=False, token_budget=None):
+    """
+    Return how many frames go in each group request and the size frames are sent at.
+    """
+    batch_size = 20
+    max_size = MAX_IMAGE_SIZE
+    if token_budget:
+        text_tokens = estimate_request_tokens([], prompt or generate_prompt(persona), system)
+        batch_size, max_size = plan_uniform_requests(
+            (metadata['width'], metadata['height']), token_budget,
+            max_images=batch_size if process_as_group else 1, text_tokens=text_tokens
+        )
+        logger.info(f"Token budget {token_budget}: {batch_size} frames per request at {max_size[0]}x{max_size[1]}")
+    return batch_size, max_size
+
+def plan_mosaic_layout(frame_size, mosaic, persona=None, prompt=None, system=None, token_budget=None, last_frame=0):
+    """
+    Return (columns, rows, tile size) for grids of `mosaic` frames. With token_budget, the
+    grid image gets what the budget leaves after the mosaic prompt.
+    """
+    max_tokens = MAX_IMAGE_TOKENS
+    if token_budget:
+        # The prompt lists every frame's number; size it for the longest ones
+        text = mosaic_prompt([last_frame] * mosaic, prompt or generate_prompt(persona), 'json')
+        max_tokens = min(max_tokens, max(token_budget - estimate_request_tokens([], text, system), 1))
+    columns, rows, tile_size = mosaic_layout(frame_size, mosaic, max_tokens)
+    if token_budget:
+        logger.info(f"Token budget {token_budget}: {columns}x{rows} mosaics of {tile_size[0]}x{tile_size[1]} tiles")
+    return columns, rows, tile_size
+
+async def iter_video_results(video_path, frame_interval, persona, output, stream, num_workers=None, prompt=None, system=None, process_as_group=False, client=None, decode_strategy='auto', dedup_threshold=None, token_budget=None, max_frames=None, mosaic=None, concurrency=REQUEST_WORKERS, progress=None, checkpoint_dir=None, restart_checkpoint=False, metadata=None, **analysis_options):
+    """
+    Sample every frame_interval-th frame of a video, analyze it and yield each frame result,
+    in frame order, as soon as it and every earlier frame are done.
+
+    With token_budget, group mode packs as many frames into each request as fit in that many
+    input tokens and sizes every frame to share the budget; single-frame mode sizes each frame
+    to fit on its own.
+
+    max_frames stops after that many sampled frames.
+
+    With mosaic, that many frames are tiled into each request's single grid image instead,
+    and the grid is sized to the token budget.
+
+    With stream, responses are streamed from the API and each frame's text is yielded once it
+    is complete.
+
+    With checkpoint_dir, every frame result is appended to a checkpoint file keyed by the video
+    and the analysis parameters as soon as it arrives. A rerun with the same video and
+    parameters only decodes and requests the frames that are missing from it, and deduplicates
+    them against the saved frames. restart_checkpoint discards the saved frames first.
+    """
+    metadata = metadata or get_video_metadata(video_path)
+    if analysis_options.get('prompt_cache'):
+        # Frames differ from request to request, so only the system prompt and instructions can be cached
+        warn_if_uncacheable(output, system, None if mosaic else prompt or generate_prompt(persona))
+    # A mosaic's budget goes to the whole grid, not to each frame
+    batch_size, max_size = plan_frame_requests(metadata, persona, prompt, system, process_as_group and not mosaic, None if mosaic else token_budget)
+    layout = None
+    if mosaic:
+        layout = plan_mosaic_layout((metadata['width'], metadata['height']), mosaic, persona, prompt, system, token_budget, metadata['frame_count'])
+
+    checkpoint = None
+    saved = {}
+    if checkpoint_dir:
+        params = {
+            'frame_interval': frame_interval, 'persona': persona, 'output': output, 'prompt': prompt,
+            'system': system, 'process_as_group': process_as_group, 'dedup_threshold': dedup_threshold,
+            'token_budget': token_budget, 'mosaic': mosaic,
+            # Caching and the backend change what a run costs, not its results
+            'options': {key: value for key, value in analysis_options.items() if key not in ('use_cache', 'refresh_cache', 'prompt_cache', 'backend')},
+        }
+        checkpoint = VideoCheckpoint.for_video(video_path, params, checkpoint_dir)
+        if restart_checkpoint:
+            checkpoint.clear()
+        saved = checkpoint.load()
+        if saved:
+            logger.info(f"Resuming from {checkpoint.path}: {len(saved)} frames already analyzed")
+
+    frames = iter_frames(video_path, frame_interval, decode_strategy, skip_frames=set(saved))
+    total_frames = math.ceil(metadata['frame_count'] / frame_interval)
+    if max_frames is not None:
+        frames = itertools.takewhile(lambda frame: frame['frame_number'] < max_frames * frame_interval, frames)
+        saved = {number: result for number, result in saved.items() if number < max_frames * frame_interval}
+        total_frames = min(total_frames, max_frames)
+
+    if progress and saved:
+        report = progress
+        progress = lambda done, total: report(len(saved) + done, total)
+
+    # Saved results are merged back in ahead of the first new frame that follows them
+    saved_results = collections.deque(
+        {key: value for key, value in saved[number].items() if key != 'frame_hash'} for number in sorted(saved)
+    )
+    # Kept frames' hashes are checkpointed with their results, for deduplicating a resumed run
+    frame_hashes = {} if checkpoint and dedup_threshold is not None else None
+    try:
+        async for result in iter_frame_results(
+            frames, persona, output, stream, batch_size=batch_size, prompt=prompt, system=system,
+            process_as_group=process_as_group, client=client, num_workers=num_workers,
+            dedup_threshold=dedup_threshold, max_size=max_size, mosaic=mosaic, concurrency=concurrency,
+            progress=progress, total_frames=total_frames, restored=saved, frame_hashes=frame_hashes,
+            layout=layout, **analysis_options
+        ):
+            if checkpoint:
+                frame_hash = frame_hashes.pop(result['frame_number'], None) if frame_hashes is not None else None
+                checkpoint.append(result if frame_hash is None else {**result, 'frame_hash': frame_hash})
+            while saved_results and saved_results[0]['frame_number'] < result['frame_number']:
+                yield saved_results.popleft()
+            yield result
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    while saved_results:
+        yield saved_results.popleft()
+
+async def analyze_video(video_path, frame_interval, persona, output, stream, num_workers=None, **options):
+    """
+    Analyze a video with iter_video_results and return (metadata, frame results).
+    """
     metadata = get_video_metadata(video_path)
-    frames = extract_frames(video_path, frame_interval, num_workers)
-    frame_results = await process_video_frames(frames, persona, output, stream, prompt=prompt, system=system, process_as_group=process_as_group)
+    frame_results = [
+        result async for result in iter_video_results(video_path, frame_interval, persona, output, stream, num_workers, metadata=metadata, **options)
+    ]
     return metadata, frame_results
 
 def generate_prompt(persona=None):
     base_prompt = "Analyze this video frame and provide a detailed description."
     if persona:
         return f"As a {persona}, {base_prompt}"
-    return base_prompt
\ No newline at end of file
+    return base_prompt
@@ -1,13 +1,9 @@
 import cv2
 import os
+import time
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
-import multiprocessing
-
-def is_video_file(file_path):
-    video_extensions = ['.mp4', '.avi', '.mov', '.mkv']
-    _, ext = os.path.splitext(file_path)
-    return ext.lower() in video_extensions
+from .utils import logger, is_video_file, DECODE_STRATEGIES
+from .metrics import span
 
 def get_video_metadata(file_path):
     cap = cv2.VideoCapture(file_path)
@@ -35,30 +31,99 @@ def process_frame(args):
         'timestamp': frame_number * interval
     }
     
-def extract_frames(video_path, interval, num_workers=None):
-    if num_workers is None:
-        num_workers = multiprocessing.cpu_count()
+def measure_gop_length(cap, grab_samples=30, probes=3):
+    """
+    Estimate the keyframe interval (GOP length) of an open capture from decode timings.
 
-    cap = cv2.VideoCapture(video_path)
+    A seek lands on the preceding keyframe and decodes forward to the target, which costs
+    about half a GOP of frames on average. Comparing the time of a few seeks against the
+    time of a plain grab() gives that distance in frames.
+    """
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    frame_indices = range(0, total_frames, interval)
-    
-    frames = []
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        futures = []
-        for i in frame_indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-            ret, frame = cap.read()
-            if ret:
-                futures.append(executor.submit(process_frame, (frame, i, interval / fps)))
-        
-        for future in futures:
-            frames.append(future.result())
-    
-    cap.release()
-    return frames
+    if total_frames < grab_samples * 2:
+        return 1.0
+
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    start = time.perf_counter()
+    for _ in range(grab_samples):
+        cap.grab()
+    grab_cost = (time.perf_counter() - start) / grab_samples
+    start = time.perf_counter()
+    cap.retrieve()
+    retrieve_cost = time.perf_counter() - start
+
+    seek_costs = []
+    for probe in range(1, probes + 1):
+        position = total_frames * probe // (probes + 1)
+        start = time.perf_counter()
+        cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+        cap.read()
+        seek_costs.append(time.perf_counter() - start)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    seek_frames = max(0.0, sum(seek_costs) / len(seek_costs) - retrieve_cost) / max(grab_cost, 1e-9)
+    return max(1.0, 2 * seek_frames)
+
+def choose_decode_strategy(interval, gop_length):
+    """
+    Reading straight through grabs interval - 1 frames per sample; a seek decodes about half a GOP.
+    """
+    return 'seek' if interval - 1 > gop_length / 2 else 'sequential'
+
+def iter_frames(video_path, interval, strategy='auto', skip_frames=None):
+    """
+    Lazily decode every `interval`-th frame of a video, yielding one RGB frame at a time.
+
+    'sequential' reads straight through, grab()bing skipped frames and only retrieving sampled
+    ones; 'seek' jumps to each sampled frame. 'auto' picks whichever is cheaper for the
+    interval given the video's measured GOP length.
+
+    Sampled frames whose numbers are in `skip_frames` are passed over without being decoded.
+    """
+    skip_frames = skip_frames or ()
+    if strategy not in DECODE_STRATEGIES:
+        raise ValueError(f"Unknown decode strategy {strategy!r}; expected one of {', '.join(DECODE_STRATEGIES)}")
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+
+        if strategy == 'auto':
+            gop_length = measure_gop_length(cap)
+            strategy = choose_decode_strategy(interval, gop_length)
+            logger.debug(f"Measured GOP length {gop_length:.1f} for {video_path}; decoding with {strategy} strategy")
+
+        if strategy == 'sequential':
+            for i in range(total_frames):
+                if i % interval == 0 and i not in skip_frames:
+                    with span('video.decode'):
+                        ret, frame = cap.read()
+                        sampled = process_frame((frame, i, 1 / fps)) if ret else None
+                    if not ret:
+                        break
+                    yield sampled
+                else:
+                    with span('video.skip'):
+                        grabbed = cap.grab()
+                    if not grabbed:
+                        break
+        else:
+            for i in range(0, total_frames, interval):
+                if i in skip_frames:
+                    continue
+                with span('video.decode'):
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+                    ret, frame = cap.read()
+                    sampled = process_frame((frame, i, 1 / fps)) if ret else None
+                if ret:
+                    yield sampled
+    finally:
+        cap.release()
+
+def extract_frames(video_path, interval, num_workers=None, strategy='auto'):
+    # num_workers is kept for backwards compatibility; frames are decoded in a single pass
+    return list(iter_frames(video_path, interval, strategy))
 
 def save_frames(frames, output_dir):
     os.makedirs(output_dir, exist_ok=True)
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import struct
+import ctypes
+import asyncio
+import hashlib
+from typing import Callable, Dict, List, Optional, Tuple, AsyncIterator
+from .config import CACHE_DIR, WATCH_SETTLE, WATCH_POLL_INTERVAL
+from .batch import analyze_entry, entry_prompt, DEFAULT_CONCURRENCY
+from .claude_integration import warn_if_uncacheable
+from .json_utils import dumps
+from .metrics import span, count
+from .utils import logger, is_image_file
+
+WATCH_LEDGER_DIR = os.path.join(CACHE_DIR, 'watch')
+
+# A file's (size, modification time in ns): when either changes, the file is analyzed again
+Signature = Tuple[int, int]
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# struct inotify_event header: wd, mask, cookie, len, followed by len bytes of NUL-padded name
+EVENT_HEADER = struct.Struct('iIII')
+
+_DONE = object()
+
+def file_signature(path: str) -> Optional[Signature]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class Inotify:
+    """
+    Non-blocking inotify watch on one directory, through libc with ctypes.
+    """
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, os.strerror(error))
+        self.fd = fd
+
+    def read(self) -> Optional[List[str]]:
+        """
+        Return the names of the files that had events since the last read, or None if the
+        kernel's event queue overflowed and some were lost.
+        """
+        names = []
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif name and not mask & IN_ISDIR:
+                    names.append(os.fsdecode(name))
+        return None if overflowed else names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+def open_inotify(directory: str) -> Optional[Inotify]:
+    """
+    Watch directory with inotify, or return None where it isn't available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return Inotify(directory)
+    except (OSError, AttributeError) as e:
+        logger.info(f"inotify is unavailable ({e}); polling {directory} instead")
+        return None
+
+class DirectoryWatcher:
+    """
+    Reports the image files in a directory that are new, or have changed since they were
+    last reported, once they have settled.
+
+    A file has settled when its size and modification time have stayed the same for `settle`
+    seconds, so files that are still being copied or written aren't picked up half-written.
+    Changes are noticed through inotify where available (`use_inotify=None`), and otherwise
+    by rescanning the directory every `poll_interval` seconds. Hidden files, such as the
+    temporary files rsync and many uploaders write before renaming, are ignored. Settling is
+    timed with `clock`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        known: Optional[Dict[str, Signature]] = None,
+        settle: float = WATCH_SETTLE,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+        use_inotify: Optional[bool] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.known = dict(known or {})
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.clock = clock
+        # Files waiting to settle: the signature they were last seen with, and since when
+        self.pending: Dict[str, Tuple[Signature, float]] = {}
+
+    def note(self, path: str, now: float) -> None:
+        if os.path.basename(path).startswith('.') or not is_image_file(path):
+            self.pending.pop(path, None)
+            return
+        signature = file_signature(path)
+        if signature is None or signature == self.known.get(path):
+            self.pending.pop(path, None)
+        elif path not in self.pending or self.pending[path][0] != signature:
+            self.pending[path] = (signature, now)
+
+    def scan(self, now: float) -> None:
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                self.note(entry.path, now)
+
+    async def changes(self, once: bool = False) -> AsyncIterator[Tuple[str, Signature]]:
+        """
+        Yield (path, signature) for each file as it settles, forever, or with `once` until
+        every file that was there at the start has been yielded.
+
+        The directory isn't read while the caller is busy with a yielded file, so a slow
+        consumer holds changes back; inotify keeps them queued in the kernel, and if that
+        queue overflows the directory is rescanned.
+        """
+        loop = asyncio.get_event_loop()
+        notifier = open_inotify(self.directory) if self.use_inotify is not False and not once else None
+        if self.use_inotify and notifier is None and not once:
+            raise OSError(f"Can't watch {self.directory} with inotify")
+        woken = asyncio.Event()
+        try:
+            self.scan(self.clock())
+            while True:
+                for path, (signature, since) in list(self.pending.items()):
+                    now = self.clock()
+                    if now - since < self.settle:
+                        continue
+                    if file_signature(path) != signature:
+                        # Still being written, or gone
+                        self.note(path, now)
+                        continue
+                    del self.pending[path]
+                    self.known[path] = signature
+                    yield path, signature
+                if once and not self.pending:
+                    return
+
+                timeout = None if notifier else self.poll_interval
+                if self.pending:
+                    next_settled = min(since for _, since in self.pending.values()) + self.settle
+                    timeout = max(0.0, min(next_settled - self.clock(), timeout or float('inf')))
+                # The fd is level-triggered, so it's only watched while waiting: left registered
+                # while the caller holds a yielded file, pending events would wake the loop nonstop
+                if notifier:
+                    loop.add_reader(notifier.fd, woken.set)
+                try:
+                    await asyncio.wait_for(woken.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    if notifier:
+                        loop.remove_reader(notifier.fd)
+
+                now = self.clock()
+                if once:
+                    continue
+                if notifier is None:
+                    self.scan(now)
+                elif woken.is_set():
+                    woken.clear()
+                    names = notifier.read()
+                    if names is None:
+                        logger.warning(f"Missed changes in {self.directory}; rescanning it")
+                        self.scan(now)
+                    else:
+                        for name in names:
+                            self.note(os.path.join(self.directory, name), now)
+        finally:
+            if notifier:
+                notifier.close()
+
+class WatchLedger:
+    """
+    Append-only JSONL record of the files a watch has analyzed, with the size and
+    modification time each had, so a restarted watch skips them unless they've changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self._file = None
+
+    @classmethod
+    def for_watch(cls, directory: str, output_path: str, ledger_dir: str = WATCH_LEDGER_DIR) -> 'WatchLedger':
+        """
+        The ledger of watching this directory into this output file.
+        """
+        identity = json.dumps([os.path.abspath(directory), os.path.abspath(output_path)])
+        key = hashlib.sha256(identity.encode('utf-8')).hexdigest()
+        return cls(os.path.join(os.path.expanduser(ledger_dir), f"{key}.jsonl"))
+
+    def load(self) -> Dict[str, Signature]:
+        processed = {}
+        if not os.path.exists(self.path):
+            return processed
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    processed[record['path']] = (record['size'], record['mtime_ns'])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # A run killed mid-write can leave a truncated last line
+                    continue
+        return processed
+
+    def record(self, path: str, signature: Signature) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a')
+        size, mtime_ns = signature
+        self._file.write(dumps({"path": path, "size": size, "mtime_ns": mtime_ns}) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+async def run_watch(
+    directory: str,
+    output_path: str,
+    ledger: Optional[WatchLedger] = None,
+    output: str = 'text',
+    prompt: Optional[str] = None,
+    persona: Optional[str] = None,
+    system: Optional[str] = None,
+    max_tokens: int = 1000,
+    prefill: Optional[str] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    settle: float = WATCH_SETTLE,
+    poll_interval: float = WATCH_POLL_INTERVAL,
+    use_inotify: Optional[bool] = None,
+    once: bool = False,
+    **analysis_options
+) -> Dict[str, int]:
+    """
+    Analyze every image file in directory that isn't in the ledger yet, then keep analyzing
+    new and changed files as they settle until cancelled, or with `once`, stop when the files
+    that were there at the start are done.
+
+    At most `concurrency` files are analyzed at once, and the watch waits for a free slot
+    before picking up more changes. Results are appended to output_path as JSONL in
+    completion order, one {"file", "result"} or {"file", "error"} object per file. Only
+    successful files go in the ledger, so a failed file is retried when it changes or the
+    watch restarts.
+    """
+    ledger = ledger or WatchLedger.for_watch(directory, output_path)
+    watcher = DirectoryWatcher(directory, ledger.load(), settle, poll_interval, use_inotify)
+    summary = {'succeeded': 0, 'failed': 0}
+    files = asyncio.Queue(maxsize=concurrency)
+    if analysis_options.get('prompt_cache'):
+        warn_if_uncacheable(output, system, entry_prompt({'files': [None], 'prompt': prompt, 'persona': persona}))
+
+    with open(output_path, 'a') as out:
+        async def analyze_files():
+            while True:
+                item = await files.get()
+                if item is _DONE:
+                    return
+                path, signature = item
+                entry = {'files': [path], 'output': output, 'prompt': prompt, 'persona': persona, 'system': system, 'max_tokens': max_tokens, 'prefill': prefill}
+                # Every file gets the same instructions, so with prompt caching they're a shared prefix
+                hints = {'prompt_prefix': entry_prompt(entry)} if analysis_options.get('prompt_cache') else {}
+                try:
+                    record = {"file": path, "result": await analyze_entry(entry, **hints, **analysis_options)}
+                except Exception as e:
+                    logger.error(f"Watched file {path} failed: {e}")
+                    record = {"file": path, "error": str(e)}
+                count('watch_files_failed' if 'error' in record else 'watch_files_succeeded')
+                with span('output.write'):
+                    out.write(dumps(record) + "\n")
+                    out.flush()
+                if 'error' in record:
+                    summary['failed'] += 1
+                else:
+                    ledger.record(path, signature)
+                    summary['succeeded'] += 1
+
+        workers = [asyncio.ensure_future(analyze_files()) for _ in range(concurrency)]
+        try:
+            logger.info(f"Watching {watcher.directory}: {len(watcher.known)} files already analyzed")
+            async for change in watcher.changes(once):
+                await files.put(change)
+            for _ in workers:
+                await files.put(_DONE)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            ledger.close()
+
+    return summary
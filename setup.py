@@ -12,6 +12,10 @@ setup(
         "pyyaml",
         "jsonschema",
     ],
+    extras_require={
+        "http2": ["httpx[http2]"],
+        "fast-json": ["orjson"],
+    },
     entry_points={
         "console_scripts": [
             "claude-vision=claude_vision.cli:cli",
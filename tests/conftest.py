@@ -0,0 +1,25 @@
+import pytest
+
+@pytest.fixture
+def make_video(tmp_path):
+    """
+    Return a function that writes a 10 fps MJPG video and returns its path. Frame i is
+    frame(i), a (height, width, 3) uint8 array, or by default a flat gray of brightness i * 8.
+    """
+    import cv2
+    import numpy as np
+
+    def make(size=(64, 48), frame_count=30, frame=None, name="sample.avi"):
+        width, height = size
+        frame = frame or (lambda i: np.full((height, width, 3), i * 8, dtype=np.uint8))
+        path = str(tmp_path / name)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10.0, size)
+        for i in range(frame_count):
+            writer.write(frame(i))
+        writer.release()
+        return path
+    return make
+
+@pytest.fixture
+def sample_video(make_video):
+    return make_video()
@@ -29,6 +29,19 @@ async def test_persona_based_analysis():
         result = await persona_based_analysis('base64_image', 'art_critic', 'noir_detective', 'text', False)
         assert result == 'Persona-based analysis result'
 
+@pytest.mark.asyncio
+async def test_persona_based_analysis_shares_the_image_across_personas_with_prompt_cache():
+    with patch('claude_vision.advanced_features.claude_vision_analysis') as mock_analysis:
+        mock_analysis.return_value = 'Persona-based analysis result'
+        for persona in ('art_critic', 'botanist'):
+            await persona_based_analysis('base64_image', persona, 'text', False, prompt_cache=True)
+
+    critic, botanist = mock_analysis.await_args_list
+    # Same system prompt and leading cached image; only the text after it differs
+    assert 'system' not in critic.kwargs and 'system' not in botanist.kwargs
+    assert critic.kwargs['cached_images'] == botanist.kwargs['cached_images'] == 1
+    assert critic.args[1] != botanist.args[1]
+
 @pytest.mark.asyncio
 async def test_comparative_time_series_analysis():
     with patch('claude_vision.advanced_features.claude_vision_analysis') as mock_analysis:
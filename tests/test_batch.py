@@ -0,0 +1,61 @@
+import json
+import pytest
+from unittest.mock import patch, AsyncMock
+from claude_vision.batch import load_manifest, completed_ids, run_batch
+
+def write_manifest(path, entries):
+    path.write_text("\n".join(json.dumps(entry) for entry in entries) + "\n")
+
+def test_load_manifest_defaults_ids_to_line_numbers(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"files": "a.jpg"}\n\n{"id": "x", "files": ["b.jpg", "c.jpg"]}\n')
+    entries = load_manifest(str(manifest))
+    assert [entry['id'] for entry in entries] == [1, "x"]
+    assert entries[0]['files'] == ["a.jpg"]
+
+def test_load_manifest_rejects_duplicate_ids(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    write_manifest(manifest, [{"id": 1, "files": "a.jpg"}, {"id": 1, "files": "b.jpg"}])
+    with pytest.raises(ValueError):
+        load_manifest(str(manifest))
+
+@pytest.mark.asyncio
+async def test_run_batch_resumes(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    output = tmp_path / "results.jsonl"
+    write_manifest(manifest, [{"id": i, "files": f"{i}.jpg", "prompt": f"prompt {i}"} for i in range(5)])
+    output.write_text('{"id": 0, "result": "done"}\n{"id": 1, "error": "boom"}\n')
+
+    with patch('claude_vision.batch.process_multiple_images', AsyncMock(return_value=['img'])), \
+         patch('claude_vision.batch.claude_vision_analysis', AsyncMock(return_value='analysis')) as mock_analysis:
+        summary = await run_batch(str(manifest), str(output), concurrency=2)
+
+    assert summary == {'total': 5, 'skipped': 1, 'succeeded': 4, 'failed': 0}
+    assert mock_analysis.await_count == 4
+    assert completed_ids(str(output)) == {0, 1, 2, 3, 4}
+
+@pytest.mark.asyncio
+async def test_run_batch_marks_shared_prompts_and_images_for_prompt_caching(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    output = tmp_path / "results.jsonl"
+    write_manifest(manifest, [
+        {"id": 0, "files": "a.jpg", "prompt": "Count the cars."},
+        {"id": 1, "files": "b.jpg", "prompt": "Count the cars."},
+        {"id": 2, "files": "a.jpg", "prompt": "Read the signs."},
+        {"id": 3, "files": "a.jpg", "prompt": "Read the signs."},
+        {"id": 4, "files": "a.jpg", "prompt": "Read the signs.", "system": "Be terse."},
+    ])
+
+    with patch('claude_vision.batch.process_multiple_images', AsyncMock(return_value=['img'])), \
+         patch('claude_vision.batch.claude_vision_analysis', AsyncMock(return_value='analysis')) as mock_analysis:
+        await run_batch(str(manifest), str(output), concurrency=1, prompt_cache=True)
+
+    hints = [(call.kwargs['prompt_prefix'], call.kwargs['cached_images']) for call in mock_analysis.await_args_list]
+    # Shared prompts move into the cached prefix. Images are only cached when another entry
+    # sends them after the same system prompt and prefix: entry 0's a.jpg follows "Count the
+    # cars.", so it can't reuse entries 2 and 3's, and entry 4's system prompt differs.
+    assert hints == [
+        ("Count the cars.", 0), ("Count the cars.", 0),
+        ("Read the signs.", 1), ("Read the signs.", 1),
+        (None, 0),
+    ]
@@ -0,0 +1,102 @@
+import json
+import asyncio
+import pytest
+from PIL import Image
+from click.testing import CliRunner
+from unittest.mock import patch
+from claude_vision.batch_api import MessageBatcher, RequestSpool, result_error
+from claude_vision.cli import cli
+from claude_vision.claude_integration import claude_vision_analysis, build_request
+from claude_vision.exceptions import InvalidRequestError, APIError
+from claude_vision.http_client import close_client
+from claude_vision.json_utils import JSONBody
+from claude_vision.mock_server import MockAnthropicServer
+
+IMAGE = 'iVBORw0KGgo' + 'A' * 100
+
+@pytest.fixture
+def server():
+    with MockAnthropicServer(batch_latency=0.1) as server:
+        with patch('claude_vision.batch_api.ANTHROPIC_API_URL', server.url), \
+             patch('claude_vision.claude_integration.ANTHROPIC_API_URL', server.url):
+            yield server
+
+@pytest.mark.asyncio
+async def test_batcher_splits_submissions_and_maps_results_back(server):
+    batcher = MessageBatcher(max_requests=2, linger=0.01, poll_interval=0.02)
+    params = [build_request([IMAGE] * count, "Describe.", 'text')[1] for count in range(5)]
+    try:
+        messages = await asyncio.gather(*(batcher.submit(request) for request in params))
+    finally:
+        await close_client()
+
+    assert [message['content'][0]['text'] for message in messages] == [
+        "Mock analysis of 0 images.", "Mock analysis of 1 image.", "Mock analysis of 2 images.",
+        "Mock analysis of 3 images.", "Mock analysis of 4 images.",
+    ]
+    assert len(batcher.submitted) == 3
+    assert [len(batch['results']) for batch in server.batches.values()] == [2, 2, 1]
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_before_exceeding_max_bytes(server):
+    params = build_request([IMAGE], "Describe.", 'text')[1]
+    batcher = MessageBatcher(max_bytes=len(str(params)) + 100, linger=0.01, poll_interval=0.02)
+    try:
+        await asyncio.gather(batcher.submit(params), batcher.submit(params))
+    finally:
+        await close_client()
+
+    assert len(server.batches) == 2
+
+@pytest.mark.asyncio
+async def test_batch_api_backend_answers_like_the_messages_api(server):
+    batcher = MessageBatcher(linger=0.01, poll_interval=0.02)
+    with patch('claude_vision.claude_integration.get_message_batcher', return_value=batcher):
+        try:
+            text = await claude_vision_analysis([IMAGE], "Describe this.", 'json', backend='batch-api')
+            stream = await claude_vision_analysis([IMAGE], "Describe this.", 'text', stream=True, backend='batch-api')
+            chunks = [chunk async for chunk in stream]
+        finally:
+            await close_client()
+
+    assert text == '{ "description": "Mock analysis of 1 image."}'
+    assert ''.join(chunks) == "Mock analysis of 1 image."
+    # Every request went through a batch, none to the Messages endpoint
+    submissions = [request for request in server.requests if 'requests' in request]
+    assert len(submissions) == len(server.batches) == 2
+    assert not any('messages' in request for request in server.requests)
+    assert all('stream' not in entry['params'] for submission in submissions for entry in submission['requests'])
+
+def test_result_error_maps_error_types():
+    errored = {'type': 'errored', 'error': {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': "max_tokens: too large"}}}
+
+    assert isinstance(result_error('req-0', errored), InvalidRequestError)
+    assert str(result_error('req-0', errored)) == "max_tokens: too large"
+    assert isinstance(result_error('req-1', {'type': 'expired'}), APIError)
+    assert str(result_error('req-1', {'type': 'expired'})) == "Batch request req-1 expired"
+
+@pytest.mark.asyncio
+async def test_request_spool_reads_back_as_the_submission_body():
+    requests = [{'custom_id': f"req-{i}", 'params': build_request([IMAGE] * i, "Describe.", 'text')[1]} for i in range(3)]
+    spool = RequestSpool()
+    for request in requests:
+        spool.add(JSONBody(request, separators=(',', ':')))
+
+    body = b''.join([chunk async for chunk in spool])
+    # Read again, as a retried upload would
+    assert b''.join([chunk async for chunk in spool]) == body
+    spool.close()
+    assert json.loads(body) == {'requests': requests}
+    assert len(spool) == len(body)
+
+def test_analyze_packs_a_large_batch_api_job_into_one_submission(server, tmp_path):
+    for i in range(120):
+        Image.new('RGB', (8, 8), (i, i, i)).save(tmp_path / f"image-{i:03}.png")
+
+    with patch.dict('claude_vision.batch_api._batcher_settings', {'linger': 0.2, 'poll_interval': 0.02}):
+        result = CliRunner().invoke(cli, ['analyze', str(tmp_path), '--backend', 'batch-api', '--no-cache', '--output', 'ndjson'])
+
+    assert result.exit_code == 0, result.output
+    assert len(result.output.splitlines()) == 120
+    # Every request was queued while the first submission was still open
+    assert [len(batch['results']) for batch in server.batches.values()] == [120]
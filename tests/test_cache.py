@@ -0,0 +1,42 @@
+import os
+import time
+import pytest
+from claude_vision.cache import DiskCache, response_cache_key, replay_stream
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(str(tmp_path / "cache"), max_bytes=1000)
+
+def test_get_set_counts_hits_and_misses(cache):
+    assert cache.get("abc") is None
+    cache.set("abc", b"value")
+    assert cache.get("abc") == b"value"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_lru_eviction(cache):
+    cache.set("aa", b"x" * 400)
+    cache.set("bb", b"x" * 400)
+    # Make "aa" the most recently used entry
+    os.utime(cache._path("bb"), (time.time() - 100, time.time()))
+    cache.get("aa")
+    cache.set("cc", b"x" * 400)
+    assert cache.get("bb") is None
+    assert cache.get("aa") is not None
+    assert cache.get("cc") is not None
+    assert cache.size() <= 1000
+
+def test_ttl_expiry(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1000, ttl=60)
+    cache.set("abc", b"value")
+    os.utime(cache._path("abc"), (time.time(), time.time() - 120))
+    assert cache.get("abc") is None
+
+def test_response_cache_key_ignores_stream():
+    data = {"model": "m", "system": "s", "max_tokens": 10, "messages": [{"role": "user", "content": "hi"}]}
+    assert response_cache_key(dict(data, stream=True)) == response_cache_key(dict(data, stream=False))
+    assert response_cache_key(data) != response_cache_key(dict(data, max_tokens=20))
+
+@pytest.mark.asyncio
+async def test_replay_stream():
+    chunks = [chunk async for chunk in replay_stream("abcdefgh", chunk_size=3)]
+    assert chunks == ["abc", "def", "gh"]
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from unittest.mock import patch, AsyncMock
+from claude_vision.checkpoint import VideoCheckpoint, checkpoint_key
+from claude_vision.video_processing import analyze_video
+
+def test_checkpoint_key_depends_on_video_and_params(sample_video, tmp_path):
+    other = tmp_path / "other.avi"
+    other.write_bytes(open(sample_video, 'rb').read() + b'\0')
+    key = checkpoint_key(sample_video, {'frame_interval': 5})
+    assert key == checkpoint_key(sample_video, {'frame_interval': 5})
+    assert key != checkpoint_key(sample_video, {'frame_interval': 10})
+    assert key != checkpoint_key(str(other), {'frame_interval': 5})
+
+def test_checkpoint_survives_truncated_line(tmp_path):
+    checkpoint = VideoCheckpoint(str(tmp_path / "run.jsonl"), "key")
+    checkpoint.append({'frame_number': 0, 'result': 'a'})
+    checkpoint.close()
+    with open(checkpoint.path, 'a') as f:
+        f.write('{"frame_number": 5, "res')
+    checkpoint.append({'frame_number': 10, 'result': 'c'})
+    checkpoint.close()
+    assert sorted(checkpoint.load()) == [0, 10]
+    assert VideoCheckpoint(checkpoint.path, "other key").load() == {}
+
+@pytest.mark.asyncio
+async def test_analyze_video_resumes_from_checkpoint(sample_video, tmp_path):
+    calls = 0
+
+    async def flaky(images, prompt, output, stream, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls > 3:
+            raise RuntimeError("network blip")
+        return prompt
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=flaky)):
+        with pytest.raises(RuntimeError):
+            await analyze_video(sample_video, 5, None, 'text', False, concurrency=1, checkpoint_dir=str(tmp_path))
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=lambda images, prompt, *args, **kwargs: prompt)) as mock_analysis:
+        _, results = await analyze_video(sample_video, 5, None, 'text', False, checkpoint_dir=str(tmp_path))
+
+    assert mock_analysis.await_count == 3
+    assert [result['frame_number'] for result in results] == [0, 5, 10, 15, 20, 25]
+    assert all(result['result'].startswith(f"Analyze frame {result['frame_number']} ") for result in results)
+
+    # A different prompt is a different run
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='x')) as mock_analysis:
+        await analyze_video(sample_video, 5, None, 'text', False, prompt="Count the boats.", checkpoint_dir=str(tmp_path))
+    assert mock_analysis.await_count == 6
+
+@pytest.mark.asyncio
+async def test_resumed_run_deduplicates_against_saved_frames(make_video, tmp_path):
+    gradient = np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (48, 1))[..., None].repeat(3, axis=2)
+    # Frames 0-19 are one scene and 20-29 another
+    path = make_video(frame=lambda i: gradient if i < 20 else gradient[:, ::-1].copy())
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='scene')):
+        await analyze_video(path, 5, None, 'text', False, dedup_threshold=4, max_frames=1, checkpoint_dir=str(tmp_path))
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='scene')) as mock_analysis:
+        _, results = await analyze_video(path, 5, None, 'text', False, dedup_threshold=4, checkpoint_dir=str(tmp_path))
+
+    # Frames 5-15 duplicate the saved frame 0, so only frame 20 is sent
+    assert mock_analysis.await_count == 1
+    assert [result.get('duplicate_of') for result in results] == [None, 0, 0, 0, None, 20]
+    assert not any('frame_hash' in result for result in results)
+
+@pytest.mark.asyncio
+async def test_only_restart_discards_the_checkpoint(sample_video, tmp_path):
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='x')):
+        await analyze_video(sample_video, 5, None, 'text', False, checkpoint_dir=str(tmp_path))
+
+    # Refreshing the response cache still resumes from the saved frames
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='x')) as mock_analysis:
+        await analyze_video(sample_video, 5, None, 'text', False, checkpoint_dir=str(tmp_path), refresh_cache=True)
+    assert mock_analysis.await_count == 0
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='x')) as mock_analysis:
+        await analyze_video(sample_video, 5, None, 'text', False, checkpoint_dir=str(tmp_path), restart_checkpoint=True)
+    assert mock_analysis.await_count == 6
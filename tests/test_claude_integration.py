@@ -1,41 +1,107 @@
+import json
 import pytest
-from unittest.mock import patch, MagicMock
-from claude_vision.claude_integration import claude_vision_analysis
+from unittest.mock import patch, MagicMock, AsyncMock
+from claude_vision.claude_integration import claude_vision_analysis, cached_content, warn_if_uncacheable, PROMPT_CACHE_MIN_TOKENS
 from claude_vision.exceptions import APIError
 
 @pytest.mark.asyncio
 async def test_claude_vision_analysis():
-    with patch('claude_vision.claude_integration.httpx.AsyncClient') as mock_client:
+    with patch('claude_vision.claude_integration.get_client') as mock_client:
         mock_response = MagicMock()
         mock_response.json.return_value = {
             'content': [{'text': 'Test response'}]
         }
-        mock_client.return_value.__aenter__.return_value.post.return_value = mock_response
+        mock_client.return_value.post = AsyncMock(return_value=mock_response)
 
         result = await claude_vision_analysis(['base64_image'], 'Describe the image', 'text')
         assert result == 'Test response'
 
 @pytest.mark.asyncio
 async def test_claude_vision_analysis_error():
-    with patch('claude_vision.claude_integration.httpx.AsyncClient') as mock_client:
+    with patch('claude_vision.claude_integration.get_client') as mock_client:
         mock_response = MagicMock()
         mock_response.raise_for_status.side_effect = APIError('API Error')
-        mock_client.return_value.__aenter__.return_value.post.return_value = mock_response
+        mock_client.return_value.post = AsyncMock(return_value=mock_response)
 
         with pytest.raises(APIError):
             await claude_vision_analysis(['base64_image'], 'Describe the image', 'text')
 
 @pytest.mark.asyncio
 async def test_claude_vision_analysis_stream():
-    with patch('claude_vision.claude_integration.httpx.AsyncClient') as mock_client:
-        mock_response = MagicMock()
-        mock_response.aiter_lines.return_value = [
+    async def aiter_lines():
+        for line in [
             'data: {"type": "content_block_delta", "delta": {"text": "Chunk 1"}}',
             'data: {"type": "content_block_delta", "delta": {"text": "Chunk 2"}}',
             'data: {"type": "message_stop"}'
-        ]
-        mock_client.return_value.__aenter__.return_value.post.return_value = mock_response
+        ]:
+            yield line
+
+    with patch('claude_vision.claude_integration.get_client') as mock_client:
+        mock_response = MagicMock()
+        mock_response.aiter_lines = aiter_lines
+        mock_client.return_value.post = AsyncMock(return_value=mock_response)
 
         result = await claude_vision_analysis(['base64_image'], 'Describe the image', 'text', stream=True)
         chunks = [chunk async for chunk in result]
-        assert chunks == ['Chunk 1', 'Chunk 2']
\ No newline at end of file
+        assert chunks == ['Chunk 1', 'Chunk 2']
+        # The shared client made the request
+        mock_client.return_value.post.assert_awaited_once()
+        assert json.loads(b''.join(mock_client.return_value.post.await_args.kwargs['content'].chunks()))['stream'] is True
+
+@pytest.mark.asyncio
+async def test_claude_vision_analysis_explicit_client():
+    client = MagicMock()
+    mock_response = MagicMock()
+    mock_response.json.return_value = {'content': [{'text': 'Explicit client'}]}
+    client.post = AsyncMock(return_value=mock_response)
+
+    with patch('claude_vision.claude_integration.get_client') as mock_get_client:
+        result = await claude_vision_analysis(['base64_image'], 'Describe the image', 'text', client=client)
+        assert result == 'Explicit client'
+        mock_get_client.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_claude_vision_analysis_cached(tmp_path):
+    from claude_vision.cache import DiskCache
+    cache = DiskCache(str(tmp_path), max_bytes=10000)
+    with patch('claude_vision.claude_integration.get_client') as mock_client, \
+         patch('claude_vision.claude_integration.get_response_cache', return_value=cache):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {'content': [{'text': 'Cached response'}]}
+        mock_client.return_value.post = AsyncMock(return_value=mock_response)
+
+        first = await claude_vision_analysis(['base64_image'], 'Describe the image', 'text', use_cache=True)
+        second = await claude_vision_analysis(['base64_image'], 'Describe the image', 'text', use_cache=True)
+        streamed = await claude_vision_analysis(['base64_image'], 'Describe the image', 'text', stream=True, use_cache=True)
+
+        assert first == second == 'Cached response'
+        assert ''.join([chunk async for chunk in streamed]) == 'Cached response'
+        assert mock_client.return_value.post.await_count == 1
+        assert cache.hits == 2
+
+@pytest.mark.asyncio
+async def test_claude_vision_analysis_sets_media_type():
+    with patch('claude_vision.claude_integration.get_client') as mock_client:
+        mock_response = MagicMock()
+        mock_response.json.return_value = {'content': [{'text': 'ok'}]}
+        mock_client.return_value.post = AsyncMock(return_value=mock_response)
+
+        await claude_vision_analysis(['/9j/4AAQSkZJRg', 'iVBORw0KGgo', 'UklGRh4AAABXRUJQ'], 'Describe', 'text')
+
+        body = mock_client.return_value.post.await_args.kwargs['content']
+        content = json.loads(b''.join(body.chunks()))['messages'][0]['content']
+        assert [block['source']['media_type'] for block in content[1:]] == ['image/jpeg', 'image/png', 'image/webp']
+
+def test_cached_content_puts_stable_blocks_before_breakpoints():
+    content = cached_content(['iVBORw0KGgoA', 'iVBORw0KGgoB', 'iVBORw0KGgoC'], "Frames 3-4.", cached_images=1, prompt_prefix="Describe each frame.")
+
+    assert [block['type'] for block in content] == ['text', 'image', 'image', 'image', 'text']
+    assert content[0]['text'] == "Describe each frame."
+    assert content[1]['source']['data'] == 'iVBORw0KGgoA'
+    assert [index for index, block in enumerate(content) if 'cache_control' in block] == [0, 1]
+    assert content[-1] == {"type": "text", "text": "Frames 3-4."}
+
+def test_warn_if_uncacheable_checks_the_minimum_prefix(caplog):
+    assert not warn_if_uncacheable('text', None, "Describe each frame.")
+    assert "below the 1024-token minimum" in caplog.text
+    assert warn_if_uncacheable('text', "x" * 4 * PROMPT_CACHE_MIN_TOKENS)
@@ -39,4 +39,50 @@ def test_alt_text_command(runner):
 def test_config_command(runner):
     result = runner.invoke(cli, ['config'])
     assert result.exit_code == 0
-    assert 'ANTHROPIC_API_KEY' in result.output
\ No newline at end of file
+    assert 'ANTHROPIC_API_KEY' in result.output
+
+def test_analyze_video_ndjson_writes_one_line_per_frame(runner, sample_video):
+    import json
+    from unittest.mock import patch, AsyncMock
+    path = sample_video
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='{"objects": []}')) as mock_analysis:
+        result = runner.invoke(cli, ['analyze', path, '--output', 'ndjson', '--frame-interval', '10', '--no-checkpoint', '--no-progress'])
+
+    assert result.exit_code == 0
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert [line['frame_number'] for line in lines] == [0, 10, 20]
+    assert lines[1] == {'frame_number': 10, 'timestamp': pytest.approx(1.0), 'result': {'objects': []}}
+    assert mock_analysis.await_args.args[2] == 'json'
+
+def test_analyze_image_directory_in_chunks(runner, tmp_path):
+    import json
+    from PIL import Image
+    from unittest.mock import patch, AsyncMock
+    for i in range(5):
+        Image.new('RGB', (16, 16), (i * 40, 0, 0)).save(tmp_path / f"image-{i}.png")
+
+    with patch('claude_vision.image_sets.claude_vision_analysis', AsyncMock(return_value='{"description": "ok"}')) as mock_analysis:
+        result = runner.invoke(cli, ['analyze', str(tmp_path), '--chunk-size', '2', '--output', 'json'])
+
+    assert result.exit_code == 0
+    records = json.loads(result.output)
+    assert [record['files'] for record in records] == [
+        [str(tmp_path / f"image-{i}.png") for i in chunk] for chunk in [(0, 1), (2, 3), (4,)]
+    ]
+    assert all(record['result'] == {"description": "ok"} for record in records)
+    assert mock_analysis.await_count == 3
+
+@pytest.mark.parametrize('path', ['missing.jpg', 'missing.mp4', 'missing/*.png', ''])
+def test_analyze_rejects_missing_inputs(runner, tmp_path, path):
+    # '' is tmp_path itself, a directory without images
+    result = runner.invoke(cli, ['analyze', str(tmp_path / path)])
+    assert result.exit_code == 2
+
+@pytest.mark.parametrize('options', [['--chunk-size', '2', '--stream'], ['--chunk-size', '2', '--dedup-threshold', '4'], ['--as-completed']])
+def test_analyze_rejects_options_chunks_would_ignore(runner, tmp_path, options):
+    from PIL import Image
+    for i in range(3):
+        Image.new('RGB', (16, 16)).save(tmp_path / f"image-{i}.png")
+    result = runner.invoke(cli, ['analyze', str(tmp_path), *options])
+    assert result.exit_code == 2
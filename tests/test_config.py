@@ -65,4 +65,13 @@ def test_config_update():
         del CONFIG["TEST_UPDATE_KEY"]
     else:
         CONFIG["TEST_UPDATE_KEY"] = original_value
-    save_config(CONFIG)
\ No newline at end of file
+    save_config(CONFIG)
+
+def test_load_config_is_memoized(temp_config_file):
+    save_config({"KEY": "first"})
+    assert load_config() == {"KEY": "first"}
+    # Edits made behind our back aren't seen until the next save_config
+    temp_config_file.write_text("KEY: second\n")
+    assert load_config() == {"KEY": "first"}
+    save_config({"KEY": "third"})
+    assert load_config() == {"KEY": "third"}
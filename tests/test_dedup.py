@@ -0,0 +1,34 @@
+import io
+import base64
+import numpy as np
+from PIL import Image
+from claude_vision.dedup import difference_hash, hamming_distance, FrameDeduplicator, dedupe_base64_images
+
+def gradient(flip=False, noise=0):
+    row = np.linspace(0, 255, 160)
+    if flip:
+        row = row[::-1]
+    image = np.tile(row, (120, 1))
+    image = image + np.random.default_rng(1).normal(0, noise, image.shape) if noise else image
+    return np.stack([np.clip(image, 0, 255).astype(np.uint8)] * 3, axis=-1)
+
+def encode(array):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def test_difference_hash_is_stable_under_noise():
+    assert hamming_distance(difference_hash(gradient()), difference_hash(gradient(noise=3))) <= 4
+    assert hamming_distance(difference_hash(gradient()), difference_hash(gradient(flip=True))) > 32
+
+def test_frame_deduplicator_collapses_onto_reference():
+    deduplicator = FrameDeduplicator(threshold=4)
+    hashes = [0b0000, 0b0001, 0b0011, 0xFFFF, 0xFFFE]
+    assert [deduplicator.check(i, h) for i, h in enumerate(hashes)] == [None, 0, 0, None, 3]
+    assert deduplicator.skipped == 3
+
+def test_dedupe_base64_images():
+    images = [encode(gradient()), encode(gradient(noise=3)), encode(gradient(flip=True))]
+    kept, duplicate_of = dedupe_base64_images(images, threshold=5)
+    assert kept == [images[0], images[2]]
+    assert duplicate_of == {1: 0}
@@ -0,0 +1,24 @@
+import asyncio
+import pytest
+from claude_vision import http_client
+
+@pytest.mark.asyncio
+async def test_get_client_is_shared():
+    try:
+        client = http_client.get_client()
+        assert http_client.get_client() is client
+    finally:
+        await http_client.close_client()
+    assert client.is_closed
+
+def test_get_client_recreated_per_loop():
+    async def fetch():
+        return http_client.get_client()
+
+    first = asyncio.run(fetch())
+    second = asyncio.run(fetch())
+    assert first is not second
+
+def test_configure_client_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        http_client.configure_client(pool_size=5)
@@ -59,4 +59,101 @@ async def test_process_invalid_image():
 async def test_process_too_many_images():
     image_paths = [os.path.join(TEST_IMAGE_DIR, 'sample.jpg')] * 21
     with pytest.raises(InvalidRequestError):
-        await process_multiple_images(image_paths)
\ No newline at end of file
+        await process_multiple_images(image_paths)
+
+@pytest.mark.asyncio
+async def test_process_image_source_uses_image_cache(tmp_path):
+    from unittest.mock import patch
+    from claude_vision import image_processing
+    from claude_vision.cache import DiskCache
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    image_path = tmp_path / "red.png"
+    Image.new('RGB', (64, 64), 'red').save(image_path)
+
+    with patch('claude_vision.image_processing.get_image_cache', return_value=cache), \
+         patch('claude_vision.image_processing.open_image', wraps=image_processing.open_image) as mock_open:
+        first = await process_image_source(str(image_path), None)
+        second = await process_image_source(str(image_path), None)
+        assert first == second
+        assert mock_open.call_count == 1
+        assert cache.hits == 1
+
+        # Rewriting the file changes its identity and invalidates the entry
+        Image.new('RGB', (32, 32), 'blue').save(image_path)
+        os.utime(image_path, ns=(0, 10 ** 9))
+        third = await process_image_source(str(image_path), None)
+        assert third != first
+        assert mock_open.call_count == 2
+
+def photo_like_image(size=(256, 256)):
+    import numpy as np
+    noise = np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    return Image.fromarray(noise).resize((size[0] * 2, size[1] * 2), Image.BILINEAR)
+
+@pytest.mark.parametrize("image_format,prefix", [("png", "iVBORw0KGgo"), ("jpeg", "/9j/"), ("webp", "UklGR")])
+def test_convert_image_to_base64_formats(image_format, prefix):
+    assert convert_image_to_base64(Image.new('RGBA', (32, 32), 'red'), image_format=image_format).startswith(prefix)
+
+def test_encode_image_auto_picks_smaller_lossy_format():
+    from claude_vision.image_processing import encode_image
+    image = photo_like_image()
+    png, _ = encode_image(image, 'png')
+    data, chosen = encode_image(image, 'auto')
+    assert chosen in ('jpeg', 'webp')
+    assert len(data) < len(png)
+
+def test_encode_image_respects_byte_budget():
+    from claude_vision.image_processing import encode_image
+    image = photo_like_image()
+    unbounded, _ = encode_image(image, 'jpeg', quality=95)
+    bounded, _ = encode_image(image, 'jpeg', quality=95, byte_budget=len(unbounded) * 2 // 3)
+    assert len(bounded) <= len(unbounded) * 2 // 3
+
+@pytest.mark.asyncio
+async def test_process_multiple_images_fits_token_budget(tmp_path):
+    from claude_vision.rate_limit import estimate_base64_image_tokens
+    paths = []
+    for i, size in enumerate([(1600, 1200), (800, 800), (100, 100)]):
+        path = tmp_path / f"{i}.png"
+        Image.new('RGB', size, 'red').save(path)
+        paths.append(str(path))
+    base64_images = await process_multiple_images(paths, token_budget=1200, text_tokens=200)
+    tokens = [estimate_base64_image_tokens(image) for image in base64_images]
+    assert sum(tokens) <= 1000
+    assert tokens[2] == (100 * 100) // 750
+
+@pytest.mark.asyncio
+async def test_process_image_source_runs_off_event_loop(tmp_path):
+    import threading
+    from unittest.mock import patch
+    from claude_vision import image_processing
+    path = tmp_path / "red.png"
+    Image.new('RGB', (64, 64), 'red').save(path)
+    threads = []
+    original = image_processing.prepare_image
+
+    def prepare(*args):
+        threads.append(threading.get_ident())
+        return original(*args)
+
+    with patch('claude_vision.image_processing.prepare_image', prepare):
+        await process_image_source(str(path), None, use_cache=False)
+    assert threads and threads[0] != threading.get_ident()
+
+@pytest.mark.asyncio
+async def test_process_pool_matches_thread_pool(tmp_path):
+    from claude_vision.image_processing import configure_image_executor
+    paths = []
+    for i, color in enumerate(['red', 'green', 'blue']):
+        path = tmp_path / f"{i}.png"
+        Image.new('RGB', (2000, 1000), color).save(path)
+        paths.append(str(path))
+    try:
+        configure_image_executor(kind='process', workers=2)
+        from_processes = [await process_image_source(path, None, use_cache=False) for path in paths]
+    finally:
+        configure_image_executor(kind='thread', workers=0)
+    from_threads = [await process_image_source(path, None, use_cache=False) for path in paths]
+    assert from_processes == from_threads
+    with pytest.raises(ValueError):
+        configure_image_executor(kind='fibre')
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from PIL import Image
+from unittest.mock import patch, AsyncMock
+from claude_vision.image_sets import iter_image_set_results, chunked, plan_chunks
+from claude_vision.utils import expand_image_paths, generate_prompt
+from claude_vision.planner import image_tokens
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+def test_plan_chunks_splits_by_token_budget(tmp_path):
+    paths = []
+    for i in range(6):
+        paths.append(str(tmp_path / f"image-{i}.png"))
+        Image.new('RGB', (1000, 750)).save(paths[-1])
+
+    fixed = list(plan_chunks(paths, 4))
+    assert [[source for source, _ in chunk] for chunk in fixed] == [paths[:4], paths[4:]]
+    # 1000 tokens per image at full size, at least 400 each: two images per 1000-token request
+    planned = list(plan_chunks(iter(paths), 4, token_budget=1000))
+    assert [[source for source, _ in chunk] for chunk in planned] == [paths[0:2], paths[2:4], paths[4:6]]
+    assert all(sum(image_tokens(size) for _, size in chunk) <= 1000 for chunk in planned)
+
+def test_expand_image_paths(tmp_path):
+    for name in ['b.png', 'a.jpg', 'notes.txt']:
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'nested' / 'c.png').write_bytes(b'')
+
+    assert expand_image_paths([str(tmp_path)]) == [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.png')]
+    assert expand_image_paths([str(tmp_path / '**' / '*.png')]) == [str(tmp_path / 'b.png'), str(tmp_path / 'nested' / 'c.png')]
+    assert expand_image_paths(['https://example.com/a.png']) == ['https://example.com/a.png']
+    with pytest.raises(ValueError):
+        expand_image_paths([str(tmp_path / 'missing.png')])
+
+@pytest.mark.asyncio
+async def test_results_come_back_in_input_order_or_as_completed():
+    async def analysis(base64_images, prompt, output, **kwargs):
+        # Later chunks finish first
+        await asyncio.sleep(0.01 * (10 - int(base64_images[0][6:-4])))
+        return f"{len(base64_images)} images from {base64_images[0]}"
+
+    sources = [f"image-{i}.png" for i in range(7)]
+    with patch('claude_vision.image_sets.prepare_planned_images', AsyncMock(side_effect=lambda chunk: [source for source, _ in chunk])), \
+         patch('claude_vision.image_sets.claude_vision_analysis', side_effect=analysis):
+        ordered = [record async for record in iter_image_set_results(sources, 'text', chunk_size=3, concurrency=3)]
+        completed = [record async for record in iter_image_set_results(sources, 'text', chunk_size=3, concurrency=3, ordered=False)]
+
+    assert ordered == [
+        {"index": 0, "files": sources[0:3], "result": "3 images from image-0.png"},
+        {"index": 1, "files": sources[3:6], "result": "3 images from image-3.png"},
+        {"index": 2, "files": sources[6:], "result": "1 images from image-6.png"},
+    ]
+    assert [record['index'] for record in completed] == [2, 1, 0]
+
+@pytest.mark.asyncio
+async def test_chunks_get_the_persona_prompt_for_their_size():
+    with patch('claude_vision.image_sets.prepare_planned_images', AsyncMock(side_effect=lambda chunk: [source for source, _ in chunk])), \
+         patch('claude_vision.image_sets.claude_vision_analysis', AsyncMock(return_value="ok")) as mock_analysis:
+        records = [record async for record in iter_image_set_results(['a.png', 'b.png', 'c.png'], 'text', chunk_size=2, multi_angle=True)]
+
+    assert len(records) == 2
+    assert [call.args[1] for call in mock_analysis.await_args_list] == [
+        generate_prompt(None, True, False, 2), generate_prompt(None, True, False, 1)
+    ]
+
+@pytest.mark.asyncio
+async def test_failed_chunk_does_not_stop_the_others():
+    async def analysis(base64_images, prompt, output, **kwargs):
+        if 'image-1.png' in base64_images:
+            raise ValueError("bad image")
+        return '{"description": "ok"}'
+
+    with patch('claude_vision.image_sets.prepare_planned_images', AsyncMock(side_effect=lambda chunk: [source for source, _ in chunk])), \
+         patch('claude_vision.image_sets.claude_vision_analysis', side_effect=analysis):
+        records = [record async for record in iter_image_set_results([f"image-{i}.png" for i in range(3)], 'json', chunk_size=1)]
+
+    assert [record.get('error') for record in records] == [None, "bad image", None]
+    assert records[0]['result'] == {"description": "ok"}
+
+@pytest.mark.asyncio
+async def test_only_concurrency_chunks_are_read_ahead():
+    read = []
+    in_flight = 0
+    most_in_flight = 0
+
+    def sources():
+        for i in range(40):
+            read.append(i)
+            yield Image.new('RGB', (8, 8))
+
+    async def analysis(base64_images, prompt, output, **kwargs):
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return "ok"
+
+    with patch('claude_vision.image_sets.prepare_planned_images', AsyncMock(side_effect=lambda chunk: ['x'] * len(chunk))), \
+         patch('claude_vision.image_sets.claude_vision_analysis', side_effect=analysis):
+        records = iter_image_set_results(sources(), 'text', chunk_size=4, concurrency=2)
+        first = await records.__anext__()
+        # Two chunks in flight, two queued and the one being put: nowhere near all 40 images
+        assert len(read) <= 4 * 5
+        rest = [record async for record in records]
+
+    assert first['files'] == [None] * 4
+    assert len(rest) == 9
+    assert most_in_flight <= 2
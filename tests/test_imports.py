@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def run_python(code, home):
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+
+def test_cli_import_skips_video_and_schema_dependencies(tmp_path):
+    output = run_python(
+        "import sys, claude_vision.cli; print(sorted(m for m in ('cv2', 'numpy', 'jsonschema') if m in sys.modules))",
+        tmp_path
+    )
+    assert output.strip() == '[]'
+
+def test_cli_import_skips_image_and_http_dependencies(tmp_path):
+    output = run_python(
+        "import sys, claude_vision.cli; print(sorted(m for m in ('PIL', 'httpx') if m in sys.modules))",
+        tmp_path
+    )
+    assert output.strip() == '[]'
+
+def test_config_import_does_not_write(tmp_path):
+    output = run_python("import claude_vision.config as c; print(c.MAX_IMAGE_SIZE)", tmp_path)
+    assert output.strip() == '(1568, 1568)'
+    assert not (tmp_path / '.config').exists()
+
+def test_package_attributes_load_lazily(tmp_path):
+    output = run_python(
+        "import sys, claude_vision; assert 'claude_vision.image_processing' not in sys.modules; "
+        "print(claude_vision.process_image_source.__module__)",
+        tmp_path
+    )
+    assert output.strip() == 'claude_vision.image_processing'
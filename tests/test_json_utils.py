@@ -0,0 +1,52 @@
+import json
+import pytest
+from claude_vision.json_utils import (
+    format_frame_result, format_video_json_output, get_validator, dumps, json_backend,
+    JSONBody, VIDEO_FRAME_SCHEMA, SPLICE_MIN_CHARS
+)
+
+def test_validators_are_compiled_once():
+    assert get_validator(VIDEO_FRAME_SCHEMA) is get_validator(VIDEO_FRAME_SCHEMA)
+
+def test_format_frame_result_validates_each_frame():
+    frame = {'frame_number': 5, 'timestamp': 0.5, 'result': '{"objects": ["boat"]}', 'duplicate_of': 0}
+    assert format_frame_result(frame) == {'frame_number': 5, 'timestamp': 0.5, 'result': {'objects': ['boat']}, 'duplicate_of': 0}
+    with pytest.raises(ValueError, match="Frame 5"):
+        format_frame_result({**frame, 'result': '[1, 2]'})
+
+def test_format_video_json_output():
+    frames = [{'frame_number': i, 'timestamp': i / 10, 'result': 'a frame'} for i in range(3)]
+    output = format_video_json_output({'fps': 10.0, 'frame_count': 3}, frames, 'video_description')
+    assert [frame['frame_number'] for frame in output['frame_results']] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        format_video_json_output({'fps': 'fast'}, frames, 'video_description')
+
+@pytest.mark.parametrize("backend", ["json", "orjson"])
+def test_dumps_backends_agree(backend):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    value = {'result': {'description': 'café ☕', 'count': 3, 'ratio': 0.25}, 'frames': [1, None, True]}
+    assert json.loads(dumps(value, backend=backend)) == value
+    assert json.loads(dumps(value, indent=2, backend=backend)) == value
+    assert 'café ☕' in dumps(value, backend=backend)
+
+def test_json_backend():
+    assert json_backend('json') == 'json'
+    assert json_backend('auto') in ('json', 'orjson')
+    with pytest.raises(ValueError):
+        json_backend('ujson')
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('options', [{}, {'sort_keys': True}, {'separators': (',', ':')}])
+async def test_json_body_matches_json_dumps(options):
+    image = 'iVBORw0KGgo' + 'A/+' * SPLICE_MIN_CHARS
+    value = {'messages': [{'content': [{'type': 'image', 'source': {'data': image}}, {'type': 'text', 'text': 'Caf\u00e9 "menu" ' * 1000}]}], 'max_tokens': 10}
+    body = JSONBody(value, **options)
+
+    expected = json.dumps(value, **options).encode('utf-8')
+    assert b''.join(body.chunks()) == expected
+    assert len(body) == len(expected)
+    # Async iteration can be repeated, e.g. when a request is retried
+    assert b''.join([chunk async for chunk in body]) == b''.join([chunk async for chunk in body]) == expected
+    # The image is spliced in from the original string rather than copied into the skeleton
+    assert any(part is image for part in body.parts)
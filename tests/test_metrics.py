@@ -0,0 +1,82 @@
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+from claude_vision.metrics import Metrics, get_metrics, span, call_with_spans, RESERVOIR_SIZE
+
+def test_summary_reports_stage_timings_and_counters():
+    metrics = Metrics()
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        metrics.record('video.decode', seconds)
+    metrics.count('requests', 2)
+
+    summary = metrics.summary()
+    assert summary['stages']['video.decode'] == {
+        'count': 4, 'total_ms': 1000.0, 'mean_ms': 250.0, 'p50_ms': 300.0, 'p95_ms': 400.0, 'max_ms': 400.0
+    }
+    assert summary['counters'] == {'requests': 2}
+
+def test_reservoir_is_bounded():
+    metrics = Metrics()
+    for i in range(RESERVOIR_SIZE * 3):
+        metrics.record('image.encode', i / 1000)
+    timer = metrics.stages['image.encode']
+    assert timer.count == RESERVOIR_SIZE * 3
+    assert len(timer.samples) == RESERVOIR_SIZE
+
+def test_prometheus_and_openmetrics_exposition():
+    metrics = Metrics()
+    metrics.record('request.total', 0.5)
+    metrics.count('input_tokens', 1200)
+
+    text = metrics.prometheus()
+    assert '# TYPE claude_vision_stage_seconds summary' in text
+    assert 'claude_vision_stage_seconds{stage="request.total",quantile="0.95"} 0.500000' in text
+    assert 'claude_vision_stage_seconds_count{stage="request.total"} 1' in text
+    assert '# TYPE claude_vision_input_tokens_total counter\nclaude_vision_input_tokens_total 1200\n' in text
+    assert not text.endswith('# EOF\n')
+
+    openmetrics = metrics.prometheus(openmetrics=True)
+    assert '# TYPE claude_vision_input_tokens counter\n' in openmetrics
+    assert openmetrics.endswith('# EOF\n')
+
+def test_prometheus_counters_are_exact():
+    metrics = Metrics()
+    metrics.count('input_tokens', 123_456_789)
+    metrics.count('cost_dollars', 0.125)
+    text = metrics.prometheus()
+    assert 'claude_vision_input_tokens_total 123456789\n' in text
+    assert 'claude_vision_cost_dollars_total 0.125\n' in text
+
+def recording_worker(value):
+    with span('worker.step'):
+        return value * 2
+
+def test_call_with_spans_ships_spans_back_from_a_process():
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        result, spans = executor.submit(call_with_spans, recording_worker, 21).result()
+    assert result == 42
+    assert [stage for stage, _ in spans] == ['worker.step']
+
+@pytest.mark.asyncio
+async def test_requests_record_ttfb_total_and_usage():
+    from claude_vision.claude_integration import claude_vision_analysis
+    from claude_vision.http_client import close_client
+    from claude_vision.mock_server import MockAnthropicServer
+
+    get_metrics().reset()
+    with MockAnthropicServer(latency=0.01) as server:
+        with patch('claude_vision.claude_integration.ANTHROPIC_API_URL', server.url):
+            try:
+                await claude_vision_analysis([], "Describe this.", 'text')
+                stream = await claude_vision_analysis([], "Describe this.", 'text', stream=True)
+                [chunk async for chunk in stream]
+            finally:
+                await close_client()
+
+    summary = get_metrics().summary()
+    assert summary['stages']['request.total']['count'] == 2
+    assert summary['stages']['request.ttfb']['count'] == 2
+    assert summary['stages']['request.ttfb']['p50_ms'] >= 10
+    assert summary['stages']['request.ttft']['count'] == 1
+    assert summary['counters']['requests'] == 2
+    assert summary['counters']['output_tokens'] == 10
@@ -0,0 +1,72 @@
+import pytest
+from unittest.mock import patch
+from claude_vision.claude_integration import claude_vision_analysis
+from claude_vision.http_client import close_client
+from claude_vision.metrics import get_metrics
+from claude_vision.mock_server import MockAnthropicServer
+
+@pytest.fixture
+def server():
+    with MockAnthropicServer() as server:
+        with patch('claude_vision.claude_integration.ANTHROPIC_API_URL', server.url):
+            yield server
+
+@pytest.mark.asyncio
+async def test_mock_server_answers_messages(server):
+    try:
+        text = await claude_vision_analysis(['iVBORw0KGgo' + 'A' * 100], "Describe this.", 'text')
+        json_text = await claude_vision_analysis([], "Describe this.", 'json')
+    finally:
+        await close_client()
+
+    assert text == "Mock analysis of 1 image."
+    assert json_text == '{ "description": "Mock analysis of 0 images."}'
+    assert server.status_counts == {200: 2}
+    assert server.requests[0]['messages'][0]['content'][1]['type'] == 'image'
+
+@pytest.mark.asyncio
+async def test_mock_server_streams_sse(server):
+    try:
+        stream = await claude_vision_analysis([], "Describe this.", 'text', stream=True)
+        chunks = [chunk async for chunk in stream]
+    finally:
+        await close_client()
+
+    assert len(chunks) == 5
+    assert ''.join(chunks) == "Mock analysis of 0 images."
+
+@pytest.mark.asyncio
+async def test_injected_errors_are_retried():
+    with MockAnthropicServer(rate_limit_rate=0.3, overload_rate=0.3, seed=1) as server:
+        with patch('claude_vision.claude_integration.ANTHROPIC_API_URL', server.url):
+            try:
+                results = [await claude_vision_analysis([], "Describe this.", 'text') for _ in range(5)]
+            finally:
+                await close_client()
+
+    assert results == ["Mock analysis of 0 images."] * 5
+    assert server.status_counts[200] == 5
+    assert server.status_counts.get(429, 0) + server.status_counts.get(529, 0) > 0
+
+@pytest.mark.asyncio
+async def test_prompt_cache_reads_repeated_prefixes():
+    image = 'iVBORw0KGgo' + 'A' * 4000
+    metrics = get_metrics()
+    usages = []
+    with MockAnthropicServer(min_cache_tokens=0) as server:
+        with patch('claude_vision.claude_integration.ANTHROPIC_API_URL', server.url):
+            try:
+                for prompt in ("What is in it?", "What colour is it?"):
+                    metrics.reset()
+                    await claude_vision_analysis([image], prompt, 'text', system="You are terse.", prompt_cache=True, cached_images=1, use_cache=False)
+                    usages.append(dict(metrics.counters))
+            finally:
+                await close_client()
+                metrics.reset()
+
+    first, second = usages
+    assert server.requests[0]['system'][0]['cache_control'] == {'type': 'ephemeral'}
+    assert 'cache_read_input_tokens' not in first and first['cache_creation_input_tokens'] > 0
+    # The system prompt and image were written by the first request; only the question is new
+    assert second['cache_read_input_tokens'] == first['cache_creation_input_tokens']
+    assert 'cache_creation_input_tokens' not in second
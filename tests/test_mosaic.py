@@ -0,0 +1,79 @@
+import io
+import json
+import base64
+import numpy as np
+import pytest
+from PIL import Image
+from unittest.mock import patch, AsyncMock
+from claude_vision.mosaic import grid_shape, mosaic_layout, canvas_size, make_tile, build_mosaic, mosaic_prompt, split_mosaic_result
+from claude_vision.planner import image_tokens
+from claude_vision.rate_limit import estimate_request_tokens
+from claude_vision.video_processing import process_video_frames, plan_mosaic_layout
+
+def test_grid_shape_is_close_to_square():
+    assert grid_shape(9, (640, 480)) == (3, 3)
+    assert grid_shape(16, (1920, 1080)) == (3, 6)
+    assert grid_shape(2, (100, 100)) in ((1, 2), (2, 1))
+
+def test_mosaic_layout_fits_image_limits():
+    columns, rows, tile_size = mosaic_layout((1920, 1080), 12)
+    assert columns * rows >= 12
+    width, height = canvas_size(columns, rows, tile_size)
+    assert width <= 1568 and height <= 1568
+    assert image_tokens((width, height)) <= 1600
+    assert abs(tile_size[0] / tile_size[1] - 16 / 9) < 0.05
+
+def test_plan_mosaic_layout_fits_token_budget():
+    columns, rows, tile_size = plan_mosaic_layout((1920, 1080), 12, prompt="Count the boats.", token_budget=800, last_frame=9000)
+    assert columns * rows >= 12
+    text = mosaic_prompt([9000] * 12, "Count the boats.", 'json')
+    assert image_tokens(canvas_size(columns, rows, tile_size)) + estimate_request_tokens([], text) <= 800
+    assert plan_mosaic_layout((1920, 1080), 12) == mosaic_layout((1920, 1080), 12)
+
+def test_build_mosaic_places_tiles_in_order():
+    frames = [np.full((48, 64, 3), value, dtype=np.uint8) for value in (50, 100, 150, 200)]
+    tiles = [make_tile(frame, (32, 24)) for frame in frames]
+    mosaic = build_mosaic(tiles, ['#0', '#1', '#2', '#3'], columns=2)
+    assert mosaic.size == canvas_size(2, 2, (32, 24))
+    # Bottom-right pixel of each tile is clear of its label
+    assert mosaic.getpixel((31, 23)) == (50, 50, 50)
+    assert mosaic.getpixel((32 + 4 + 31, 24 + 4 + 23)) == (200, 200, 200)
+
+def test_split_mosaic_result():
+    assert split_mosaic_result('{"0": "a", "10": {"x": 1}}', [0, 10]) == ["a", {"x": 1}]
+    assert split_mosaic_result('{"0": "a"}', [0, 10]) == ["a", '{"0": "a"}']
+    assert split_mosaic_result('not json', [0, 10]) == ['not json', 'not json']
+
+@pytest.mark.asyncio
+async def test_process_video_frames_mosaic_maps_results_per_frame():
+    frames = [
+        {'frame': np.zeros((48, 64, 3), dtype=np.uint8), 'frame_number': i * 10, 'timestamp': i * 1.0}
+        for i in range(7)
+    ]
+
+    async def analysis(images, prompt, output, stream, **kwargs):
+        numbers = prompt.split('frame numbers (')[1].split(')')[0].split(', ')
+        return json.dumps({number: f"frame {number}" for number in numbers})
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=analysis)) as mock_analysis:
+        results = await process_video_frames(frames, None, 'text', False, mosaic=4)
+
+    assert mock_analysis.await_count == 2
+    assert all(len(call.args[0]) == 1 for call in mock_analysis.await_args_list)
+    assert [result['result'] for result in results] == [f"frame {i * 10}" for i in range(7)]
+
+@pytest.mark.asyncio
+async def test_mosaic_is_laid_out_once_per_video():
+    frames = [
+        {'frame': np.zeros((1080, 1920, 3), dtype=np.uint8), 'frame_number': i, 'timestamp': i / 10}
+        for i in range(8)
+    ]
+    with patch('claude_vision.video_processing.mosaic_layout', side_effect=mosaic_layout) as mock_layout, \
+         patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='{}')) as mock_analysis:
+        await process_video_frames(frames, None, 'text', False, mosaic=4)
+
+    assert mock_layout.call_count == 1
+    columns, rows, tile_size = mosaic_layout((1920, 1080), 4)
+    for call in mock_analysis.await_args_list:
+        with Image.open(io.BytesIO(base64.b64decode(call.args[0][0]))) as image:
+            assert image.size == canvas_size(columns, rows, tile_size)
@@ -0,0 +1,37 @@
+from claude_vision.planner import (
+    image_tokens, fit_to_tokens, allocate_tokens, pack_requests, plan_requests, plan_uniform_requests
+)
+
+def test_fit_to_tokens_keeps_aspect_ratio_and_never_upscales():
+    width, height = fit_to_tokens((4000, 2000), 500)
+    assert image_tokens((width, height)) <= 500
+    assert abs(width / height - 2) < 0.01
+    assert fit_to_tokens((100, 50), 5000) == (100, 50)
+
+def test_allocate_tokens_gives_unused_share_to_larger_images():
+    assert allocate_tokens([100, 1600, 1600], 2000) == [100, 950, 950]
+    assert allocate_tokens([100, 200], 2000) == [100, 200]
+
+def test_pack_requests_uses_fewest_balanced_groups():
+    groups = pack_requests([400] * 9, 1600)
+    assert len(groups) == 3
+    assert [len(group) for group in groups] == [3, 3, 3]
+    assert [i for group in groups for i in group] == list(range(9))
+    assert pack_requests([10] * 25, 10 ** 6, max_images=20) == [list(range(12)), list(range(12, 25))]
+
+def test_plan_requests_fits_budget():
+    sizes = [(3000, 2000), (800, 600), (200, 200), (4000, 3000)]
+    plan = plan_requests(sizes, 2000, min_tokens=400, text_tokens=100)
+    assert [index for group in plan for index, _ in group] == [0, 1, 2, 3]
+    for group in plan:
+        assert sum(image_tokens(size) for _, size in group) <= 1900
+    # The small image is sent at full size
+    assert dict(pair for group in plan for pair in group)[2] == (200, 200)
+
+def test_plan_uniform_requests():
+    per_request, size = plan_uniform_requests((1920, 1080), 4000, min_tokens=400)
+    assert per_request == 10
+    assert image_tokens(size) <= 400
+    per_request, size = plan_uniform_requests((1920, 1080), 4000, max_images=1)
+    assert per_request == 1
+    assert image_tokens(size) <= 1600
@@ -0,0 +1,89 @@
+import json
+import numpy as np
+import pytest
+from PIL import Image
+from unittest.mock import patch, AsyncMock
+from claude_vision.preflight import (
+    estimate_cost, summarize_requests, affordable_requests, plan_image_job, plan_video_job, plan_batch_job
+)
+from claude_vision.video_processing import analyze_video
+
+@pytest.fixture
+def sample_video(make_video):
+    # Three runs of ten identical frames, so deduplication keeps one frame per run
+    gradient = np.tile(np.linspace(0, 255, 640, dtype=np.uint8), (480, 1))
+    stripes = np.tile((np.arange(640) // 40 % 2 * 255).astype(np.uint8), (480, 1))
+    runs = [gradient, gradient[:, ::-1], stripes]
+    return make_video(size=(640, 480), frame=lambda i: np.stack([runs[i // 10]] * 3, axis=-1))
+
+def test_summarize_and_limit_requests():
+    requests = [(1000, 500), None, (2000, 500)]
+    summary = summarize_requests(requests)
+    assert summary['requests'] == 2
+    assert summary['input_tokens'] == 3000
+    assert summary['max_input_tokens_per_request'] == 2000
+    assert summary['cost'] == pytest.approx(estimate_cost(3000, 1000))
+    assert affordable_requests(requests) == 3
+    assert affordable_requests(requests, max_tokens_total=1500) == 2
+    assert affordable_requests(requests, max_cost=0) == 0
+
+def test_plan_image_job_matches_resized_tokens(tmp_path):
+    path = tmp_path / "large.png"
+    Image.new('RGB', (3000, 2000), 'red').save(path)
+    [(input_tokens, output_tokens)] = plan_image_job([str(path)], "Describe", max_tokens=300)
+    assert 1500 < input_tokens <= 1610
+    assert output_tokens == 300
+    [(budgeted, _)] = plan_image_job([str(path)], "Describe", token_budget=500)
+    assert budgeted <= 500
+
+def test_plan_video_job(sample_video):
+    requests, starts = plan_video_job(sample_video, 5)
+    assert len(requests) == 6
+    assert starts == [0, 1, 2, 3, 4, 5]
+    grouped, _ = plan_video_job(sample_video, 5, process_as_group=True)
+    assert len(grouped) == 1
+    # Frames come in three runs of identical content
+    deduped, starts = plan_video_job(sample_video, 5, dedup_threshold=0)
+    assert starts == [0, 2, 4]
+
+@pytest.mark.asyncio
+async def test_analyze_video_max_frames(sample_video):
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='frame result')) as mock_analysis:
+        _, results = await analyze_video(sample_video, 5, None, 'text', False, max_frames=2)
+    assert [result['frame_number'] for result in results] == [0, 5]
+    assert mock_analysis.await_count == 2
+
+def test_plan_batch_job_skips_completed_entries(tmp_path):
+    image = tmp_path / "a.png"
+    Image.new('RGB', (100, 100), 'red').save(image)
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join(json.dumps(entry) for entry in [
+        {"id": 1, "files": str(image)},
+        {"id": 2, "files": str(image), "max_tokens": 50},
+        {"id": 3, "files": str(tmp_path / "missing.png")},
+    ]))
+    output = tmp_path / "results.jsonl"
+    output.write_text('{"id": 1, "result": "done"}\n')
+    requests = plan_batch_job(str(manifest), str(output))
+    assert len(requests) == 2
+    assert requests[0][1] == 50
+    assert requests[1] is None
+
+def test_plan_image_job_estimates_one_request_per_chunk(tmp_path):
+    paths = []
+    for i in range(5):
+        paths.append(str(tmp_path / f"image-{i}.png"))
+        Image.new('RGB', (200, 200)).save(paths[-1])
+    [single] = plan_image_job(paths, "Describe")
+    chunks = plan_image_job(paths, "Describe", chunk_size=2)
+    assert len(chunks) == 3
+    assert sum(input_tokens for input_tokens, _ in chunks) > single[0]
+
+def test_plan_image_job_chunks_by_token_budget(tmp_path):
+    paths = []
+    for i in range(4):
+        paths.append(str(tmp_path / f"image-{i}.png"))
+        Image.new('RGB', (1000, 750)).save(paths[-1])
+    requests = plan_image_job(paths, "Describe", token_budget=1200, chunk_size=20)
+    assert len(requests) == 2
+    assert all(input_tokens <= 1200 for input_tokens, _ in requests)
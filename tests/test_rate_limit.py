@@ -0,0 +1,71 @@
+import io
+import base64
+import httpx
+import pytest
+from PIL import Image
+from claude_vision.rate_limit import RequestScheduler, TokenBucket, estimate_base64_image_tokens, parse_retry_after
+
+def status_error(status_code, headers=None):
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"{status_code}", request=request, response=response)
+
+def failing_then_ok(errors):
+    calls = []
+
+    async def send():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+    return send, calls
+
+@pytest.mark.asyncio
+async def test_retries_overload_and_backs_off_concurrency():
+    scheduler = RequestScheduler(max_concurrency=8, max_retries=3)
+    send, calls = failing_then_ok([status_error(529, {"retry-after": "0"}), status_error(429, {"retry-after": "0"})])
+    assert await scheduler.run(send) == "ok"
+    assert len(calls) == 3
+    assert scheduler.concurrency.limit < 8
+
+@pytest.mark.asyncio
+async def test_retries_transport_errors(monkeypatch):
+    monkeypatch.setattr('claude_vision.rate_limit.RETRY_BASE_DELAY', 0)
+    scheduler = RequestScheduler(max_retries=2)
+    send, calls = failing_then_ok([httpx.ConnectError("reset"), status_error(502)])
+    assert await scheduler.run(send) == "ok"
+    assert scheduler.retries == 2
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    scheduler = RequestScheduler(max_retries=3)
+    send, calls = failing_then_ok([status_error(400)])
+    with pytest.raises(httpx.HTTPStatusError):
+        await scheduler.run(send)
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries():
+    scheduler = RequestScheduler(max_retries=1)
+    send, calls = failing_then_ok([status_error(429, {"retry-after": "0"})] * 3)
+    with pytest.raises(httpx.HTTPStatusError):
+        await scheduler.run(send)
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_token_bucket_clamps_oversized_requests():
+    bucket = TokenBucket(rate_per_minute=60)
+    await bucket.acquire(1000)
+    assert bucket.tokens == 0
+
+@pytest.mark.parametrize("image_format", ["PNG", "JPEG", "GIF", "WEBP"])
+def test_estimate_base64_image_tokens(image_format):
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 200), 'red').save(buffer, format=image_format)
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    assert estimate_base64_image_tokens(encoded) == (300 * 200) // 750
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+    assert parse_retry_after(None) is None
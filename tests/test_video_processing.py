@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from unittest.mock import patch, AsyncMock
+from claude_vision.video_processing import analyze_video, process_video_frames, iter_frame_results, iter_video_results
+
+def make_frames(count):
+    return [
+        {'frame': np.zeros((48, 64, 3), dtype=np.uint8), 'frame_number': i * 10, 'timestamp': i * 1.0}
+        for i in range(count)
+    ]
+
+@pytest.mark.asyncio
+async def test_analyze_video_streams_all_sampled_frames(sample_video):
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='frame result')) as mock_analysis:
+        metadata, results = await analyze_video(sample_video, 5, None, 'text', False)
+
+    assert metadata['frame_count'] == 30
+    assert [result['frame_number'] for result in results] == [0, 5, 10, 15, 20, 25]
+    assert [result['timestamp'] for result in results] == pytest.approx([0.0, 0.5, 1.0, 1.5, 2.0, 2.5])
+    assert mock_analysis.await_count == 6
+
+@pytest.mark.asyncio
+async def test_process_video_frames_groups_in_order():
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(return_value='group result')) as mock_analysis:
+        results = await process_video_frames(make_frames(45), None, 'text', False, batch_size=20, process_as_group=True, num_workers=3)
+
+    assert [result['frame_number'] for result in results] == [i * 10 for i in range(45)]
+    assert [len(call.args[0]) for call in mock_analysis.await_args_list] == [20, 20, 5]
+    assert mock_analysis.await_args_list[0].args[1].startswith("Analyze frames 0 to 190")
+
+@pytest.mark.asyncio
+async def test_process_video_frames_propagates_errors():
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=RuntimeError('boom'))):
+        with pytest.raises(RuntimeError):
+            await process_video_frames(make_frames(5), None, 'text', False)
+
+@pytest.mark.parametrize("strategy", ["sequential", "seek", "auto"])
+def test_iter_frames_strategies_sample_same_frames(sample_video, strategy):
+    from claude_vision.video_utils import iter_frames
+    frames = list(iter_frames(sample_video, 7, strategy))
+    assert [frame['frame_number'] for frame in frames] == [0, 7, 14, 21, 28]
+    # Each synthetic frame has a distinct brightness, so the right frame must have been decoded
+    assert [int(frame['frame'].mean()) // 8 for frame in frames] == pytest.approx([0, 7, 14, 21, 28], abs=1)
+
+def test_choose_decode_strategy():
+    from claude_vision.video_utils import choose_decode_strategy
+    assert choose_decode_strategy(5, gop_length=30) == 'sequential'
+    assert choose_decode_strategy(60, gop_length=30) == 'seek'
+    assert choose_decode_strategy(2, gop_length=1) == 'seek'
+
+@pytest.mark.asyncio
+async def test_process_video_frames_skips_near_duplicates():
+    frames = make_frames(6)
+    for frame in frames[3:]:
+        frame['frame'] = np.tile(np.linspace(255, 0, 64, dtype=np.uint8), (48, 1))[..., None].repeat(3, axis=2)
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=['scene one', 'scene two'])) as mock_analysis:
+        results = await process_video_frames(frames, None, 'text', False, dedup_threshold=2)
+
+    assert mock_analysis.await_count == 2
+    assert [result.get('duplicate_of') for result in results] == [None, 0, 0, None, 30, 30]
+    assert [result['result'] for result in results] == ['scene one'] * 3 + ['scene two'] * 3
+
+@pytest.mark.asyncio
+async def test_iter_frame_results_bounds_concurrency_and_keeps_order():
+    import asyncio
+    import random
+    in_flight = 0
+    peak = 0
+
+    async def analysis(images, prompt, output, stream, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Finish out of order
+        await asyncio.sleep(random.uniform(0, 0.01))
+        in_flight -= 1
+        return prompt
+
+    progress = []
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=analysis)):
+        results = [
+            result async for result in iter_frame_results(
+                make_frames(40), None, 'text', False, concurrency=6,
+                progress=lambda done, total: progress.append((done, total)), total_frames=40
+            )
+        ]
+
+    assert peak <= 6
+    assert [result['frame_number'] for result in results] == [i * 10 for i in range(40)]
+    assert progress[-1] == (40, 40)
+    assert [done for done, _ in progress] == list(range(1, 41))
+
+@pytest.mark.asyncio
+async def test_iter_video_results_yields_before_the_video_is_done(sample_video):
+    import asyncio
+    release = asyncio.Event()
+
+    async def analysis(images, prompt, output, stream, **kwargs):
+        if not prompt.startswith("Analyze frame 0 "):
+            await release.wait()
+        return prompt
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=analysis)):
+        results = iter_video_results(sample_video, 5, None, 'text', False)
+        first = await asyncio.wait_for(results.__anext__(), timeout=5)
+        release.set()
+        rest = [result async for result in results]
+
+    assert first['frame_number'] == 0
+    assert [result['frame_number'] for result in rest] == [5, 10, 15, 20, 25]
+
+@pytest.mark.asyncio
+async def test_streamed_frame_results_are_complete_text(sample_video):
+    async def chunks(*args, **kwargs):
+        async def stream():
+            for chunk in ['"scene"', ': 1}']:
+                yield chunk
+        return stream()
+
+    with patch('claude_vision.video_processing.claude_vision_analysis', AsyncMock(side_effect=chunks)):
+        _, results = await analyze_video(sample_video, 10, None, 'json', True)
+
+    assert [result['result'] for result in results] == ['{"scene": 1}'] * 3
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import pytest
+from unittest.mock import patch
+from claude_vision.watch import DirectoryWatcher, WatchLedger, run_watch
+
+def write(path, data=b'\x89PNG'):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+async def next_change(changes, timeout=5.0):
+    return await asyncio.wait_for(changes.__anext__(), timeout)
+
+@pytest.mark.asyncio
+async def test_once_analyzes_each_file_and_skips_the_ledger_on_restart(tmp_path):
+    directory = tmp_path / "inbox"
+    directory.mkdir()
+    for name in ['a.png', 'b.jpg', 'notes.txt', '.partial.png']:
+        write(directory / name)
+    output = str(tmp_path / "results.jsonl")
+    ledger = WatchLedger(str(tmp_path / "ledger.jsonl"))
+
+    async def analyze(entry, **kwargs):
+        if entry['files'][0].endswith('b.jpg'):
+            raise ValueError("bad image")
+        return "a description"
+
+    with patch('claude_vision.watch.analyze_entry', side_effect=analyze) as mock_analyze:
+        first = await run_watch(str(directory), output, ledger=ledger, settle=0, once=True)
+        second = await run_watch(str(directory), output, ledger=ledger, settle=0, once=True)
+
+    assert first == {'succeeded': 1, 'failed': 1}
+    # The failed file isn't in the ledger, so it's retried
+    assert second == {'succeeded': 0, 'failed': 1}
+    assert mock_analyze.call_count == 3
+    with open(output) as f:
+        records = [json.loads(line) for line in f]
+    assert {"file": str(directory / "a.png"), "result": "a description"} in records
+    assert list(ledger.load()) == [str(directory / "a.png")]
+
+@pytest.mark.asyncio
+async def test_files_are_reported_once_they_settle(tmp_path):
+    # Settling is timed with a fake clock, so scheduling delays can't make a file settle early
+    now = [0.0]
+    watcher = DirectoryWatcher(str(tmp_path), settle=10, poll_interval=0.01, use_inotify=False, clock=lambda: now[0])
+    changes = watcher.changes()
+    path = str(tmp_path / "photo.jpg")
+    write(path, b'x')
+    pending = asyncio.ensure_future(next_change(changes))
+    # Keep appending, each write well within the settle time: nothing is reported
+    for _ in range(5):
+        await asyncio.sleep(0.05)
+        assert not pending.done()
+        with open(path, 'ab') as f:
+            f.write(b'x')
+        now[0] += 6
+    for _ in range(100):
+        if pending.done():
+            break
+        await asyncio.sleep(0.02)
+        now[0] += 20
+    reported, signature = await pending
+    assert reported == path
+    assert signature[0] == 6
+
+    write(path, b'changed')
+    pending = asyncio.ensure_future(next_change(changes))
+    for _ in range(100):
+        if pending.done():
+            break
+        await asyncio.sleep(0.02)
+        now[0] += 20
+    assert await pending == (path, (7, os.stat(path).st_mtime_ns))
+    await changes.aclose()
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotify is Linux only")
+async def test_inotify_reports_new_and_renamed_files(tmp_path):
+    watcher = DirectoryWatcher(str(tmp_path), settle=0.05, poll_interval=60, use_inotify=True)
+    changes = watcher.changes()
+    pending = asyncio.ensure_future(next_change(changes))
+    await asyncio.sleep(0.05)
+    write(tmp_path / ".upload.tmp")
+    os.rename(tmp_path / ".upload.tmp", tmp_path / "upload.png")
+    assert (await pending)[0] == str(tmp_path / "upload.png")
+    await changes.aclose()
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotify is Linux only")
+async def test_inotify_watcher_is_idle_while_the_caller_holds_a_file(tmp_path):
+    watcher = DirectoryWatcher(str(tmp_path), settle=0, poll_interval=60, use_inotify=True)
+    changes = watcher.changes()
+    pending = asyncio.ensure_future(next_change(changes))
+    await asyncio.sleep(0.05)
+    write(tmp_path / "first.png")
+    await pending
+    # The caller is busy with the first file while more events queue up behind it
+    for i in range(3):
+        write(tmp_path / f"next-{i}.png")
+    started = time.process_time()
+    await asyncio.sleep(0.5)
+    assert time.process_time() - started < 0.1
+    assert (await next_change(changes))[0].startswith(str(tmp_path / "next-"))
+    await changes.aclose()
+
+def test_ledger_is_per_directory_and_output(tmp_path):
+    ledger = WatchLedger.for_watch("inbox", "a.jsonl", str(tmp_path))
+    assert ledger.path == WatchLedger.for_watch("./inbox", "a.jsonl", str(tmp_path)).path
+    assert ledger.path != WatchLedger.for_watch("inbox", "b.jsonl", str(tmp_path)).path
+    ledger.record("/inbox/a.png", (10, 1))
+    ledger.record("/inbox/a.png", (12, 2))
+    ledger.close()
+    with open(ledger.path, 'a') as f:
+        f.write('{"path": "/inbox/b.pn')
+    assert ledger.load() == {"/inbox/a.png": (12, 2)}